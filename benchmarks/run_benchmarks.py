@@ -0,0 +1,209 @@
+"""End-to-end benchmarks of the three pipelines on synthetic accounts, without credentials.
+
+Each pipeline runs in its own interpreter (so peak RSS is its own) inside a scratch
+directory, against the stand-in server (benchmarks/standin_server.py) or a recorded
+cassette, and the suite reports rows/sec, peak RSS and API calls per pipeline.
+
+    python benchmarks/run_benchmarks.py --accounts 4 --ads 500 --days 14 --latency 0.02
+    python benchmarks/run_benchmarks.py --mode record --cassette-dir cassettes
+    python benchmarks/run_benchmarks.py --mode replay --cassette-dir cassettes
+
+In record mode every exchange with the stand-in server is saved to
+<cassette-dir>/<platform>.jsonl; replay mode serves those responses back with no
+server and no network, so a replay must use the same --accounts/--days/--end-date.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from standin_server import add_world_arguments, serve, world_from_args
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PIPELINES = {
+    "meta": os.path.join(ROOT, "meta", "src", "main.py"),
+    "tiktok": os.path.join(ROOT, "tiktok", "src", "main.py"),
+    "pinterest": os.path.join(ROOT, "pinterest", "src", "main.py"),
+}
+ACCOUNT_ID_BASE = {"meta": 100000000000000, "tiktok": 7000000000000000000, "pinterest": 549000000000}
+STANDIN_TOKEN = "standin-token"
+
+
+def load_pipeline(platform, namespace):
+    """Execute a pipeline script in `namespace` without running its main()"""
+    with open(PIPELINES[platform], encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    # The scripts are notebook exports; their IPython shell escapes (!pip ...) are not Python
+    source = "\n".join("# " + line if line.lstrip().startswith("!") else line for line in lines)
+    exec(compile(source, PIPELINES[platform], "exec"), namespace)
+    return namespace
+
+
+def run_meta(args, accounts, cassette):
+    ns = load_pipeline("meta", {"__name__": "meta_pipeline", "FB_TOKEN_USA": STANDIN_TOKEN})
+    config = ns["Config"]
+    config.FB_TOKEN_DEFAULT = STANDIN_TOKEN
+    config.TOKEN_MAP = {}
+    config.AD_ACCOUNT_IDS = accounts
+    config.REPLAY_MODE = args.replay_mode
+    config.REPLAY_CASSETTE = cassette
+    config.STANDIN_URL = args.server
+    return ns["run"], ns["run_metrics"]
+
+
+def run_tiktok(args, accounts, cassette):
+    os.environ.update({
+        "TIKTOK_ACCESS_TOKEN": STANDIN_TOKEN,
+        "TIKTOK_ADVERTISER_IDS": json.dumps(accounts),
+        "TIKTOK_REPLAY_MODE": args.replay_mode or "",
+        "TIKTOK_CASSETTE": cassette,
+        "TIKTOK_STANDIN_URL": args.server or "",
+    })
+    ns = load_pipeline("tiktok", {"__name__": "tiktok_pipeline"})
+    return ns["run"], ns["RUN_METRICS"]
+
+
+def run_pinterest(args, accounts, cassette):
+    ns = load_pipeline("pinterest", {"__name__": "pinterest_pipeline"})
+    ns["AD_ACCOUNT_IDS"] = accounts
+    ns["REPLAY_MODE"] = args.replay_mode
+    ns["REPLAY_CASSETTE"] = cassette
+    ns["STANDIN_URL"] = args.server
+    ns["SESSION"].mount("https://", ns["build_adapter"]())
+    return ns["run"], ns["RUN_METRICS"]
+
+
+RUNNERS = {"meta": run_meta, "tiktok": run_tiktok, "pinterest": run_pinterest}
+
+
+def child(args):
+    """Run one pipeline in this process and write its measurements to args.result"""
+    accounts = [str(ACCOUNT_ID_BASE[args.child] + n) for n in range(args.accounts)]
+    cassette = os.path.join(args.cassette_dir, f"{args.child}.jsonl") if args.replay_mode else ""
+    end = args.end_date
+    start = time.strftime("%Y-%m-%d", time.gmtime(time.mktime(time.strptime(end, "%Y-%m-%d")) - (args.days - 1) * 86400))
+
+    run, metrics = RUNNERS[args.child](args, accounts, cassette)
+    started = time.time()
+    summary = run(start, end)
+    seconds = time.time() - started
+
+    report = metrics.report(summary)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {
+        "platform": args.child,
+        "accounts": len(accounts),
+        "rows": summary["rows"],
+        "failed_accounts": summary["failed_accounts"],
+        "seconds": round(seconds, 2),
+        "rows_per_second": round(summary["rows"] / seconds, 1) if seconds else None,
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        "peak_rss_mb": round(rss / (1024 ** 2 if sys.platform == "darwin" else 1024), 1),
+        "api_calls": int(sum(c["value"] for c in report["counters"] if c["name"] == "requests")),
+        "stages": report["stages"],
+    }
+    with open(args.result, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def control(server, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(server + path, data=data, method="POST" if data is not None else "GET")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def benchmark(args, platform):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{platform}_")
+    result_path = os.path.join(workdir, "result.json")
+    command = [sys.executable, os.path.abspath(__file__), "--child", platform, "--result", result_path,
+               "--accounts", str(args.accounts), "--days", str(args.days), "--end-date", args.end_date,
+               "--cassette-dir", args.cassette_dir]
+    if args.server:
+        command += ["--server", args.server]
+        control(args.server, "/__reset", {})
+    if args.replay_mode:
+        command += ["--replay-mode", args.replay_mode]
+
+    with open(os.path.join(workdir, "pipeline.log"), "w") as log:
+        completed = subprocess.run(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    if completed.returncode != 0 or not os.path.exists(result_path):
+        with open(os.path.join(workdir, "pipeline.log")) as log:
+            tail = log.read()[-3000:]
+        print(f"❌ {platform} failed (exit {completed.returncode}); log in {workdir}:\n{tail}")
+        return None
+
+    with open(result_path) as f:
+        result = json.load(f)
+    if args.server:
+        stats = control(args.server, "/__stats")
+        result["server_calls"] = stats["total_calls"]
+        result["throttled_calls"] = stats["total_throttled"]
+    if args.keep:
+        result["workdir"] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--platforms", nargs="+", choices=sorted(PIPELINES), default=["meta", "tiktok", "pinterest"])
+    parser.add_argument("--accounts", type=int, default=3, help="synthetic accounts per platform")
+    parser.add_argument("--days", type=int, default=7, help="days in the report window")
+    parser.add_argument("--end-date", default="2025-01-31", help="last day of the window (fixed so replays match)")
+    parser.add_argument("--mode", choices=["standin", "record", "replay"], default="standin")
+    parser.add_argument("--cassette-dir", default="cassettes")
+    parser.add_argument("--output", help="also write the results as JSON to this path")
+    parser.add_argument("--keep", action="store_true", help="keep each pipeline's scratch directory")
+    add_world_arguments(parser)
+    # internal: one pipeline run in a child interpreter
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    parser.add_argument("--replay-mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.cassette_dir = os.path.abspath(args.cassette_dir)
+
+    if args.child:
+        return child(args)
+
+    args.replay_mode = None if args.mode == "standin" else args.mode
+    server = None
+    if args.mode == "replay":
+        args.server = None
+    else:
+        server, args.server = serve(world_from_args(args))
+        print(f"🧪 Stand-in API server on {args.server}")
+    if args.replay_mode:
+        os.makedirs(args.cassette_dir, exist_ok=True)
+
+    results = []
+    for platform in args.platforms:
+        print(f"⏳ Benchmarking {platform} ({args.accounts} accounts x {args.days} days, mode={args.mode})")
+        result = benchmark(args, platform)
+        if result:
+            results.append(result)
+    if server:
+        server.shutdown()
+
+    print(f"\n{'platform':<10} {'rows':>9} {'seconds':>8} {'rows/s':>10} {'peak MB':>8} {'API calls':>9} {'throttled':>9}")
+    for r in results:
+        print(f"{r['platform']:<10} {r['rows']:>9} {r['seconds']:>8} {r['rows_per_second'] or 0:>10} "
+              f"{r['peak_rss_mb']:>8} {r['api_calls']:>9} {r.get('throttled_calls', '-'):>9}")
+        if r["failed_accounts"]:
+            print(f"  ⚠️ failed accounts: {r['failed_accounts']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0 if len(results) == len(args.platforms) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
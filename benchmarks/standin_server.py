@@ -0,0 +1,407 @@
+"""Local stand-in for the Meta Graph, TikTok Business and Pinterest v5 APIs.
+
+Serves the endpoints the pipelines call, with synthetic but deterministic accounts,
+so they can run end-to-end without credentials. Faults can be injected:
+
+- latency: every response is delayed by `latency` + up to `jitter` seconds
+- throttling: a `throttle_rate` share of calls get the platform's rate-limit answer
+  (Graph error 17, TikTok code 40100, Pinterest HTTP 429)
+- async jobs: Meta insights jobs report 'Job Running' for `async_job_seconds`
+
+Control endpoints: GET /__stats (call counts per platform/endpoint), POST /__reset,
+POST /__config (JSON body with any of the knobs above).
+
+    python benchmarks/standin_server.py --port 8765 --ads 200 --latency 0.05
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+COUNTRIES = ["US", "GB", "DE", "FR", "CA", "AU", "NL", "ES", "IT", "SE"]
+ENTITY_EPOCH = 1577836800  # every synthetic entity was created 2020-01-01
+
+
+def stable_int(*parts, mod=1000):
+    """Deterministic pseudo-random number for a (account, ad, day, ...) tuple"""
+    return zlib.crc32("|".join(map(str, parts)).encode()) % mod
+
+
+def days_between(start, end):
+    day, last = date.fromisoformat(start), date.fromisoformat(end)
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+class StandInWorld:
+    """Synthetic accounts plus the fault-injection knobs and call counters."""
+
+    def __init__(self, ads=200, countries=4, delivering_share=0.5, latency=0.0, jitter=0.0,
+                 throttle_rate=0.0, async_job_seconds=2.0, seed=0):
+        self.ads = ads
+        self.countries = countries
+        self.delivering_share = delivering_share
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.async_job_seconds = async_job_seconds
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.job_ids = itertools.count(10 ** 12)
+        self.jobs = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = defaultdict(int)
+            self.throttled = defaultdict(int)
+
+    def configure(self, **knobs):
+        for name, value in knobs.items():
+            if not hasattr(self, name) or name in ("lock", "random", "jobs", "calls", "throttled"):
+                raise ValueError(f"unknown knob {name}")
+            setattr(self, name, type(getattr(self, name))(value))
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "throttled": dict(self.throttled),
+                    "total_calls": sum(self.calls.values()), "total_throttled": sum(self.throttled.values())}
+
+    def admit(self, platform, endpoint):
+        """Count the call, apply latency and decide whether it gets throttled"""
+        key = f"{platform}:{endpoint}"
+        with self.lock:
+            self.calls[key] += 1
+            throttle = self.random.random() < self.throttle_rate
+            if throttle:
+                self.throttled[key] += 1
+            delay = self.latency + self.random.random() * self.jitter
+        if delay:
+            time.sleep(delay)
+        return throttle
+
+    # Synthetic entities: ad i of an account belongs to ad group i // 5 and campaign i // 20.
+    # The first `delivering_share` of the ads deliver every day in every country.
+
+    def delivering(self, i):
+        return i < self.ads * self.delivering_share
+
+    def countries_for(self):
+        return COUNTRIES[:self.countries]
+
+    def ad_rows(self, account, start, end, ad_indexes=None):
+        for day in days_between(start, end):
+            for i in (range(self.ads) if ad_indexes is None else ad_indexes):
+                if self.delivering(i):
+                    for country in self.countries_for():
+                        yield i, day, country
+
+    def metrics(self, account, i, day, country):
+        impressions = 100 + stable_int(account, i, day, country, "impressions", mod=5000)
+        clicks = impressions // (20 + stable_int(account, i, day, country, "ctr", mod=80))
+        purchases = clicks // 10
+        return {
+            "impressions": impressions,
+            "clicks": clicks,
+            "spend": round(impressions * 0.004, 2),
+            "purchases": purchases,
+            "purchase_value": round(purchases * 37.5, 2),
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    world = None  # set by serve()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self):
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        if body.startswith("{"):
+            params.update(json.loads(body))
+        elif body:
+            params.update(parse_qsl(body, keep_blank_values=True))
+        return parts.path, params
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        path, params = self._params()
+        try:
+            if path.startswith("/__"):
+                return self._control(method, path, params)
+            if path.startswith("/open_api/"):
+                return self._tiktok(path, params)
+            if path.startswith("/v5/"):
+                return self._pinterest(path, params)
+            if re.match(r"^/v\d+\.\d+/", path):
+                return self._meta(method, path, params)
+            self._send(404, {"error": f"unknown path {path}"})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+    def _control(self, method, path, params):
+        if path == "/__stats":
+            return self._send(200, self.world.stats())
+        if path == "/__reset" and method == "POST":
+            self.world.reset()
+            return self._send(200, {"ok": True})
+        if path == "/__config" and method == "POST":
+            self.world.configure(**params)
+            return self._send(200, {"ok": True})
+        self._send(404, {"error": f"unknown control path {path}"})
+
+    # ---------- Meta Graph API ----------
+    def _meta(self, method, path, params):
+        world = self.world
+        parts = path.strip("/").split("/")[1:]
+        endpoint = "insights" if parts[-1] == "insights" else "debug_token" if parts == ["debug_token"] else "node"
+        if world.admit("meta", f"{method} {endpoint}"):
+            return self._send(400, {"error": {"message": "(#17) User request limit reached", "type": "OAuthException",
+                                              "code": 17, "fbtrace_id": "standin"}})
+
+        if parts == ["debug_token"]:
+            return self._send(200, {"data": {"app_id": "standin", "is_valid": True, "expires_at": 0}})
+
+        if method == "POST" and len(parts) == 2 and parts[0].startswith("act_") and parts[1] == "insights":
+            time_range = json.loads(params["time_range"])
+            job_id = str(next(world.job_ids))
+            with world.lock:
+                world.jobs[job_id] = {
+                    "account": parts[0][4:],
+                    "since": time_range["since"],
+                    "until": time_range["until"],
+                    "windows": json.loads(params.get("action_attribution_windows", '["7d_click"]')),
+                    "created_at": time.time(),
+                }
+            return self._send(200, {"report_run_id": job_id})
+
+        job = world.jobs.get(parts[0])
+        if job is None:
+            return self._send(400, {"error": {"message": "Unsupported get request", "type": "GraphMethodException",
+                                              "code": 100}})
+        if len(parts) == 1:
+            elapsed = time.time() - job["created_at"]
+            done = elapsed >= world.async_job_seconds
+            percent = 100 if done else int(100 * elapsed / world.async_job_seconds)
+            return self._send(200, {"id": parts[0], "async_status": "Job Completed" if done else "Job Running",
+                                    "async_percent_completion": percent})
+
+        limit, offset = int(params.get("limit", 25)), int(params.get("after", 0))
+        rows = list(itertools.islice(world.ad_rows(job["account"], job["since"], job["until"]),
+                                     offset, offset + limit + 1))
+        data = [self._meta_row(job, *row) for row in rows[:limit]]
+        paging = {"cursors": {"before": str(offset), "after": str(offset + len(data))}}
+        if len(rows) > limit:
+            paging["next"] = f"http://{self.headers.get('Host')}{path}?limit={limit}&after={offset + limit}"
+        self._send(200, {"data": data, "paging": paging})
+
+    def _meta_row(self, job, i, day, country):
+        account = job["account"]
+        m = self.world.metrics(account, i, day, country)
+
+        def by_window(value, cast):
+            # the windows split the total, the first one taking the larger share
+            figures = {"value": str(value)}
+            for n, window in enumerate(job["windows"]):
+                figures[window] = str(cast(value * (0.8 if n == 0 else 0.2)))
+            return figures
+
+        return {
+            "account_id": account,
+            "campaign_id": f"{account}{i // 20:05d}",
+            "campaign_name": f"Campaign {i // 20}",
+            "adset_id": f"{account}{i // 5:06d}",
+            "adset_name": f"Ad set {i // 5}",
+            "ad_id": f"{account}{i:07d}",
+            "ad_name": f"Ad {i}",
+            "date_start": day,
+            "date_stop": day,
+            "country": country,
+            "impressions": str(m["impressions"]),
+            "clicks": str(m["clicks"]),
+            "spend": str(m["spend"]),
+            "reach": str(m["impressions"] * 8 // 10),
+            "frequency": "1.25",
+            "unique_clicks": str(m["clicks"] * 9 // 10),
+            "inline_link_clicks": str(m["clicks"] // 2),
+            "objective": "OUTCOME_SALES",
+            "actions": [
+                {"action_type": "purchase", **by_window(m["purchases"], int)},
+                {"action_type": "view_content", **by_window(m["clicks"], int)},
+                {"action_type": "post", "value": str(m["clicks"] // 50)},
+            ],
+            "action_values": [
+                {"action_type": "purchase", **by_window(m["purchase_value"], lambda v: round(v, 2))},
+            ],
+        }
+
+    # ---------- TikTok Business API ----------
+    def _tiktok(self, path, params):
+        world = self.world
+        endpoint = path.rstrip("/").split("/")[-2]
+        if world.admit("tiktok", endpoint):
+            return self._send(200, {"code": 40100, "message": "Too many requests. Please retry in some time.",
+                                    "request_id": "standin", "data": {}})
+
+        advertiser = params["advertiser_id"]
+        page, page_size = int(params.get("page", 1)), int(params.get("page_size", 10))
+        filtering = json.loads(params["filtering"]) if params.get("filtering") else None
+        if endpoint == "integrated":
+            span = date.fromisoformat(params["end_date"]) - date.fromisoformat(params["start_date"])
+            if span.days >= 30:
+                return self._send(200, {"code": 40002, "message": "The time span between start_date and end_date "
+                                        "cannot exceed 30 days.", "request_id": "standin", "data": {}})
+            metrics = json.loads(params["metrics"])
+            items = self._tiktok_report(advertiser, params["start_date"], params["end_date"], metrics)
+        else:
+            items = self._tiktok_entities(endpoint, advertiser, filtering)
+
+        total = len(items)
+        self._send(200, {"code": 0, "message": "OK", "request_id": "standin", "data": {
+            "list": items[(page - 1) * page_size: page * page_size],
+            "page_info": {"page": page, "page_size": page_size, "total_number": total,
+                          "total_page": max(1, -(-total // page_size))},
+        }})
+
+    def _tiktok_entities(self, endpoint, advertiser, filtering):
+        ads = self.world.ads
+        if endpoint == "campaign":
+            items = [{"campaign_id": f"{advertiser}{c:05d}", "campaign_name": f"Campaign {c}",
+                      "objective_type": "CONVERSIONS"} for c in range(-(-ads // 20))]
+        elif endpoint == "adgroup":
+            items = [{"adgroup_id": f"{advertiser}{g:06d}", "adgroup_name": f"Ad group {g}"}
+                     for g in range(-(-ads // 5))]
+        else:
+            items = [{"ad_id": f"{advertiser}{i:07d}", "ad_name": f"Ad {i}", "adgroup_id": f"{advertiser}{i // 5:06d}",
+                      "campaign_id": f"{advertiser}{i // 20:05d}", "operation_status": "ENABLE"} for i in range(ads)]
+        if isinstance(filtering, dict):
+            if "creation_filter_start_time" in filtering:
+                return []  # nothing is created after ENTITY_EPOCH
+            for key, ids in filtering.items():
+                if key.endswith("_ids"):
+                    items = [item for item in items if str(item[key[:-1]]) in set(map(str, ids))]
+        return items
+
+    def _tiktok_report(self, advertiser, start, end, metric_names):
+        items = []
+        for i, day, country in self.world.ad_rows(advertiser, start, end):
+            m = self.world.metrics(advertiser, i, day, country)
+            values = {"impressions": m["impressions"], "clicks": m["clicks"], "spend": m["spend"],
+                      "conversion": m["purchases"], "complete_payment": m["purchases"],
+                      "total_complete_payment_rate": m["purchase_value"]}
+            items.append({
+                "dimensions": {"ad_id": f"{advertiser}{i:07d}", "stat_time_day": f"{day} 00:00:00",
+                               "country_code": country},
+                "metrics": {name: str(values.get(name, 0)) for name in metric_names},
+            })
+        return items
+
+    # ---------- Pinterest v5 API ----------
+    def _pinterest(self, path, params):
+        world = self.world
+        parts = path.strip("/").split("/")  # v5, ad_accounts, <id>, ads[, targeting_analytics]
+        account, endpoint = parts[2], parts[-1]
+        if world.admit("pinterest", endpoint):
+            return self._send(429, {"code": 8, "message": "You have exceeded your rate limit. Try again later."},
+                              {"Retry-After": "1"})
+
+        if endpoint == "ads":
+            page_size, offset = int(params.get("page_size", 25)), int(params.get("bookmark") or 0)
+            items = []
+            for i in range(offset, min(offset + page_size, world.ads)):
+                live = world.delivering(i)
+                items.append({"id": f"{account}{i:07d}", "ad_account_id": account,
+                              "campaign_id": f"{account}{i // 20:05d}", "ad_group_id": f"{account}{i // 5:06d}",
+                              "status": "ACTIVE" if live else "PAUSED", "created_time": ENTITY_EPOCH,
+                              "updated_time": int(time.time()) if live else ENTITY_EPOCH})
+            more = offset + page_size < world.ads
+            return self._send(200, {"items": items, "bookmark": str(offset + page_size) if more else None})
+
+        ad_indexes = sorted(int(ad_id[len(account):]) for ad_id in params["ad_ids"].split(","))
+        data = []
+        for i, day, country in world.ad_rows(account, params["start_date"], params["end_date"], ad_indexes):
+            m = world.metrics(account, i, day, country)
+            data.append({"ad_id": f"{account}{i:07d}", "targeting_type": "COUNTRY", "targeting_value": country,
+                         "metrics": {
+                             "AD_ID": f"{account}{i:07d}", "DATE": day,
+                             "CAMPAIGN_ID": f"{account}{i // 20:05d}", "CAMPAIGN_NAME": f"Campaign {i // 20}",
+                             "CAMPAIGN_OBJECTIVE_TYPE": "CONVERSIONS",
+                             "AD_GROUP_ID": f"{account}{i // 5:06d}", "AD_GROUP_NAME": f"Ad group {i // 5}",
+                             "AD_NAME": f"Ad {i}", "SPEND_IN_DOLLAR": m["spend"],
+                             "TOTAL_IMPRESSION": m["impressions"], "TOTAL_CLICKTHROUGH": m["clicks"],
+                             "TOTAL_CHECKOUT": m["purchases"],
+                             "TOTAL_CHECKOUT_VALUE_IN_MICRO_DOLLAR": int(m["purchase_value"] * 1_000_000),
+                         }})
+        self._send(200, {"data": data})
+
+
+def serve(world, host="127.0.0.1", port=0):
+    """Start the server on a background thread; returns (server, base_url)"""
+    handler = type("StandInHandler", (Handler,), {"world": world})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_world_arguments(parser):
+    parser.add_argument("--ads", type=int, default=200, help="ads per account")
+    parser.add_argument("--countries", type=int, default=4, help="countries each delivering ad reports")
+    parser.add_argument("--delivering-share", type=float, default=0.5, help="share of ads with delivery")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of calls answered as rate limited")
+    parser.add_argument("--async-job-seconds", type=float, default=2.0, help="Meta async job run time")
+
+
+def world_from_args(args):
+    return StandInWorld(ads=args.ads, countries=args.countries, delivering_share=args.delivering_share,
+                        latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                        async_job_seconds=args.async_job_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_world_arguments(parser)
+    args = parser.parse_args()
+    server, url = serve(world_from_args(args), args.host, args.port)
+    print(f"Stand-in API server listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
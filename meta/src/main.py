@@ -2,16 +2,33 @@
  !pip install facebook-business
  !pip install requests pandas
  !pip install concurrent.futures
+ !pip install pyarrow google-cloud-bigquery
+import os
 import json
 import time
+import random
+import sqlite3
+import threading
 import traceback
+from contextlib import ExitStack, contextmanager
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 from facebook_business.api import FacebookAdsApi
+from facebook_business.session import FacebookSession
 from facebook_business.adobjects.adaccount import AdAccount
 from facebook_business.adobjects.adreportrun import AdReportRun
 from facebook_business.exceptions import FacebookRequestError
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import parse_qsl, urlencode, urlsplit
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict, deque
 import hashlib
+import shutil
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 # Configuration
 class Config:
@@ -32,127 +49,855 @@ class Config:
     ]
 
     ATTRIBUTION_WINDOWS = ['7d_click']
+    # Request every window in one async job and fan the per-window figures out into
+    # one row per window, instead of running a separate job for each window
+    COMBINE_ATTRIBUTION_WINDOWS = True
+
+    # 'raw' reads finished async job results as plain JSON pages straight into
+    # normalization; 'sdk' walks the SDK cursor, which builds an AdsInsights object per row
+    RESULT_DOWNLOAD = 'raw'
+
+    # Conversion columns flattened out of `actions` (counts) and `action_values` (values).
+    # A window of None reads the action's 'value'; a window name (e.g. '1d_view') reads that figure instead.
+    ACTION_COLUMNS = [
+        # (output column, action_type, 'count' | 'value', attribution window)
+        ('purchases', 'purchase', 'count', None),
+        ('purchase_value', 'purchase', 'value', None),
+        ('post_shares', 'post', 'count', None),
+        ('view_content', 'view_content', 'count', None),
+        ('view_content_value', 'view_content', 'value', None),
+    ]
     MAX_ACCOUNT_FAILURES = 3
+    # Retries: full-jitter backoff (or the server's Retry-After), a circuit breaker and a
+    # retry budget per host. Throttling errors are paced by the usage governor instead
+    RETRY_MAX_ATTEMPTS = 6
+    RETRY_BASE_DELAY = 1
+    RETRY_MAX_DELAY = 60
+    CIRCUIT_FAILURES = 5  # failures in a row that open a host's circuit
+    CIRCUIT_RESET_SECONDS = 30
+    RETRY_BUDGET_RATIO = 0.2  # error retries per request, after a burst of 10
+    MAX_CONCURRENT_JOBS_PER_ACCOUNT = 3
+    MAX_CONCURRENT_JOBS = 25
+    CHECKPOINT_DIR = 'meta_checkpoints'
+
+    # Adaptive job sizing: chunks are sized per account from the rows/day and job
+    # seconds/day of past runs; accounts without history use MAX_CHUNK_DAYS
+    TARGET_ROWS_PER_JOB = 100_000
+    TARGET_JOB_SECONDS = 300  # half the scheduler's job timeout
+    MAX_CHUNK_DAYS = 560
+
+    # Full-refresh window: REPORT_DAYS days ending yesterday
+    REPORT_DAYS = 10
+
+    # Incremental mode: fetch each account from its high-water mark, re-fetching the
+    # trailing LOOKBACK_DAYS so late-attributed conversions settle, into per-day partitions
+    INCREMENTAL = False
+    STATE_DB_PATH = 'meta_state.sqlite'
+    LOOKBACK_DAYS = 7  # matches the 7d_click attribution window
+    INITIAL_DAYS = 30  # first run for an account without a high-water mark
+    PARTITION_DIR = 'meta_partitions'
+    # 'combined' writes one file for a full-refresh run; 'partitioned' writes the same
+    # platform/account/day partitions as incremental mode (incremental runs always do)
+    OUTPUT_LAYOUT = 'combined'
+    SHARD_MAX_BYTES = 128 * 1024 * 1024  # uncompressed size at which a partition's shard is rolled
+    JSONL_COMPRESSION = 'gzip'  # or 'zstd' / None; Parquet shards always use zstd internally
+    COMPRESSION_WORKERS = 4  # background threads serializing and compressing shards
+    # Cross-platform fact table (FACT_SCHEMA) shared with the TikTok and Pinterest pipelines;
+    # each completed account's days are replaced under FACT_DIR/platform=meta. None disables it
+    FACT_DIR = 'ad_facts'
+    OUTPUT_FORMAT = 'parquet'  # or 'jsonl'
+    RUN_REPORT_PATH = 'meta_run_report.json'  # per-stage timings and counters of the last run
+    PROMETHEUS_TEXTFILE = None  # e.g. '/var/lib/node_exporter/meta_ads.prom' for the textfile collector
+    BQ_TABLE = None  # e.g. 'project.dataset.meta_ads' to batch-load the combined file
+    LOCAL_LOAD_DIR = None  # filesystem stand-in for BigQuery, e.g. for tests
+
+    # Offline runs: 'record' saves every Graph API exchange to REPLAY_CASSETTE, 'replay'
+    # serves them back without network access. STANDIN_URL (e.g. 'http://127.0.0.1:8765')
+    # sends all Graph API traffic to a local stand-in server instead of graph.facebook.com
+    REPLAY_MODE = None
+    REPLAY_CASSETTE = 'meta_cassette.jsonl'
+    STANDIN_URL = None
 
 
 class DeduplicationManager:
+    """Thread-safe dedup index for one run, keyed by a 64-bit hash of each record's identity fields.
+
+    Keys stay pending under the scope (unit of work) that produced them until the unit
+    is committed, so a unit that fails can be released and fetched again without its
+    rows being dropped as duplicates.
+    """
+    KEY_FIELDS = ('adset_id', 'ad_id', 'date_start', 'date_stop', 'account_id', 'attribution_window', 'country')
+
     def __init__(self):
         self.seen_records = set()
+        self._pending = defaultdict(set)
+        self._lock = threading.Lock()
 
-    def generate_record_hash(self, record):
-        hash_data = {
-            'adset_id': record.get('adset_id'),
-            'ad_id': record.get('ad_id'),
-            'date_start': record.get('date_start'),
-            'date_stop': record.get('date_stop'),
-            'account_id': record.get('account_id'),
-            'attribution_window': record.get('attribution_window'),
-            'country': record.get('country')
-        }
-        return hashlib.md5(json.dumps(hash_data, sort_keys=True).encode()).hexdigest()
+    @classmethod
+    def generate_record_hash(cls, record):
+        """Signed 64-bit key of the record's identity fields"""
+        identity = '\x1f'.join('\x00' if value is None else str(value)
+                               for value in map(record.get, cls.KEY_FIELDS))
+        return int.from_bytes(hashlib.blake2b(identity.encode(), digest_size=8).digest(), 'big', signed=True)
 
     def is_duplicate(self, record):
-        record_hash = self.generate_record_hash(record)
-        if record_hash in self.seen_records:
+        return not self.filter_duplicates([record])
+
+    def filter_duplicates(self, records, scope=None):
+        """Return the records whose keys were not seen before, and mark them as seen"""
+        keyed = [(self.generate_record_hash(record), record) for record in records]
+
+        with self._lock:
+            candidates = {}
+            for key, record in keyed:
+                if key not in self.seen_records and key not in candidates:
+                    candidates[key] = record
+            self.seen_records.update(candidates)
+            if scope is not None:
+                self._pending[scope].update(candidates)
+            return list(candidates.values())
+
+    def commit_scope(self, scope):
+        """Keep the keys of a committed unit for the rest of the run"""
+        with self._lock:
+            self._pending.pop(scope, None)
+
+    def release_scope(self, scope):
+        """Forget the keys of a failed unit so a later retry isn't dropped as duplicate"""
+        with self._lock:
+            self.seen_records.difference_update(self._pending.pop(scope, ()))
+
+
+class RunMetrics:
+    """Thread-safe stage timings (per stage + labels such as account) and counters for one run."""
+    def __init__(self, platform):
+        self.platform = platform
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.spans = defaultdict(lambda: {"count": 0, "seconds": 0.0, "rows": 0})
+            self.counters = defaultdict(float)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        # set span["rows"] inside the block to report throughput
+        span = {"rows": 0}
+        started = time.time()
+        try:
+            yield span
+        finally:
+            self.add(stage, time.time() - started, span["rows"], **labels)
+
+    def add(self, stage, seconds, rows=0, **labels):
+        key = (stage, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            entry = self.spans[key]
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["rows"] += rows
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def report(self, summary=None):
+        with self.lock:
+            spans = [dict(stage=stage, labels=dict(labels), **entry) for (stage, labels), entry in self.spans.items()]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self.counters.items()]
+            elapsed = time.time() - self.started_at
+        stages = defaultdict(lambda: {"count": 0, "seconds": 0.0, "rows": 0})
+        for span in spans:
+            for field in ("count", "seconds", "rows"):
+                stages[span["stage"]][field] += span[field]
+        for totals in stages.values():
+            totals["rows_per_second"] = totals["rows"] / totals["seconds"] if totals["rows"] and totals["seconds"] else None
+        return {"platform": self.platform, "elapsed_seconds": elapsed, "summary": summary,
+                "stages": dict(stages), "counters": counters, "spans": spans}
+
+    def write(self, report_path, prometheus_path=None, summary=None):
+        report = self.report(summary)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        if prometheus_path:
+            platform = f'platform="{self.platform}"'
+            lines = ["# TYPE social_ads_run_seconds gauge",
+                     f"social_ads_run_seconds{{{platform}}} {report['elapsed_seconds']:.3f}",
+                     "# TYPE social_ads_stage_seconds_total counter",
+                     "# TYPE social_ads_stage_rows_total counter",
+                     "# TYPE social_ads_stage_calls_total counter"]
+            for stage, totals in sorted(report["stages"].items()):
+                labels = f'{platform},stage="{stage}"'
+                lines.append(f"social_ads_stage_seconds_total{{{labels}}} {totals['seconds']:.3f}")
+                lines.append(f"social_ads_stage_rows_total{{{labels}}} {totals['rows']}")
+                lines.append(f"social_ads_stage_calls_total{{{labels}}} {totals['count']}")
+            for counter in sorted(report["counters"], key=lambda c: (c["name"], sorted(c["labels"].items()))):
+                labels = ",".join([platform] + [f'{k}="{v}"' for k, v in sorted(counter["labels"].items())])
+                lines.append(f"social_ads_{counter['name']}_total{{{labels}}} {counter['value']:g}")
+            # rename into place so the collector never scrapes a partial file
+            with open(prometheus_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(prometheus_path + ".tmp", prometheus_path)
+        return report
+
+
+run_metrics = RunMetrics('meta')
+
+
+class RetryableError(Exception):
+    """A failure worth another attempt: throttling, a 5xx, a timeout or a dropped connection.
+
+    retry_after is the server's own hint in seconds, when it gave one.
+    """
+    def __init__(self, message, retry_after=None, throttled=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+
+class CircuitOpenError(RetryableError):
+    """Raised without sending the request while the host's circuit is open."""
+
+
+def parse_retry_after(headers, now=None):
+    """Seconds to wait according to Retry-After (delay or HTTP date) or a rate-limit reset header, else None."""
+    headers = CaseInsensitiveDict(headers or {})
+    now = time.time() if now is None else now
+    value = headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+    for name in ("RateLimit-Reset", "X-RateLimit-Reset"):
+        try:
+            value = float(headers.get(name))
+        except (TypeError, ValueError):
+            continue
+        # some APIs send the reset as an epoch timestamp rather than a delay
+        return max(0.0, value - now if value > 1e9 else value)
+    return None
+
+
+class CircuitBreaker:
+    """Stop calling a host after failure_threshold failures in a row.
+
+    While open, calls fail fast for reset_timeout seconds; then one probe is let through
+    (half-open) and its outcome closes the circuit or opens it again. Openings are
+    counted on `metrics` (a RunMetrics) and reported through `log`.
+    """
+    def __init__(self, host, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic, metrics=None, log=print):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.metrics = metrics
+        self.log = log
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if not self.probing and (self.opened_at is not None or self.failures < self.failure_threshold):
+                return
+            self.opened_at = self.clock()
+            self.probing = False
+        if self.metrics:
+            self.metrics.count("circuit_opened", host=self.host)
+        self.log(f"Circuit for {self.host} opened after {self.failures} failures in a row; "
+                 f"pausing it for {self.reset_timeout:.0f}s")
+
+
+class RetryBudget:
+    """Token bucket capping a host's error retries at `ratio` per request, after an initial `burst`."""
+    def __init__(self, ratio=0.2, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
             return True
-        self.seen_records.add(record_hash)
-        return False
 
 
-class TokenValidator:
+class RetryPolicy:
+    """Retries shared by every request: full-jitter backoff, Retry-After, circuit breakers and budgets per host.
+
+    call(host, send) runs send() until it returns. send raises RetryableError for
+    throttling and transient failures, and any other exception for failures no retry
+    can fix, which propagate at once. Throttled attempts wait as long as the server
+    asked and leave the host's circuit and budget alone; other failures count against
+    both. The last error is raised once the attempts or the budget run out. Retries
+    are counted on `metrics` (a RunMetrics) and reported through `log`.
+    """
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0, max_retry_after=300.0,
+                 failure_threshold=5, reset_timeout=30.0, budget_ratio=0.2, budget_burst=10, sleep=time.sleep,
+                 metrics=None, log=print):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self.sleep = sleep
+        self.metrics = metrics
+        self.log = log
+        self.breakers = {}
+        self.budgets = {}
+        self.lock = threading.Lock()
+
+    def _host(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, self.failure_threshold, self.reset_timeout,
+                                                     metrics=self.metrics, log=self.log)
+                self.budgets[host] = RetryBudget(self.budget_ratio, self.budget_burst)
+            return self.breakers[host], self.budgets[host]
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retrying after failed attempt number `attempt` (1-based)."""
+        if retry_after is not None:
+            # the server said when; a little jitter keeps the waiting threads from returning in lockstep
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, host, send, endpoint=""):
+        breaker, budget = self._host(host)
+        budget.deposit()
+        for attempt in range(1, self.max_attempts + 1):
+            if breaker.allow():
+                try:
+                    result = send()
+                except RetryableError as e:
+                    error = e
+                    if e.throttled:
+                        breaker.record_success()  # a rate-limit answer still shows the host is up
+                    else:
+                        breaker.record_failure()
+                except Exception:
+                    breaker.record_success()  # the host answered; the request itself is at fault
+                    raise
+                else:
+                    breaker.record_success()
+                    return result
+            else:
+                error = CircuitOpenError(f"circuit open for {host}", breaker.remaining() or None)
+
+            if attempt == self.max_attempts:
+                break
+            if error.retry_after is not None and error.retry_after > self.max_retry_after:
+                break  # not worth holding the run for
+            reason = "throttle" if error.throttled else "circuit" if isinstance(error, CircuitOpenError) else "error"
+            if reason == "error" and not budget.withdraw():
+                if self.metrics:
+                    self.metrics.count("retries_denied", host=host)
+                self.log(f"{endpoint or host}: retry budget spent, giving up: {error}")
+                break
+            delay = self.backoff(attempt, error.retry_after)
+            if self.metrics:
+                self.metrics.count("retries", endpoint=endpoint, reason=reason)
+                self.metrics.count("sleep_seconds", delay, reason="backoff")
+            self.log(f"{endpoint or host}: {error} (attempt {attempt}/{self.max_attempts}), retrying in {delay:.1f}s")
+            self.sleep(delay)
+        raise error
+
+
+retry_policy = RetryPolicy(Config.RETRY_MAX_ATTEMPTS, Config.RETRY_BASE_DELAY, Config.RETRY_MAX_DELAY,
+                           failure_threshold=Config.CIRCUIT_FAILURES, reset_timeout=Config.CIRCUIT_RESET_SECONDS,
+                           budget_ratio=Config.RETRY_BUDGET_RATIO, metrics=run_metrics,
+                           log=lambda message: print(f"⚠️ {message}"))
+GRAPH_HOST = urlsplit(FacebookSession.GRAPH).netloc
+
+
+class UsageGovernor:
+    """Admit Graph API calls only while Meta's usage headers report headroom.
+
+    Usage is tracked per ad account (x-ad-account-usage, x-business-use-case-usage)
+    and for the app (x-app-usage). Below `soft_limit` percent calls go through
+    immediately; between the soft and hard limits they are spaced out more and
+    more; at the hard limit, or after a throttling error, the account (or the
+    whole app) is blocked until Meta's estimated time to regain access. Throttling
+    errors without an estimate back off exponentially with full jitter, capped at
+    `default_cooldown`, until a call for the account goes through again.
+    """
+    THROTTLE_ERROR_CODES = {4, 17, 32, 613, 80000, 80003, 80004, 80014}
+    APP_KEY = '__app__'
+
+    def __init__(self, soft_limit=60, hard_limit=90, max_spacing=30, default_cooldown=60, throttle_backoff=5,
+                 record=False, clock=time.time, sleep=time.sleep, rng=None):
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.max_spacing = max_spacing
+        self.default_cooldown = default_cooldown
+        self.throttle_backoff = throttle_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.usage = {}
+        self.blocked_until = {}
+        self.throttle_streak = {}
+        self.last_admitted = {}
+        self.recorded = [] if record else None
+        self._lock = threading.Lock()
+
     @staticmethod
-    def validate_token(token):
-        try:
-            FacebookAdsApi.init(access_token=token)
-            test_account = AdAccount('act_1315317622252931')
-            test_account.api_get(fields=['id', 'name'])
-            return True, "Token is valid"
-        except FacebookRequestError as e:
-            error_msg = f"Token validation failed: {e.api_error_code} - {e.api_error_message}"
-            return False, error_msg
-        except Exception as e:
-            return False, f"Token validation error: {str(e)}"
+    def _parse_header(headers, name):
+        for key, value in (headers or {}).items():
+            if key.lower() == name:
+                try:
+                    return json.loads(value) if isinstance(value, str) else value
+                except ValueError:
+                    return None
+        return None
+
+    def _set_usage(self, key, percent, regain_seconds=0, reset_seconds=0):
+        now = self.clock()
+        self.usage[key] = percent
+        if regain_seconds:
+            # Meta already blocks this key until the estimated time to regain access
+            self.blocked_until[key] = max(self.blocked_until.get(key, 0), now + regain_seconds)
+        elif percent >= self.hard_limit:
+            cooldown = reset_seconds or self.default_cooldown
+            self.blocked_until[key] = max(self.blocked_until.get(key, 0), now + cooldown)
+
+    def update(self, account_id, headers):
+        """Record the usage reported in a response's headers"""
+        app_usage = self._parse_header(headers, 'x-app-usage')
+        account_usage = self._parse_header(headers, 'x-ad-account-usage')
+        buc_usage = self._parse_header(headers, 'x-business-use-case-usage')
+
+        # key -> [percent, regain_seconds, reset_seconds], keeping the worst reading
+        readings = defaultdict(lambda: [0, 0, 0])
+
+        def note(key, percent, regain_seconds=0, reset_seconds=0):
+            reading = readings[key]
+            reading[0] = max(reading[0], percent)
+            reading[1] = max(reading[1], regain_seconds)
+            reading[2] = max(reading[2], reset_seconds)
+
+        if app_usage:
+            note(self.APP_KEY, max(app_usage.get('call_count', 0), app_usage.get('total_cputime', 0),
+                                   app_usage.get('total_time', 0)))
+
+        if account_usage:
+            note(account_id, account_usage.get('acc_id_util_pct', 0),
+                 reset_seconds=account_usage.get('reset_time_duration', 0))
+
+        # Business use case usage is keyed by the object id, which is the ad account
+        # id for ads_insights/ads_management
+        for object_id, entries in (buc_usage or {}).items():
+            key = account_id if object_id in (account_id, f"act_{account_id}") else object_id
+            for entry in entries:
+                note(key, max(entry.get('call_count', 0), entry.get('total_cputime', 0),
+                              entry.get('total_time', 0)),
+                     regain_seconds=entry.get('estimated_time_to_regain_access', 0) * 60)
+
+        with self._lock:
+            if self.recorded is not None:
+                self.recorded.append({'account_id': account_id, 'headers': dict(headers or {})})
+            for key, (percent, regain_seconds, reset_seconds) in readings.items():
+                self._set_usage(key, percent, regain_seconds, reset_seconds)
+
+    def record_error(self, account_id, error_code, headers=None):
+        """Record a failed call; returns True when it was a throttling error"""
+        self.update(account_id, headers)
+        if error_code not in self.THROTTLE_ERROR_CODES:
+            return False
+
+        # App-level codes block every account, the rest only the throttled one
+        key = self.APP_KEY if error_code in (4, 32) else account_id
+        with self._lock:
+            now = self.clock()
+            streak = self.throttle_streak[key] = self.throttle_streak.get(key, 0) + 1
+            cooldown = self.rng.uniform(0, min(self.default_cooldown, self.throttle_backoff * 2 ** streak))
+            # A regain estimate from the usage headers, when there was one, wins over the backoff
+            self.blocked_until[key] = max(self.blocked_until.get(key, 0), now + cooldown)
+            self.usage[key] = max(self.usage.get(key, 0), self.hard_limit)
+            wait = self.blocked_until[key] - now
+        print(f"🚦 Throttled ({error_code}) on {key}, backing off {wait:.0f}s")
+        return True
+
+    def record_success(self, account_id):
+        """Reset the throttling backoff once a call for the account goes through"""
+        with self._lock:
+            self.throttle_streak.pop(account_id, None)
+            self.throttle_streak.pop(self.APP_KEY, None)
+
+    def _spacing(self, percent):
+        if percent <= self.soft_limit:
+            return 0
+        ratio = min((percent - self.soft_limit) / (self.hard_limit - self.soft_limit), 1)
+        return self.max_spacing * ratio ** 2
+
+    def wait_time(self, account_id):
+        """Seconds until a call for this account would be admitted"""
+        with self._lock:
+            return self._wait_time(account_id, self.clock())
+
+    def _wait_time(self, account_id, now):
+        wait = 0
+        for key in (self.APP_KEY, account_id):
+            blocked_until = self.blocked_until.get(key, 0)
+            if blocked_until > now:
+                wait = max(wait, blocked_until - now)
+                continue
+            if blocked_until:
+                # The block has expired: usage has reset, let a probe call through
+                del self.blocked_until[key]
+                self.usage[key] = min(self.usage.get(key, 0), self.soft_limit)
+            spacing = self._spacing(self.usage.get(key, 0))
+            wait = max(wait, self.last_admitted.get(key, 0) + spacing - now)
+        return max(wait, 0)
+
+    def acquire(self, account_id):
+        """Block until the account and the app have headroom for one more call"""
+        while True:
+            with self._lock:
+                now = self.clock()
+                wait = self._wait_time(account_id, now)
+                if wait <= 0:
+                    self.last_admitted[account_id] = now
+                    self.last_admitted[self.APP_KEY] = now
+                    return
+            self.sleep(wait)
+
+
+class GovernedFacebookAdsApi(FacebookAdsApi):
+    """FacebookAdsApi that routes every call for one account through a UsageGovernor and a RetryPolicy.
+
+    Throttling errors block the account (or the app) in the governor and are retried
+    once it admits calls again. Transient errors (flagged is_transient, codes 1 and 2,
+    5xx answers, network failures) are retried with backoff. Anything else, such as an
+    invalid parameter, an expired token or a missing permission, is raised at once.
+    """
+    TRANSIENT_ERROR_CODES = {1, 2}
+
+    def __init__(self, session, account_id, governor, policy=None):
+        super().__init__(session)
+        self.account_id = account_id
+        self.governor = governor
+        self.policy = policy or retry_policy
+
+    def is_transient(self, error):
+        return (error.api_transient_error() or error.api_error_code() in self.TRANSIENT_ERROR_CODES
+                or (error.http_status() or 0) >= 500)
+
+    def call(self, method, path, params=None, headers=None, files=None, url_override=None, api_version=None):
+        def send():
+            waited = time.time()
+            self.governor.acquire(self.account_id)
+            run_metrics.count('sleep_seconds', time.time() - waited, reason='governor')
+            run_metrics.count('requests')
+            try:
+                with run_metrics.span('http'):
+                    response = FacebookAdsApi.call(self, method, path, params=params, headers=headers, files=files,
+                                                   url_override=url_override, api_version=api_version)
+            except FacebookRequestError as e:
+                run_metrics.count('request_errors', code=e.api_error_code())
+                message = f"({e.api_error_code()}) {e.api_error_message()}"
+                if self.governor.record_error(self.account_id, e.api_error_code(), e.http_headers()):
+                    # The governor holds the next attempt back in acquire() for as long as needed
+                    raise RetryableError(message, retry_after=0, throttled=True) from e
+                if self.is_transient(e):
+                    raise RetryableError(message, parse_retry_after(e.http_headers())) from e
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                run_metrics.count('request_errors', code='network')
+                raise RetryableError(f"request failed: {e}") from e
+            run_metrics.count('bytes', len(response.body() or ''))
+            self.governor.update(self.account_id, response.headers())
+            self.governor.record_success(self.account_id)
+            return response
+
+        return self.policy.call(GRAPH_HOST, send, f"act_{self.account_id}")
+
+
+usage_governor = UsageGovernor()
+
+
+class ReplayAdapter(HTTPAdapter):
+    """Transport under a requests session for runs without the real API.
+
+    In "record" mode requests pass through and each exchange is appended to the
+    cassette (JSON lines, access tokens stripped); in "replay" mode responses come from
+    the cassette and nothing reaches the network. Identical requests are answered in
+    recorded order, the last response repeating, so a request retried after a throttled
+    answer, or a job status poll, sees the same sequence of answers as when it was recorded.
+    With a target, requests go to that base URL instead of the API host.
+    """
+    SECRET_PARAMS = {"access_token", "appsecret_proof", "input_token"}
+    DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "set-cookie"}
+    _lock = threading.Lock()
+    _cassettes = {}  # replay: path -> {key: deque of responses}
+    _recording = set()  # record: paths truncated by this process
+
+    def __init__(self, mode=None, cassette=None, target=None, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode
+        self.cassette = cassette
+        self.target = target.rstrip("/") if target else None
+        with self._lock:
+            if mode == "replay" and cassette not in self._cassettes:
+                recorded = defaultdict(deque)
+                with open(cassette, encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        recorded[entry["key"]].append(entry)
+                self._cassettes[cassette] = recorded
+            elif mode == "record" and cassette not in self._recording:
+                open(cassette, "w").close()
+                self._recording.add(cassette)
+
+    @classmethod
+    def request_key(cls, method, url, body=None):
+        """Method, path and sorted parameters of a request, without credentials or host"""
+        parts = urlsplit(url)
+        query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in cls.SECRET_PARAMS)
+        key = f"{method} {parts.path}?{urlencode(query)}"
+        if body:
+            body = body.decode("utf-8") if isinstance(body, bytes) else body
+            form = sorted((k, v) for k, v in parse_qsl(body, keep_blank_values=True) if k not in cls.SECRET_PARAMS)
+            key += " " + (urlencode(form) if form else body)
+        return key
+
+    def send(self, request, **kwargs):
+        key = self.request_key(request.method, request.url, request.body)
+        if self.mode == "replay":
+            with self._lock:
+                responses = self._cassettes[self.cassette].get(key)
+                entry = (responses.popleft() if len(responses) > 1 else responses[0]) if responses else None
+            if entry is None:
+                raise requests.exceptions.ConnectionError(f"No recorded response for {key}", request=request)
+            return self._replayed(request, entry)
+
+        if self.target:
+            parts = urlsplit(request.url)
+            request.url = self.target + parts.path + (f"?{parts.query}" if parts.query else "")
+        response = super().send(request, **kwargs)
+        if self.mode == "record":
+            entry = {
+                "key": key,
+                "status": response.status_code,
+                "headers": {k: v for k, v in response.headers.items() if k.lower() not in self.DROPPED_HEADERS},
+                "body": response.text,
+            }
+            with self._lock, open(self.cassette, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        return response
+
+    @staticmethod
+    def _replayed(request, entry):
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.reason = "Replayed"
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class TokenValidator:
+    """Validate each access token once and reuse the answer for the token's lifetime.
+
+    Validation runs debug_token through the caller's API object, so it never touches
+    FacebookAdsApi's global default and also learns when the token expires. Invalid
+    tokens stay cached as invalid; network errors are not cached.
+    """
+    _lock = threading.Lock()
+    _results = {}  # token -> (is_valid, message, valid_until)
+    _token_locks = {}  # token -> lock held while that token's debug_token call is in flight
+
+    @classmethod
+    def validate_token(cls, token, api):
+        # Only threads validating the same token wait for the network call; the
+        # class-wide lock guards the dicts
+        with cls._lock:
+            token_lock = cls._token_locks.setdefault(token, threading.Lock())
+        with token_lock:
+            with cls._lock:
+                cached = cls._results.get(token)
+            if cached and time.time() < cached[2]:
+                return cached[0], cached[1]
+            try:
+                response = api.call('GET', ('debug_token',), params={'input_token': token})
+                data = response.json().get('data', {})
+            except FacebookRequestError as e:
+                message = f"Token validation failed: {e.api_error_code()} - {e.api_error_message()}"
+                result = (False, message, float('inf'))
+            except Exception as e:
+                return False, f"Token validation error: {str(e)}"
+            else:
+                if data.get('is_valid'):
+                    # expires_at is 0 for tokens that never expire
+                    result = (True, "Token is valid", data.get('expires_at') or float('inf'))
+                else:
+                    reason = data.get('error', {}).get('message', 'token is not valid')
+                    result = (False, f"Token validation failed: {reason}", float('inf'))
+            with cls._lock:
+                cls._results[token] = result
+            return result[0], result[1]
 
 
 class EnhancedFacebookAPIClient:
-    def __init__(self, account_id):
+    """Graph API access for one account over the shared, validated session of its token.
+
+    There is one FacebookSession (and connection pool) per token for the whole
+    process; each account gets its own GovernedFacebookAdsApi on top of it so usage
+    is still tracked per account.
+    """
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, account_id, governor=None):
         self.account_id = account_id
         token = Config.TOKEN_MAP.get(account_id, Config.FB_TOKEN_DEFAULT)
 
-        is_valid, message = TokenValidator.validate_token(token)
+        self.api = GovernedFacebookAdsApi(self.session_for(token), account_id, governor or usage_governor)
+        is_valid, message = TokenValidator.validate_token(token, self.api)
         if not is_valid:
             raise Exception(f"Invalid token for account {account_id}: {message}")
 
-        token_type = "USA" if token == Config.FB_TOKEN_USA else "DEFAULT"
+        token_type = "account" if account_id in Config.TOKEN_MAP else "DEFAULT"
         print(f"🔑 Initializing account {account_id} with {token_type} token - Validated ✓")
 
-        self.api = FacebookAdsApi.init(access_token=token)
         self.ad_account = AdAccount(f"act_{account_id}", api=self.api)
 
+    @classmethod
+    def session_for(cls, token):
+        with cls._sessions_lock:
+            if token not in cls._sessions:
+                session = FacebookSession(access_token=token)
+                if Config.REPLAY_MODE or Config.STANDIN_URL:
+                    session.requests.mount('https://', ReplayAdapter(Config.REPLAY_MODE, Config.REPLAY_CASSETTE,
+                                                                     Config.STANDIN_URL))
+                cls._sessions[token] = session
+            return cls._sessions[token]
+
+
+class ActionExtractor:
+    """Flatten `actions` / `action_values` lists into columns driven by a declarative table.
+
+    The table is compiled into one lookup per list, action_type -> [(column, key, cast)],
+    so each action in a record costs a single dict lookup however many action types
+    are configured, and every list is walked once.
+    """
+    SOURCES = {'count': ('actions', int, 0), 'value': ('action_values', float, 0.0)}
+
+    def __init__(self, action_columns=None):
+        self.defaults = {}
+        self.lookups = defaultdict(lambda: defaultdict(list))
+        for column, action_type, kind, window in action_columns or Config.ACTION_COLUMNS:
+            source, cast, default = self.SOURCES[kind]
+            self.lookups[source][action_type].append((column, window, cast))
+            self.defaults[column] = default
+        self.lookups = {source: dict(lookup) for source, lookup in self.lookups.items()}
+
+    def flatten(self, records, attribution_window=None):
+        """Replace the action lists of every record with the configured columns, in place.
+
+        Columns without a window of their own read `attribution_window`'s figure when
+        given, otherwise the action's 'value'.
+        """
+        defaults = self.defaults
+        default_key = attribution_window or 'value'
+        lookups = list(self.lookups.items())
+        for record in records:
+            record.update(defaults)
+            for source, lookup in lookups:
+                for action in record.pop(source, None) or ():
+                    targets = lookup.get(action.get('action_type'))
+                    if targets is None:
+                        continue
+                    for column, key, cast in targets:
+                        value = action.get(key or default_key)
+                        if value is not None:
+                            record[column] = cast(value)
+            # Any action list not in the table is dropped, as before
+            record.pop('actions', None)
+            record.pop('action_values', None)
+        return records
+
+    def fan_out(self, records, attribution_windows):
+        """One flattened row per record and window, each reading that window's figures"""
+        rows = []
+        for attribution_window in attribution_windows:
+            # Shallow copies: the action lists are only read, and popped from the copy
+            window_rows = self.flatten([dict(record) for record in records], attribution_window)
+            for row in window_rows:
+                row['attribution_window'] = attribution_window
+            rows.extend(window_rows)
+        return rows
+
+    def job_rows(self, records, attribution_window):
+        """Rows of one job's records: a combined job ('7d_click+1d_view') fans out to one row
+        per window, a single-window job reads its own window's figures, so both scheduling
+        modes produce the same columns"""
+        windows = attribution_window.split('+')
+        if len(windows) > 1:
+            return self.fan_out(records, windows)
+        for record in self.flatten(records, attribution_window):
+            record['attribution_window'] = attribution_window
+        return records
+
+
+def job_attribution_windows():
+    """Attribution windows as scheduled: one combined '+'-joined label per job, or one job per window"""
+    if Config.COMBINE_ATTRIBUTION_WINDOWS and len(Config.ATTRIBUTION_WINDOWS) > 1:
+        return ['+'.join(Config.ATTRIBUTION_WINDOWS)]
+    return list(Config.ATTRIBUTION_WINDOWS)
+
 
 class EnhancedAdsetDataFetcher:
-    def __init__(self, fb_client, deduplicator):
+    def __init__(self, fb_client, deduplicator, page_size=500, extractor=None):
         self.fb_client = fb_client
         self.deduplicator = deduplicator
-        self.max_poll_attempts = 40
-        self.poll_interval = 15
-
-    def fetch_all_attribution_windows(self, time_range):
-        """Fetch data for all attribution windows"""
-        all_data = []
-        for window in Config.ATTRIBUTION_WINDOWS:
-            print(f"\n--- Fetching for Attribution Window: {window} ---")
-            window_data = self.fetch_raw_adset_data(time_range, window)
-            if window_data:
-                all_data.extend(window_data)
-            time.sleep(1)  # Small delay between windows
-        return all_data
-
-    def _poll_async_job(self, async_job):
-        try:
-            job_id = async_job.get(AdReportRun.Field.id) or async_job.get('report_run_id')
-            if not job_id:
-                print("❌ Error: Could not get job ID from async_job")
-                return False
-
-            print(f"🔍 Polling async job ID: {job_id}")
-            for attempt in range(self.max_poll_attempts):
-                try:
-                    current_job_state = AdReportRun(job_id, api=self.fb_client.api).api_get(fields=[
-                        AdReportRun.Field.async_status,
-                        AdReportRun.Field.async_percent_completion,
-                    ])
-
-                    status = current_job_state.get(AdReportRun.Field.async_status, 'Unknown')
-                    percent = current_job_state.get(AdReportRun.Field.async_percent_completion, 0)
-
-                    print(f"📊 Job {job_id}: {status} ({percent}%) [Attempt {attempt + 1}/{self.max_poll_attempts}]")
-
-                    if status == 'Job Completed':
-                        async_job._data.update(current_job_state._data)
-                        print(f"✅ Async job {job_id} completed successfully")
-                        return True
-
-                    if status in ['Job Failed', 'Job Skipped']:
-                        print(f"❌ Async job {job_id} failed: {status}")
-                        return False
-
-                    time.sleep(self.poll_interval)
-
-                except Exception as e:
-                    print(f"⚠️ Error polling job {job_id} (attempt {attempt + 1}): {str(e)}")
-                    time.sleep(self.poll_interval)
-
-            print(f"⏰ Async job {job_id} timed out after {self.max_poll_attempts} attempts")
-            return False
-
-        except Exception as e:
-            print(f"💥 Critical error in polling: {str(e)}")
-            return False
-
-    def fetch_raw_adset_data(self, time_range, attribution_window):
-        print(f"\n📅 Starting data fetch for time range: {time_range}, window: {attribution_window}")
+        self.page_size = page_size
+        self.extractor = extractor or ActionExtractor()
 
+    def _build_insights_params(self, time_range, attribution_window):
         # Comprehensive fields list
         safe_fields = [
             'adset_name', 'adset_id', 'campaign_id', 'campaign_name',
@@ -164,81 +909,369 @@ class EnhancedAdsetDataFetcher:
             'video_p50_watched_actions', 'objective'
         ]
 
-        params = {
+        return {
             'level': 'ad',
             'time_range': time_range,
             'time_increment': 1,
             'fields': safe_fields,
-            'action_attribution_windows': [attribution_window],
+            'action_attribution_windows': attribution_window.split('+'),
             'breakdowns': ['country']
         }
 
-        try:
-            print("🚀 Starting async job for insights...")
-            async_job = self.fb_client.ad_account.get_insights(params=params, is_async=True)
+    def start_async_job(self, time_range, attribution_window):
+        """Submit an async insights job without waiting for it to finish"""
+        print(f"🚀 Starting async job for {self.fb_client.account_id}: {time_range}, window: {attribution_window}")
+        params = self._build_insights_params(time_range, attribution_window)
+        return self.fb_client.ad_account.get_insights(params=params, is_async=True)
+
+    def iter_result_pages(self, async_job, attribution_window, scope=None):
+        """Yield processed, de-duplicated records of a completed job one page at a time.
+
+        Only the current page is held, so memory stays bounded by `page_size` no
+        matter how long the date range is.
+        """
+        if Config.RESULT_DOWNLOAD == 'raw':
+            for insights in self.iter_raw_result_pages(async_job):
+                yield self._process_page(insights, attribution_window, scope)
+            return
+
+        page = []
+        for insight in async_job.get_result(params={'limit': self.page_size}):
+            page.append(insight)
+            if len(page) >= self.page_size:
+                yield self._process_page(page, attribution_window, scope)
+                page = []
+        if page:
+            yield self._process_page(page, attribution_window, scope)
+
+    def iter_raw_result_pages(self, async_job):
+        """Download a finished job's result pages as plain dicts.
+
+        Follows the same `after` cursors as the SDK's Cursor, but each page body is
+        parsed once and handed on as-is instead of becoming one AdsInsights object per row.
+        """
+        job_id = async_job.get(AdReportRun.Field.id) or async_job.get('report_run_id')
+        params = {'limit': self.page_size}
+        while True:
+            response = self.fb_client.api.call('GET', (job_id, 'insights'), params=params)
+            with run_metrics.span('parse'):
+                body = response.json()
+            yield body.get('data', [])
+            paging = body.get('paging', {})
+            if 'next' not in paging or 'after' not in paging.get('cursors', {}):
+                return
+            params['after'] = paging['cursors']['after']
+
+    def _process_page(self, insights, attribution_window, scope):
+        """Flatten a page of insights into records and drop the ones already seen.
+
+        A combined job ('7d_click+1d_view') becomes one row per window, each tagged with
+        its own attribution_window so the dedup key is the same as for single-window jobs.
+        """
+        records = [insight if type(insight) is dict else dict(insight) for insight in insights]
+        return self.deduplicator.filter_duplicates(self.extractor.job_rows(records, attribution_window), scope)
+
+
+class AsyncInsightsJob:
+    """One (account, time chunk, attribution window) async insights job"""
+
+    def __init__(self, fetcher, time_range, attribution_window):
+        self.fetcher = fetcher
+        self.account_id = fetcher.fb_client.account_id
+        self.time_range = time_range
+        self.attribution_window = attribution_window
+        self.async_job = None
+        self.job_id = None
+        self.status = 'Pending'
+        self.percent = 0
+        self.succeeded = False
+        self.started_at = None
+        self.last_polled_at = None
+        self.next_poll_at = 0
+        self.poll_interval = None
+        self.poll_errors = 0
+        self.finished_at = None
+        self.submitted_at = time.time()
+
+    def days(self):
+        return (datetime.strptime(self.time_range['until'], '%Y-%m-%d')
+                - datetime.strptime(self.time_range['since'], '%Y-%m-%d')).days + 1
+
+    def label(self):
+        return (f"{self.account_id} {self.time_range['since']}..{self.time_range['until']} "
+                f"[{self.attribution_window}]")
+
+
+class AsyncJobScheduler:
+    """Run many async insights jobs at once and poll them all from a single loop.
+
+    Jobs are started as soon as the per-account and global concurrency caps allow.
+    Each job is polled on its own schedule: the interval is derived from the
+    observed `async_percent_completion` rate and backs off when a job stalls.
+    A multi-day job that fails or times out is bisected and its halves requeued
+    instead of being reported; with a `sizer`, the failure also shrinks future chunks.
+    """
+
+    def __init__(self, max_jobs_per_account=None, max_jobs=None,
+                 min_poll_interval=5, max_poll_interval=60, job_timeout=600, max_poll_errors=5, sizer=None):
+        self.max_jobs_per_account = max_jobs_per_account or Config.MAX_CONCURRENT_JOBS_PER_ACCOUNT
+        self.max_jobs = max_jobs or Config.MAX_CONCURRENT_JOBS
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.job_timeout = job_timeout
+        self.max_poll_errors = max_poll_errors
+        self.sizer = sizer
+        self.pending = deque()
+        self.running = []
+        self.account_failures = defaultdict(int)
+
+    def submit(self, fetcher, time_range, attribution_window):
+        job = AsyncInsightsJob(fetcher, time_range, attribution_window)
+        self.pending.append(job)
+        return job
+
+    def record_failure(self, account_id):
+        """Count a failed unit and drop the account's queued jobs once it hits the limit"""
+        self.account_failures[account_id] += 1
+        if self.account_failures[account_id] >= Config.MAX_ACCOUNT_FAILURES:
+            dropped = [job for job in self.pending if job.account_id == account_id]
+            if dropped:
+                print(f"⚠️ Too many failures for account {account_id}. Skipping {len(dropped)} remaining jobs.")
+                self.pending = deque(job for job in self.pending if job.account_id != account_id)
 
-            if not self._poll_async_job(async_job):
-                print("❌ Failed to complete async job")
-                return None
-
-            results = async_job.get_result()
-            print(f"✅ Successfully retrieved {len(results) if results else 0} records")
-
-            if not results:
-                print("⚠️ No data returned from API")
-                return []
-
-            processed_data = []
-            for insight in results:
-                record = self._process_insight_record(insight)
-                record['attribution_window'] = attribution_window
-
-                if not self.deduplicator.is_duplicate(record):
-                    processed_data.append(record)
-
-            return processed_data
+    @staticmethod
+    def _governor_wait(job):
+        return job.fetcher.fb_client.api.governor.wait_time(job.account_id)
+
+    def _finish(self, job, succeeded):
+        job.succeeded = succeeded
+        job.finished_at = time.time()
+        if job.started_at:
+            run_metrics.add('async_job_queued', job.started_at - job.submitted_at, account=job.account_id)
+            run_metrics.add('async_job_running', job.finished_at - job.started_at, account=job.account_id)
+        run_metrics.count('async_jobs', status='succeeded' if succeeded else 'failed')
+        if job in self.running:
+            self.running.remove(job)
+        if not succeeded:
+            self.record_failure(job.account_id)
+        return job
+
+    def _start_ready_jobs(self):
+        """Start pending jobs while there is capacity; returns jobs that failed to start"""
+        failed = []
+        running_per_account = defaultdict(int)
+        for job in self.running:
+            running_per_account[job.account_id] += 1
+
+        deferred = deque()
+        while self.pending and len(self.running) < self.max_jobs:
+            job = self.pending.popleft()
+            if (running_per_account[job.account_id] >= self.max_jobs_per_account
+                    or self._governor_wait(job) > 0):
+                deferred.append(job)
+                continue
+            try:
+                job.async_job = job.fetcher.start_async_job(job.time_range, job.attribution_window)
+                job.job_id = job.async_job.get(AdReportRun.Field.id) or job.async_job.get('report_run_id')
+                if not job.job_id:
+                    raise ValueError("Could not get job ID from async_job")
+            except FacebookRequestError as e:
+                print(f"❌ Facebook API Error starting {job.label()}: {e.api_error_code()} - {e.api_error_message()}")
+                failed.append(self._finish(job, False))
+                continue
+            except Exception as e:
+                print(f"❌ Error starting {job.label()}: {e}")
+                failed.append(self._finish(job, False))
+                continue
+
+            job.started_at = time.time()
+            job.next_poll_at = job.started_at + self.min_poll_interval
+            self.running.append(job)
+            running_per_account[job.account_id] += 1
+
+        deferred.extend(self.pending)
+        self.pending = deferred
+        return failed
+
+    def _next_poll_interval(self, job, percent, now):
+        """Estimate when the job will be done from its completion rate"""
+        if job.last_polled_at and percent > job.percent:
+            rate = (percent - job.percent) / max(now - job.last_polled_at, 1e-3)
+            interval = (100 - percent) / rate / 2
+        elif job.poll_interval:
+            interval = job.poll_interval * 1.5
+        else:
+            interval = self.min_poll_interval
+        return min(max(interval, self.min_poll_interval), self.max_poll_interval)
+
+    def _poll(self, job):
+        """Poll a running job once; returns True when the job reached a final state"""
+        now = time.time()
+        wait = self._governor_wait(job)
+        if wait > 0:
+            job.next_poll_at = now + wait
+            return False
 
-        except FacebookRequestError as e:
-            print(f"❌ Facebook API Error: {e.api_error_code} - {e.api_error_message}")
-            return None
+        run_metrics.count('polls')
+        try:
+            current_job_state = AdReportRun(job.job_id, api=job.fetcher.fb_client.api).api_get(fields=[
+                AdReportRun.Field.async_status,
+                AdReportRun.Field.async_percent_completion,
+            ])
         except Exception as e:
-            print(f"💥 Unexpected error: {str(e)}")
-            traceback.print_exc()
-            return None
+            job.poll_errors += 1
+            print(f"⚠️ Error polling job {job.job_id} (error {job.poll_errors}/{self.max_poll_errors}): {str(e)}")
+            # The call already retried transient errors; polling again won't fix any other kind
+            if job.poll_errors >= self.max_poll_errors or not isinstance(e, RetryableError):
+                self._finish(job, False)
+                return True
+            job.next_poll_at = now + max(self.min_poll_interval, retry_policy.backoff(job.poll_errors, e.retry_after))
+            return False
 
-    def _process_insight_record(self, insight):
-        """Process individual insight record and calculate derived metrics"""
-        record = dict(insight)
+        job.status = current_job_state.get(AdReportRun.Field.async_status, 'Unknown')
+        percent = current_job_state.get(AdReportRun.Field.async_percent_completion, 0) or 0
+        print(f"📊 Job {job.job_id} ({job.label()}): {job.status} ({percent}%)")
 
-        # Initialize purchase metrics
-        record['purchases'] = 0
-        record['purchase_value'] = 0.0
-        record['post_shares'] = 0
-        record['view_content'] = 0
+        if job.status == 'Job Completed':
+            job.async_job._data.update(current_job_state._data)
+            job.percent = 100
+            print(f"✅ Async job {job.job_id} completed in {now - job.started_at:.0f}s")
+            self._finish(job, True)
+            return True
 
-        # Process actions and action_values
-        actions = record.get('actions', [])
-        action_values = record.get('action_values', [])
+        if job.status in ['Job Failed', 'Job Skipped']:
+            print(f"❌ Async job {job.job_id} failed: {job.status}")
+            return self._split_or_fail(job)
 
-        for action in actions:
-            if action.get('action_type') == 'post':
-                record['post_shares'] = int(action.get('value', 0))
-            if action.get('action_type') == 'purchase':
-                record['purchases'] = int(action.get('value', 0))
-            if action.get('action_type') == 'view_content':
-                record['view_content'] = int(action.get('value', 0))
+        if now - job.started_at >= self.job_timeout:
+            print(f"⏰ Async job {job.job_id} timed out after {self.job_timeout}s")
+            return self._split_or_fail(job)
 
-        for action_value in action_values:
-            if action_value.get('action_type') == 'purchase':
-                record['purchase_value'] = float(action_value.get('value', 0))
-            if action_value.get('action_type') == 'view_content':
-                record['view_content'] = float(action_value.get('value', 0))
+        job.poll_interval = self._next_poll_interval(job, percent, now)
+        job.percent = percent
+        job.last_polled_at = now
+        job.next_poll_at = now + job.poll_interval
+        return False
 
-        # Clean up
-        record.pop('actions', None)
-        record.pop('action_values', None)
+    def _split_or_fail(self, job):
+        """Requeue the two halves of a failed multi-day job, or finish it as failed"""
+        days = job.days()
+        if days < 2:
+            self._finish(job, False)
+            return True
+
+        if job in self.running:
+            self.running.remove(job)
+        if self.sizer:
+            self.sizer.observe_failure(job.account_id, days)
+        since = datetime.strptime(job.time_range['since'], '%Y-%m-%d')
+        middle = since + timedelta(days=days // 2)
+        halves = [{'since': job.time_range['since'], 'until': (middle - timedelta(days=1)).strftime('%Y-%m-%d')},
+                  {'since': middle.strftime('%Y-%m-%d'), 'until': job.time_range['until']}]
+        for half in halves:
+            self.pending.appendleft(AsyncInsightsJob(job.fetcher, half, job.attribution_window))
+        run_metrics.count('async_jobs', status='split')
+        print(f"✂️ Split {job.label()} into {halves[0]['since']}..{halves[0]['until']} "
+              f"and {halves[1]['since']}..{halves[1]['until']}")
+        return False
 
-        return record
+    def run(self):
+        """Yield every job as soon as it completes or fails"""
+        while self.pending or self.running:
+            for job in self._start_ready_jobs():
+                yield job
+
+            now = time.time()
+            for job in list(self.running):
+                if job.next_poll_at <= now and self._poll(job):
+                    yield job
+
+            if self.running:
+                wake_at = min(job.next_poll_at for job in self.running)
+                idle = max(0, wake_at - time.time())
+                run_metrics.count('sleep_seconds', idle, reason='poll_wait')
+                time.sleep(idle)
+            elif self.pending:
+                # Every queued account is waiting for rate-limit headroom
+                idle = max(min(self._governor_wait(job) for job in self.pending), 1)
+                run_metrics.count('sleep_seconds', idle, reason='governor')
+                time.sleep(idle)
+
+
+class ChunkSizer:
+    """Per-account job sizing learned from the rows/day and job seconds/day of past runs.
+
+    Observations are kept as moving averages in SQLite so sizing carries across runs.
+    Job time is modelled as a fixed overhead plus seconds/day. A failed or timed-out
+    job halves the account's day cap; every job that succeeds at the cap grows it by
+    a quarter again. Accounts without history get `Config.MAX_CHUNK_DAYS`.
+    """
+    JOB_OVERHEAD_SECONDS = 30
+
+    def __init__(self, db_path, target_rows=None, target_seconds=None, max_days=None, smoothing=0.3):
+        self.target_rows = target_rows or Config.TARGET_ROWS_PER_JOB
+        self.target_seconds = target_seconds or Config.TARGET_JOB_SECONDS
+        self.max_days = max_days or Config.MAX_CHUNK_DAYS
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS account_density (account_id TEXT PRIMARY KEY, '
+                         'rows_per_day REAL, seconds_per_day REAL, day_cap INTEGER, jobs INTEGER)')
+        self._db.commit()
+
+    def _estimates(self, account_id):
+        row = self._db.execute('SELECT rows_per_day, seconds_per_day, day_cap, jobs FROM account_density '
+                               'WHERE account_id = ?', (account_id,)).fetchone()
+        return row or (None, None, None, 0)
+
+    def _save(self, account_id, rows_per_day, seconds_per_day, day_cap, jobs):
+        self._db.execute('INSERT OR REPLACE INTO account_density VALUES (?, ?, ?, ?, ?)',
+                         (account_id, rows_per_day, seconds_per_day, day_cap, jobs))
+        self._db.commit()
+
+    def observe(self, account_id, days, rows, seconds):
+        """Learn from a completed job covering `days` days"""
+        rows_per_day = rows / days
+        seconds_per_day = max(seconds - self.JOB_OVERHEAD_SECONDS, 0) / days
+        with self._lock:
+            old_rows, old_seconds, day_cap, jobs = self._estimates(account_id)
+            a = self.smoothing
+            if old_rows is not None:
+                rows_per_day = (1 - a) * old_rows + a * rows_per_day
+            if old_seconds is not None:
+                seconds_per_day = (1 - a) * old_seconds + a * seconds_per_day
+            if day_cap and days >= day_cap:
+                day_cap = day_cap + max(day_cap // 4, 1)
+                day_cap = day_cap if day_cap < self.max_days else None
+            self._save(account_id, rows_per_day, seconds_per_day, day_cap, jobs + 1)
+
+    def observe_failure(self, account_id, days):
+        """A job over `days` days failed or timed out: cap the account below it"""
+        with self._lock:
+            rows_per_day, seconds_per_day, day_cap, jobs = self._estimates(account_id)
+            day_cap = max(1, min(day_cap or days, days // 2))
+            self._save(account_id, rows_per_day, seconds_per_day, day_cap, jobs + 1)
+
+    def chunk_days(self, account_id):
+        with self._lock:
+            rows_per_day, seconds_per_day, day_cap, _ = self._estimates(account_id)
+        limits = [self.max_days, day_cap or self.max_days]
+        if rows_per_day:
+            limits.append(self.target_rows / rows_per_day)
+        if seconds_per_day:
+            limits.append((self.target_seconds - self.JOB_OVERHEAD_SECONDS) / seconds_per_day)
+        return max(1, int(min(limits)))
+
+    def plan(self, account_id, time_range):
+        """Split a range into equal chunks no longer than the account's chunk size"""
+        total = (datetime.strptime(time_range['until'], '%Y-%m-%d')
+                 - datetime.strptime(time_range['since'], '%Y-%m-%d')).days + 1
+        chunks = -(-total // self.chunk_days(account_id))
+        return split_time_range(time_range['since'], time_range['until'], days=-(-total // chunks))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
 
 
 def split_time_range(start_date_str, end_date_str, days=560):
@@ -258,136 +1291,876 @@ def split_time_range(start_date_str, end_date_str, days=560):
     return date_ranges
 
 
-def process_account(account_id, time_chunks, deduplicator):
-    """Process a single account with all its time chunks"""
-    account_data = []
-    account_failures = 0
+def process_account(account_id, time_range, deduplicator, scheduler, ledger, sizer):
+    """Initialize a single account and queue sized jobs for every day the ledger hasn't completed"""
+    units = [(chunk, window) for window in job_attribution_windows()
+             for gap in ledger.uncovered(account_id, time_range, window)
+             for chunk in sizer.plan(account_id, gap)]
+    if not units:
+        print(f"⏭️ All units for account {account_id} already completed")
+        return None
 
     try:
-        fb_client = EnhancedFacebookAPIClient(account_id)
-        fetcher = EnhancedAdsetDataFetcher(fb_client, deduplicator)
-
-        for i, chunk in enumerate(time_chunks):
-            print(f"\n📅 Processing chunk {i+1}/{len(time_chunks)} for account {account_id} - {chunk['since']} to {chunk['until']}")
-            start_time = time.time()
-
-            try:
-                raw_data = fetcher.fetch_all_attribution_windows(chunk)
+        with run_metrics.span('account_init', account=account_id):
+            fb_client = EnhancedFacebookAPIClient(account_id)
+    except Exception as e:
+        print(f"❌ Critical error initializing account {account_id}: {e}")
+        return None
 
-                if raw_data is None:
-                    print("⚠️ No data returned for this chunk. Skipping.")
-                    account_failures += 1
-                else:
-                    account_data.extend(raw_data)
-                    print(f"✅ Successfully processed chunk. Total records so far: {len(account_data)}")
+    fetcher = EnhancedAdsetDataFetcher(fb_client, deduplicator)
+    for chunk, window in units:
+        scheduler.submit(fetcher, chunk, window)
 
-                elapsed = time.time() - start_time
-                print(f"⏱️ Time for this chunk: {elapsed:.2f}s")
+    print(f"📥 Queued {len(units)} jobs for account {account_id} ({sizer.chunk_days(account_id)} days per job)")
+    return fetcher
 
-                # Add delay between chunks to avoid rate limiting
-                if i < len(time_chunks) - 1:
-                    print("⏳ Sleeping for 2 minutes before next chunk...")
-                    time.sleep(120)  # 2 minutes delay
 
-            except Exception as e:
-                print(f"❌ Error processing chunk {i+1} for account {account_id}: {e}")
-                account_failures += 1
-                if account_failures >= Config.MAX_ACCOUNT_FAILURES:
-                    print(f"⚠️ Too many failures for account {account_id}. Skipping remaining chunks.")
-                    break
+class ProgressLedger:
+    """Durable record of finished (account, time chunk, attribution window) units.
 
-    except Exception as e:
-        print(f"❌ Critical error initializing account {account_id}: {e}")
-        return None
+    Every unit streams into its own shard file. The shard is moved into place and
+    the unit is committed together, so a restarted run skips completed units and
+    requeues only the failed or missing ones.
+    """
 
-    return account_data
+    def __init__(self, checkpoint_dir, run_name, extension='jsonl'):
+        self.extension = extension
+        self.shard_dir = os.path.join(checkpoint_dir, run_name)
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(checkpoint_dir, f"{run_name}.sqlite"), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS units (
+                account_id TEXT, since TEXT, until TEXT, attribution_window TEXT,
+                status TEXT, shard_path TEXT, rows INTEGER, updated_at TEXT,
+                PRIMARY KEY (account_id, since, until, attribution_window)
+            )""")
+        self._db.commit()
 
-
-def save_data(account_id, data, combined_data):
-    """Save data for individual account and add to combined dataset"""
+    @staticmethod
+    def unit_key(account_id, time_range, attribution_window):
+        return f"{account_id}_{time_range['since']}_{time_range['until']}_{attribution_window}"
+
+    def shard_path(self, account_id, time_range, attribution_window):
+        return os.path.join(self.shard_dir,
+                            f"{self.unit_key(account_id, time_range, attribution_window)}.{self.extension}")
+
+    def _done_units(self, account_id, time_range, attribution_window):
+        with self._lock:
+            return self._db.execute(
+                "SELECT since, until, shard_path FROM units WHERE account_id = ? AND attribution_window = ? "
+                "AND status = 'done' AND since >= ? AND until <= ? ORDER BY since",
+                (account_id, attribution_window, time_range['since'], time_range['until'])).fetchall()
+
+    def uncovered(self, account_id, time_range, attribution_window):
+        """Sub-ranges of time_range that no completed unit covers.
+
+        Coverage is by day rather than by exact chunk, so a rerun whose chunks were
+        sized differently (or bisected) still skips everything already written.
+        """
+        gaps = []
+        cursor = datetime.strptime(time_range['since'], '%Y-%m-%d')
+        for since, until, _ in self._done_units(account_id, time_range, attribution_window):
+            since = datetime.strptime(since, '%Y-%m-%d')
+            if since > cursor:
+                gaps.append({'since': cursor.strftime('%Y-%m-%d'),
+                             'until': (since - timedelta(days=1)).strftime('%Y-%m-%d')})
+            cursor = max(cursor, datetime.strptime(until, '%Y-%m-%d') + timedelta(days=1))
+        if cursor <= datetime.strptime(time_range['until'], '%Y-%m-%d'):
+            gaps.append({'since': cursor.strftime('%Y-%m-%d'), 'until': time_range['until']})
+        return gaps
+
+    def _record(self, account_id, time_range, attribution_window, status, shard_path=None, rows=0):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (account_id, time_range['since'], time_range['until'], attribution_window,
+                 status, shard_path, rows, datetime.now().isoformat(timespec='seconds')))
+            self._db.commit()
+
+    def commit_unit(self, account_id, time_range, attribution_window, tmp_path, rows):
+        """Move a fully written shard into place and mark its unit as done"""
+        shard_path = self.shard_path(account_id, time_range, attribution_window)
+        if rows:
+            os.replace(tmp_path, shard_path)
+        else:
+            shard_path = None
+        self._record(account_id, time_range, attribution_window, 'done', shard_path, rows)
+
+    def mark_failed(self, account_id, time_range, attribution_window):
+        self._record(account_id, time_range, attribution_window, 'failed')
+
+    def completed_shards(self, account_id, time_range, attribution_windows):
+        """Shard paths covering time_range, or None unless every day of it is done"""
+        shard_paths = []
+        for attribution_window in attribution_windows:
+            if self.uncovered(account_id, time_range, attribution_window):
+                return None
+            shard_paths.extend(shard_path for _, _, shard_path
+                               in self._done_units(account_id, time_range, attribution_window) if shard_path)
+        return shard_paths
+
+    def completed_units(self):
+        """(account_id, shard_path, rows) of every completed unit, in a stable order"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT account_id, shard_path, rows FROM units WHERE status = 'done' "
+                "ORDER BY account_id, since, attribution_window").fetchall()
+
+    def covers(self, account_id, since, until):
+        """True once every day of since..until is done for every attribution window"""
+        return self.completed_shards(account_id, {'since': since, 'until': until},
+                                     job_attribution_windows()) is not None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def discard(self):
+        """Close the ledger and delete its shards and database.
+
+        Called once the run's output is written, so only a crashed or incomplete run
+        resumes from checkpoints and a rerun of the same range fetches fresh data.
+        """
+        self.close()
+        shutil.rmtree(self.shard_dir, ignore_errors=True)
+        os.remove(f"{self.shard_dir}.sqlite")
+
+
+class IncrementalState:
+    """Per-account high-water mark (last day fully written) persisted in SQLite."""
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS high_water (
+            account_id TEXT PRIMARY KEY, last_day TEXT, updated_at REAL)""")
+        self.conn.commit()
+
+    def window(self, account_id, end_date, lookback_days, initial_days):
+        """New days since the mark, widened to the trailing lookback (initial_days without a mark)."""
+        with self.lock:
+            row = self.conn.execute("SELECT last_day FROM high_water WHERE account_id = ?",
+                                    (account_id,)).fetchone()
+        end = datetime.strptime(end_date, "%Y-%m-%d").date()
+        if row is None:
+            start = end - timedelta(days=initial_days - 1)
+        else:
+            start = min(datetime.strptime(row[0], "%Y-%m-%d").date() + timedelta(days=1),
+                        end - timedelta(days=lookback_days - 1))
+        return start.isoformat(), end_date
+
+    def advance(self, account_id, last_day):
+        with self.lock:
+            self.conn.execute("""INSERT INTO high_water VALUES (?, ?, ?) ON CONFLICT (account_id) DO UPDATE SET
+                last_day = MAX(last_day, excluded.last_day), updated_at = excluded.updated_at""",
+                (account_id, last_day, time.time()))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class JsonlWriter:
+    """Append records to a JSONL file as they arrive; safe to share between threads"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows_written = 0
+        self.sample_record = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write_batch(self, records):
+        with run_metrics.span('serialize') as span:
+            lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+            span['rows'] = len(records)
+        with self._lock, run_metrics.span('write'):
+            # Opened lazily so runs without data don't leave an empty file behind
+            if self._file is None:
+                self._file = open(self.filename, 'w', encoding='utf-8')
+            self._file.write(lines)
+            self.rows_written += len(records)
+            if self.sample_record is None and records:
+                self.sample_record = records[0]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# Explicit column types for the Parquet output; everything else Meta returns is dropped
+META_SCHEMA = pa.schema([
+    ('account_id', pa.string()), ('source_account_id', pa.string()),
+    ('campaign_id', pa.string()), ('campaign_name', pa.string()),
+    ('adset_id', pa.string()), ('adset_name', pa.string()),
+    ('ad_id', pa.string()), ('ad_name', pa.string()),
+    ('objective', pa.string()), ('country', pa.string()), ('attribution_window', pa.string()),
+    ('date_start', pa.date32()), ('date_stop', pa.date32()),
+    ('impressions', pa.int64()), ('clicks', pa.int64()), ('reach', pa.int64()),
+    ('unique_clicks', pa.int64()), ('inline_link_clicks', pa.int64()),
+    ('spend', pa.float64()), ('frequency', pa.float64()),
+    *[(column, pa.int64() if kind == 'count' else pa.float64()) for column, _, kind, _ in Config.ACTION_COLUMNS],
+    # Action lists are kept as JSON strings
+    ('unique_outbound_clicks', pa.string()), ('video_avg_time_watched_actions', pa.string()),
+    ('video_p25_watched_actions', pa.string()), ('video_p50_watched_actions', pa.string()),
+    ('video_p100_watched_actions', pa.string()),
+])
+
+
+def records_to_table(records, schema):
+    """Build a typed Arrow table from flat dicts of API strings and Python values"""
+    columns = []
+    for field in schema:
+        values = [record.get(field.name) for record in records]
+        if pa.types.is_string(field.type):
+            values = [value if value is None or isinstance(value, str)
+                      else json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+                      for value in values]
+            columns.append(pa.array(values, pa.string()))
+            continue
+
+        # The API returns numbers and dates as strings; let Arrow parse them in bulk
+        strings = pa.array([None if value in (None, '') else str(value) for value in values], pa.string())
+        try:
+            columns.append(strings.cast(field.type))
+        except pa.ArrowInvalid:
+            columns.append(strings.cast(pa.float64()).cast(field.type, safe=False))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class ParquetRecordWriter:
+    """Write records as zstd-compressed Parquet row groups with an explicit schema"""
+
+    def __init__(self, filename, schema=META_SCHEMA, compression='zstd'):
+        self.filename = filename
+        self.schema = schema
+        self.compression = compression
+        self.rows_written = 0
+        self.sample_record = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def write_batch(self, records):
+        if not records:
+            return
+        with run_metrics.span('serialize') as span:
+            table = records_to_table(records, self.schema)
+            span['rows'] = len(records)
+        with self._lock, run_metrics.span('write'):
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.filename, self.schema, compression=self.compression)
+            self._writer.write_table(table)
+            self.rows_written += len(records)
+            if self.sample_record is None:
+                self.sample_record = records[0]
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+OUTPUT_WRITERS = {'jsonl': JsonlWriter, 'parquet': ParquetRecordWriter}
+
+
+class BigQueryLoader:
+    """Batch-load finished output files into a BigQuery table"""
+
+    SOURCE_FORMATS = {'jsonl': 'NEWLINE_DELIMITED_JSON', 'parquet': 'PARQUET'}
+
+    def __init__(self, table_id):
+        from google.cloud import bigquery
+        self.bigquery = bigquery
+        self.client = bigquery.Client()
+        self.table_id = table_id
+
+    def load(self, path, output_format):
+        job_config = self.bigquery.LoadJobConfig(
+            source_format=self.SOURCE_FORMATS[output_format],
+            write_disposition=self.bigquery.WriteDisposition.WRITE_APPEND,
+            autodetect=output_format == 'jsonl',
+        )
+        with open(path, 'rb') as f:
+            job = self.client.load_table_from_file(f, self.table_id, job_config=job_config)
+        job.result()
+        return job.output_rows
+
+
+class LocalLoader:
+    """Filesystem stand-in for BigQueryLoader: each load appends a file to the table directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, path, output_format):
+        shutil.copy(path, os.path.join(self.directory, os.path.basename(path)))
+        if output_format == 'parquet':
+            return pq.ParquetFile(path).metadata.num_rows
+        with open(path, encoding='utf-8') as f:
+            return sum(1 for _ in f)
+
+
+def build_loader():
+    if Config.BQ_TABLE:
+        return BigQueryLoader(Config.BQ_TABLE)
+    if Config.LOCAL_LOAD_DIR:
+        return LocalLoader(Config.LOCAL_LOAD_DIR)
+    return None
+
+
+def save_data(account_id, data, writer):
+    """Tag a page of records with its account and stream it to the writer"""
     if not data:
         return
 
-    # Add to combined data (with account ID for tracking)
     for record in data:
         record['source_account_id'] = account_id
-    combined_data.extend(data)
+    writer.write_batch(data)
 
 
-def main():
-    print("🚀 Starting Multi-Account Facebook Ads Data Fetcher")
+def stream_job_results(job, ledger, sizer=None):
+    """Stream a completed job's results into its shard and commit the unit.
+
+    Returns the number of rows written, or None when the unit failed.
+    """
+    scope = ledger.unit_key(job.account_id, job.time_range, job.attribution_window)
+    tmp_path = ledger.shard_path(job.account_id, job.time_range, job.attribution_window) + '.tmp'
+    try:
+        with run_metrics.span('stream_results', account=job.account_id,
+                              chunk=f"{job.time_range['since']}..{job.time_range['until']}") as span, \
+                OUTPUT_WRITERS[Config.OUTPUT_FORMAT](tmp_path) as writer:
+            for page in job.fetcher.iter_result_pages(job.async_job, job.attribution_window, scope):
+                save_data(job.account_id, page, writer)
+            span['rows'] = writer.rows_written
+        ledger.commit_unit(job.account_id, job.time_range, job.attribution_window, tmp_path, writer.rows_written)
+        job.fetcher.deduplicator.commit_scope(scope)
+    except Exception as e:
+        if isinstance(e, FacebookRequestError):
+            print(f"❌ Facebook API Error for {job.label()}: {e.api_error_code()} - {e.api_error_message()}")
+        else:
+            print(f"💥 Unexpected error for {job.label()}: {str(e)}")
+            traceback.print_exc()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        job.fetcher.deduplicator.release_scope(scope)
+        ledger.mark_failed(job.account_id, job.time_range, job.attribution_window)
+        return None
+
+    if sizer:
+        sizer.observe(job.account_id, job.days(), writer.rows_written, job.finished_at - job.started_at)
+    print(f"✅ Successfully retrieved {writer.rows_written} records for {job.label()}")
+    return writer.rows_written
+
+
+def merge_shards(ledger, combined_filename):
+    """Concatenate the shards of all completed units into the combined output file"""
+    account_rows = defaultdict(int)
+    shard_paths = []
+    for account_id, shard_path, rows in ledger.completed_units():
+        account_rows[account_id] += rows
+        if shard_path:
+            shard_paths.append(shard_path)
+
+    if Config.OUTPUT_FORMAT == 'parquet':
+        # Copy row group by row group so memory stays bounded by one shard's row group
+        with pq.ParquetWriter(combined_filename, META_SCHEMA, compression='zstd') as combined:
+            for shard_path in shard_paths:
+                shard = pq.ParquetFile(shard_path)
+                for i in range(shard.num_row_groups):
+                    combined.write_table(shard.read_row_group(i))
+        return account_rows
+
+    with open(combined_filename, 'w', encoding='utf-8') as combined:
+        for shard_path in shard_paths:
+            with open(shard_path, encoding='utf-8') as shard:
+                shutil.copyfileobj(shard, combined)
+    return account_rows
+
+
+class PartitionedWriter:
+    """Write platform/account/day partitions as size-capped, compressed shards plus a manifest.
+
+    Rows are buffered per (account, day) partition and cut into a shard whenever the
+    buffer passes `max_shard_bytes`; shards are serialized and compressed on a
+    background pool. Partitions are replaced, not appended to: `commit(account)` waits
+    for the account's shards, removes what earlier runs left in the partitions it
+    replaced and records the new shards in `_manifest.json` with row counts and
+    SHA-256 checksums, so loaders can pick up only the partitions that changed.
+    Shard writes are timed on `metrics` (a RunMetrics).
+    """
+
+    JSONL_EXTENSIONS = {"gzip": "jsonl.gz", "zstd": "jsonl.zst", None: "jsonl"}
+
+    def __init__(self, root, platform, output_format, max_shard_bytes=128 * 1024 * 1024, compression="gzip",
+                 workers=4, metrics=None):
+        self.root = os.path.join(root, f"platform={platform}")
+        self.platform = platform
+        self.output_format = output_format
+        self.max_shard_bytes = max_shard_bytes
+        # Parquet shards are always zstd inside the file; JSONL shards are compressed whole
+        self.compression = None if output_format == "parquet" else compression
+        self.extension = "parquet" if output_format == "parquet" else self.JSONL_EXTENSIONS[self.compression]
+        self.run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+        self.changed = []
+        self.metrics = metrics or RunMetrics(platform)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self._buffers = {}  # (account, day) -> [batches, buffered bytes]
+        self._shards = defaultdict(list)  # (account, day) -> shard futures
+        self._replaced = defaultdict(set)  # account -> days rewritten by this run
+        self._manifest_path = os.path.join(self.root, "_manifest.json")
+        self.manifest = {"platform": platform, "partitions": {}}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def partition_dir(self, account_id, day):
+        return os.path.join(self.root, f"account={account_id}", f"day={day}")
+
+    def replace(self, account_id, days):
+        """Mark the account's partitions for `days` as rewritten by this run, rows or not"""
+        with self.lock:
+            self._replaced[account_id].update(days)
+
+    def write(self, account_id, day, batch):
+        """Buffer a batch for a partition: an Arrow table for parquet, JSON lines for jsonl"""
+        parquet = self.output_format == "parquet"
+        rows = batch.num_rows if parquet else len(batch)
+        size = batch.nbytes if parquet else sum(len(line) for line in batch)
+        # Batches bigger than a shard are cut up so every shard stays near max_shard_bytes
+        step = -(-rows // max(1, -(-size // self.max_shard_bytes))) or 1
+        with self.lock:
+            self._replaced[account_id].add(day)
+            for offset in range(0, rows, step):
+                piece = batch.slice(offset, step) if parquet else batch[offset:offset + step]
+                buffer = self._buffers.setdefault((account_id, day), [[], 0])
+                buffer[0].append(piece)
+                buffer[1] += size * min(step, rows - offset) // rows
+                if buffer[1] >= self.max_shard_bytes:
+                    self._submit(account_id, day)
+
+    def _submit(self, account_id, day):
+        # Caller holds the lock
+        batches, _ = self._buffers.pop((account_id, day))
+        shards = self._shards[(account_id, day)]
+        name = f"part-{self.run_id}-{len(shards):05d}.{self.extension}"
+        shards.append(self._pool.submit(self._write_shard, os.path.join(self.partition_dir(account_id, day), name),
+                                        batches))
+
+    def _write_shard(self, path, batches):
+        with self.metrics.span("write_shard") as span:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            if self.output_format == "parquet":
+                table = pa.concat_tables(batches)
+                pq.write_table(table, tmp_path, compression="zstd")
+                rows = table.num_rows
+            else:
+                rows = sum(len(batch) for batch in batches)
+                stream = (pa.CompressedOutputStream(tmp_path, self.compression) if self.compression
+                          else pa.OSFile(tmp_path, "wb"))
+                with stream:
+                    for batch in batches:
+                        stream.write("".join(batch).encode("utf-8"))
+            digest = hashlib.sha256()
+            with open(tmp_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            os.replace(tmp_path, path)
+            span["rows"] = rows
+        return {"path": os.path.relpath(path, self.root), "rows": rows,
+                "bytes": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+    def commit(self, account_id):
+        """Finish the account's shards and swap them in for its previous partitions.
+
+        Returns the rows written per replaced day. If any shard fails, the shards this
+        run already wrote for the account are removed and the old partitions stay.
+        """
+        with self.lock:
+            for key in [key for key in self._buffers if key[0] == account_id]:
+                self._submit(*key)
+            days = sorted(self._replaced.pop(account_id, ()))
+            futures = {day: self._shards.pop((account_id, day), []) for day in days}
+
+        try:
+            shards = {day: [future.result() for future in day_futures] for day, day_futures in futures.items()}
+        except Exception:
+            self._remove_shards(future for day_futures in futures.values() for future in day_futures)
+            raise
+
+        written = {}
+        with self.lock:
+            for day, day_shards in shards.items():
+                directory = self.partition_dir(account_id, day)
+                keep = {os.path.basename(shard["path"]) for shard in day_shards}
+                if os.path.isdir(directory):
+                    for name in os.listdir(directory):
+                        if name not in keep:
+                            os.remove(os.path.join(directory, name))
+                    if not keep:
+                        os.rmdir(directory)
+                key = f"account={account_id}/day={day}"
+                written[day] = sum(shard["rows"] for shard in day_shards)
+                if day_shards:
+                    self.manifest["partitions"][key] = {"account": account_id, "date": day, "run_id": self.run_id,
+                                                        "rows": written[day], "shards": day_shards}
+                else:
+                    self.manifest["partitions"].pop(key, None)
+                self.changed.append(key)
+            self._save_manifest()
+        return written
+
+    def discard(self, account_id):
+        """Drop what this run buffered or wrote for the account; its previous partitions stay"""
+        with self.lock:
+            for key in [key for key in self._buffers if key[0] == account_id]:
+                del self._buffers[key]
+            self._replaced.pop(account_id, None)
+            futures = [future for key in [key for key in self._shards if key[0] == account_id]
+                       for future in self._shards.pop(key)]
+        self._remove_shards(futures)
+
+    def _remove_shards(self, futures):
+        for future in futures:
+            if future.exception() is None:
+                os.remove(os.path.join(self.root, future.result()["path"]))
+
+    def _save_manifest(self):
+        # Caller holds the lock
+        os.makedirs(self.root, exist_ok=True)
+        self.manifest["updated_at"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        with open(self._manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(self._manifest_path + ".tmp", self._manifest_path)
+
+    def close(self):
+        with self.lock:
+            pending = {account_id for account_id, _ in self._buffers} | set(self._replaced)
+        for account_id in pending:
+            self.commit(account_id)
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(cancel_futures=True)
+
+
+def partition_writer(root, output_format):
+    return PartitionedWriter(root, 'meta', output_format, Config.SHARD_MAX_BYTES, Config.JSONL_COMPRESSION,
+                             Config.COMPRESSION_WORKERS, run_metrics)
+
+
+# Cross-platform fact table: one typed row per (day, ad, country, attribution window) with
+# the same columns and units in all three pipelines, so dashboards scan a single table
+FACT_SCHEMA = pa.schema([
+    ("date", pa.date32()), ("platform", pa.string()), ("account_id", pa.string()),
+    ("campaign_id", pa.string()), ("adgroup_id", pa.string()), ("ad_id", pa.string()),
+    ("country", pa.string()), ("attribution_window", pa.string()),
+    # Money is in major units of the account currency (never cents or micros)
+    ("spend", pa.float64()), ("impressions", pa.int64()), ("clicks", pa.int64()),
+    ("purchases", pa.int64()), ("purchase_value", pa.float64()),
+])
+
+
+def fact_table(platform, num_rows, columns):
+    """Build a FACT_SCHEMA table from conformed columns; columns not given are null"""
+    columns = dict(columns, platform=pa.repeat(pa.scalar(platform), num_rows))
+    return pa.Table.from_arrays([pc.cast(columns[field.name], field.type, safe=False) if field.name in columns
+                                 else pa.nulls(num_rows, field.type) for field in FACT_SCHEMA], schema=FACT_SCHEMA)
+
+
+def meta_facts(table):
+    """Conform a META_SCHEMA table to FACT_SCHEMA"""
+    columns = {
+        'date': table['date_start'], 'account_id': table['account_id'],
+        'campaign_id': table['campaign_id'], 'adgroup_id': table['adset_id'], 'ad_id': table['ad_id'],
+        'country': pc.utf8_upper(table['country']), 'attribution_window': table['attribution_window'],
+        'spend': table['spend'], 'impressions': table['impressions'], 'clicks': table['clicks'],
+    }
+    # Present unless removed from Config.ACTION_COLUMNS
+    for column in ('purchases', 'purchase_value'):
+        if column in table.column_names:
+            columns[column] = table[column]
+    return fact_table('meta', table.num_rows, columns)
+
+
+def meta_day_parts(shard_paths):
+    """(day, rows, to_facts) pieces for write_day_partitions, read one shard at a time
+    so memory stays bounded by a single shard"""
+    for shard_path in shard_paths:
+        if Config.OUTPUT_FORMAT == 'parquet':
+            table = pq.read_table(shard_path, schema=META_SCHEMA)
+            for day in pc.unique(table['date_start']).to_pylist():
+                if day is not None:
+                    day_table = table.filter(pc.equal(table['date_start'], pa.scalar(day, pa.date32())))
+                    yield day.isoformat(), day_table, lambda day_table=day_table: meta_facts(day_table)
+        else:
+            lines_by_day = defaultdict(list)
+            records_by_day = defaultdict(list)
+            with open(shard_path, encoding='utf-8') as shard:
+                for line in shard:
+                    record = json.loads(line)
+                    lines_by_day[record.get('date_start')].append(line)
+                    records_by_day[record.get('date_start')].append(record)
+            for day, lines in lines_by_day.items():
+                yield day, lines, lambda records=records_by_day[day]: meta_facts(records_to_table(records, META_SCHEMA))
+
+
+def write_day_partitions(writer, account_id, day_parts, days, facts=None):
+    """Replace the account's partition for every day in `days` with the rows of `day_parts`.
+
+    `day_parts` yields (day, rows, to_facts) for each piece of a day: `rows` as
+    `writer.write` takes them (a table or JSONL lines) and `to_facts()` building the
+    piece's fact-table rows. Days without rows drop any earlier partition. With a
+    `facts` writer the same days of the fact table are replaced too; `writer` may be
+    None to build only the facts. Returns the number of rows written per day.
+    """
+    writers = [w for w in (writer, facts) if w is not None]
+    for w in writers:
+        w.replace(account_id, days)
+    wanted = set(days)
+    try:
+        for day, rows, to_facts in day_parts:
+            if day in wanted:
+                if writer:
+                    writer.write(account_id, day, rows)
+                if facts:
+                    facts.write(account_id, day, to_facts())
+        return [w.commit(account_id) for w in writers][0]
+    except Exception:
+        # Also undoes the fact shards when only the output commit went through
+        for w in writers:
+            w.discard(account_id)
+        raise
+
+
+def date_range(start_date, end_date):
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+def publish_partitions(ledger, account_windows, state=None, output=True):
+    """Replace the day partitions of every fully completed account and advance its high-water mark.
+
+    Accounts with a failed or missing unit keep their previous partitions and mark,
+    so the next run fetches the same days again. The account's days of the fact table
+    are replaced alongside (Config.FACT_DIR); with output=False only those are.
+    """
+    account_rows = {}
+    with ExitStack() as stack:
+        writer = (stack.enter_context(partition_writer(Config.PARTITION_DIR, Config.OUTPUT_FORMAT))
+                  if output else None)
+        facts = stack.enter_context(partition_writer(Config.FACT_DIR, 'parquet')) if Config.FACT_DIR else None
+        for account_id, (since, until) in account_windows.items():
+            shard_paths = ledger.completed_shards(account_id, {'since': since, 'until': until},
+                                                  job_attribution_windows())
+            if shard_paths is None:
+                print(f"⚠️ Account {account_id} has unfinished units; partitions and high-water mark left unchanged")
+                continue
+            try:
+                written = write_day_partitions(writer, account_id, meta_day_parts(shard_paths), date_range(since, until), facts)
+            except Exception as e:
+                print(f"❌ Failed to write partitions for account {account_id}: {e}")
+                continue
+            account_rows[account_id] = sum(written.values())
+            if state:
+                state.advance(account_id, until)
+            print(f"🗂️ Account {account_id}: replaced {len(written)} day partitions{'' if output else ' of the fact table'} ({since} to {until})")
+    return account_rows
+
+
+def read_sample_record(filename):
+    if Config.OUTPUT_FORMAT == 'parquet':
+        return pq.ParquetFile(filename).read_row_group(0).slice(0, 1).to_pylist()[0]
+    with open(filename, encoding='utf-8') as f:
+        return json.loads(f.readline())
+
+
+def run(full_start, full_end, account_windows=None, state=None):
+    """Extract every account for full_start..full_end, write the output and return the run summary.
+
+    `account_windows` gives accounts their own (since, until) inside the full range.
+    With an IncrementalState as `state` (or Config.OUTPUT_LAYOUT = 'partitioned'), output
+    goes to platform/account/day partitions instead of the combined file; with a state,
+    each completed account's high-water mark is advanced as well.
+    """
     start_time = time.time()
+    run_metrics.reset()
+    account_windows = account_windows or {account_id: (full_start, full_end) for account_id in Config.AD_ACCOUNT_IDS}
+    account_ids = list(account_windows)
+
+    partitioned = state is not None or Config.OUTPUT_LAYOUT == 'partitioned'
 
     # Initialize deduplication manager
     deduplicator = DeduplicationManager()
 
-    # Define your total range (10 days as requested)
-    full_start = (datetime.now() - timedelta(days=403)).strftime('%Y-%m-%d')
-    full_end = (datetime.now() - timedelta(days=393)).strftime('%Y-%m-%d')
-    time_chunks = split_time_range(full_start, full_end)
     time_range_str = f"{full_start.replace('-', '_')}_to_{full_end.replace('-', '_')}"
 
     print(f"📅 Processing time range: {full_start} to {full_end}")
-    print(f"📦 Number of time chunks: {len(time_chunks)}")
 
-    combined_data = []
-    successful_accounts = 0
-    failed_accounts = []
+    combined_filename = f"facebook_combined_ad_data_{time_range_str}.{Config.OUTPUT_FORMAT}"
+    ledger = ProgressLedger(Config.CHECKPOINT_DIR, time_range_str, Config.OUTPUT_FORMAT)
+    sizer = ChunkSizer(os.path.join(Config.CHECKPOINT_DIR, 'chunk_sizes.sqlite'))
+    scheduler = AsyncJobScheduler(sizer=sizer)
 
-    # Use ThreadPoolExecutor as requested
+    # Accounts are initialized in parallel; their jobs then share one scheduler,
+    # and each job's results are streamed to its shard as soon as it completes
     with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = {executor.submit(process_account, acc, time_chunks, deduplicator): acc
-                  for acc in Config.AD_ACCOUNT_IDS}
+        fetchers = dict(zip(
+            account_ids,
+            executor.map(lambda acc: process_account(acc, dict(zip(('since', 'until'), account_windows[acc])),
+                                                     deduplicator, scheduler, ledger, sizer),
+                         account_ids)
+        ))
+        print(f"📦 Queued {len(scheduler.pending)} async jobs across {sum(1 for f in fetchers.values() if f)} accounts")
+
+        futures = {}
+        for job in scheduler.run():
+            if job.succeeded:
+                futures[executor.submit(stream_job_results, job, ledger, sizer)] = job
+            else:
+                ledger.mark_failed(job.account_id, job.time_range, job.attribution_window)
 
         for future in as_completed(futures):
-            account_id = futures[future]
+            job = futures[future]
             try:
-                account_data = future.result()
-                if account_data:
-                    save_data(account_id, account_data, combined_data)
-                    successful_accounts += 1
-                    print(f"✔️ Successfully processed account {account_id}")
+                job_rows = future.result()
+                if job_rows is None:
+                    print(f"⚠️ No data returned for {job.label()}")
+                    scheduler.record_failure(job.account_id)
                 else:
-                    print(f"❌ No data returned for account {account_id}")
-                    failed_accounts.append(account_id)
+                    print(f"✅ {job.label()}: {job_rows} records committed")
             except Exception as e:
-                print(f"❌ Exception processing account {account_id}: {e}")
-                failed_accounts.append(account_id)
+                print(f"❌ Exception processing {job.label()}: {e}")
+                scheduler.record_failure(job.account_id)
+    sizer.close()
+
+    with run_metrics.span('publish' if partitioned else 'merge') as span:
+        if partitioned:
+            account_rows = publish_partitions(ledger, account_windows, state)
+            published = set(account_rows)
+        else:
+            account_rows = merge_shards(ledger, combined_filename)
+            published = {account_id for account_id, window in account_windows.items()
+                         if ledger.covers(account_id, *window)}
+        span['rows'] = sum(account_rows.values())
+    if Config.FACT_DIR and not partitioned:
+        with run_metrics.span('facts') as span:
+            fact_rows = publish_partitions(ledger, account_windows, output=False)
+            span['rows'] = sum(fact_rows.values())
+        published &= set(fact_rows)
+    # Checkpoints go once every account is written; otherwise the next run resumes from them
+    if published == set(account_windows):
+        ledger.discard()
+    else:
+        print(f"💾 Keeping checkpoints in {ledger.shard_dir} so the next run resumes from them")
+        ledger.close()
+    total_rows = sum(account_rows.values())
+
+    successful_accounts = 0
+    failed_accounts = []
+    for account_id in account_ids:
+        # A published incremental account succeeded even when its days had no delivery
+        if account_id in account_rows if partitioned else account_rows.get(account_id):
+            successful_accounts += 1
+            print(f"✔️ Successfully processed account {account_id}")
+        else:
+            print(f"❌ No data returned for account {account_id}")
+            failed_accounts.append(account_id)
 
     print(f"\nSuccessfully processed {successful_accounts} accounts.")
     if failed_accounts:
         print(f"Failed accounts: {failed_accounts}")
-    print(f"Combined data collected: {len(combined_data)} records")
+    print(f"Combined data collected: {total_rows} records")
 
-    # Save combined data as JSONL file
-    if combined_data:
-        combined_filename = f"facebook_combined_ad_data_{time_range_str}.jsonl"
-        try:
-            with open(combined_filename, 'w', encoding='utf-8') as f:
-                 for record in combined_data:
-                     json_line = json.dumps(record, ensure_ascii=False)
-                     f.write(json_line + '\n')
-            print(f"\n✅✅✅ Combined data saved: {combined_filename}")
+    if partitioned:
+        print(f"\n🗂️ Day partitions and manifest written under {Config.PARTITION_DIR}")
+    elif total_rows:
+        print(f"\n✅✅✅ Combined data saved: {combined_filename}")
 
-            # Print sample of first record
-            if combined_data:
-                print(f"\n📄 Sample record structure:")
-                print(json.dumps(combined_data[0], indent=2))
+        # Print sample of first record
+        print(f"\n📄 Sample record structure:")
+        print(json.dumps(read_sample_record(combined_filename), indent=2, default=str))
 
-        except IOError as e:
-            print(f"❌ Failed to save combined file {combined_filename}: {e}")
+        loader = build_loader()
+        if loader:
+            try:
+                loaded_rows = loader.load(combined_filename, Config.OUTPUT_FORMAT)
+                print(f"📤 Loaded {loaded_rows} rows from {combined_filename}")
+            except Exception as e:
+                print(f"❌ Failed to load {combined_filename}: {e}")
+    else:
+        os.remove(combined_filename)
 
     # Summary report
     total_time = (time.time() - start_time) / 60  # in minutes
     print(f"\n{'='*80}")
     print("📊 Processing Summary:")
-    print(f"✅ Successful accounts: {successful_accounts}/{len(Config.AD_ACCOUNT_IDS)}")
+    print(f"✅ Successful accounts: {successful_accounts}/{len(account_ids)}")
     print(f"❌ Failed accounts: {len(failed_accounts)}")
     if failed_accounts:
         print(f"Failed account IDs: {', '.join(failed_accounts)}")
     print(f"⏱️ Total processing time: {total_time:.1f} minutes")
     print(f"{'='*80}")
 
+    summary = {
+        'platform': 'meta',
+        'start_date': full_start,
+        'end_date': full_end,
+        'accounts': len(account_ids),
+        'failed_accounts': failed_accounts,
+        'rows': total_rows,
+        'output': Config.PARTITION_DIR if partitioned else combined_filename if total_rows else None,
+        'seconds': round(time.time() - start_time, 1),
+    }
+    if Config.RUN_REPORT_PATH:
+        run_metrics.write(Config.RUN_REPORT_PATH, Config.PROMETHEUS_TEXTFILE, summary)
+        print(f"📈 Run report written to {Config.RUN_REPORT_PATH}")
+    return summary
+
+
+def main():
+    print("🚀 Starting Multi-Account Facebook Ads Data Fetcher")
+
+    # Complete days only: the range always ends yesterday
+    yesterday = datetime.now() - timedelta(days=1)
+    full_end = yesterday.strftime('%Y-%m-%d')
+
+    if Config.INCREMENTAL:
+        state = IncrementalState(Config.STATE_DB_PATH)
+        try:
+            account_windows = {account_id: state.window(account_id, full_end, Config.LOOKBACK_DAYS, Config.INITIAL_DAYS)
+                               for account_id in Config.AD_ACCOUNT_IDS}
+            full_start = min(since for since, _ in account_windows.values())
+            return run(full_start, full_end, account_windows, state)
+        finally:
+            state.close()
+
+    full_start = (yesterday - timedelta(days=Config.REPORT_DAYS - 1)).strftime('%Y-%m-%d')
+    return run(full_start, full_end)
+
 
 if __name__ == "__main__":
     main()
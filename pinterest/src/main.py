@@ -1,6 +1,24 @@
+import os
+import queue
+import hashlib
+import shutil
+import sqlite3
+import threading
 import requests
 import json
 import time
+import random
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 # ---------------------------
 # ✅ CONFIG
@@ -14,8 +32,8 @@ AD_ACCOUNT_IDS = [
 
 YESTERDAY1 = (datetime.utcnow() - timedelta(days=10)).date()
 YESTERDAY2 = (datetime.utcnow() - timedelta(days=1)).date()
-start_date = YESTERDAY2.isoformat()
-end_date = YESTERDAY1.isoformat()
+start_date = YESTERDAY1.isoformat()
+end_date = YESTERDAY2.isoformat()
 
 columns = ["CAMPAIGN_ID",
            "CAMPAIGN_NAME",
@@ -31,12 +49,487 @@ columns = ["CAMPAIGN_ID",
 granularity = "DAY"
 targeting_types = "COUNTRY"
 
+OUTPUT_FORMAT = "parquet"  # or "jsonl"
+BQ_TABLE = None  # e.g. "project.dataset.pinterest_ads" to batch-load the output file
+LOCAL_LOAD_DIR = None  # filesystem stand-in for BigQuery, e.g. for tests
+RUN_REPORT_PATH = "pinterest_run_report.json"  # per-stage timings and counters; None disables it
+PROMETHEUS_TEXTFILE = None  # e.g. "/var/lib/node_exporter/pinterest_ads.prom"
+
+# Offline runs: "record" saves every API exchange to REPLAY_CASSETTE, "replay" serves them
+# back without network access; STANDIN_URL sends all traffic to a local stand-in server
+REPLAY_MODE = None
+REPLAY_CASSETTE = "pinterest_cassette.jsonl"
+STANDIN_URL = None  # e.g. "http://127.0.0.1:8765"
+
+# Incremental mode: each account from its high-water mark, re-fetching the trailing
+# LOOKBACK_DAYS so 7-day click conversions settle, into per-day partitions
+INCREMENTAL = False
+STATE_DB_PATH = "pinterest_state.sqlite"
+LOOKBACK_DAYS = 7
+INITIAL_DAYS = 30  # first run for an account without a high-water mark
+PARTITION_DIR = "pinterest_partitions"
+# "combined" writes one file for a full-refresh run; "partitioned" writes the same
+# platform/account/day partitions as incremental mode (incremental runs always do)
+OUTPUT_LAYOUT = "combined"
+SHARD_MAX_BYTES = 128 * 1024 * 1024  # uncompressed size at which a partition's shard is rolled
+JSONL_COMPRESSION = "gzip"  # or "zstd" / None; Parquet shards always use zstd internally
+COMPRESSION_WORKERS = 4  # background threads serializing and compressing shards
+# Cross-platform fact table (FACT_SCHEMA) shared with the Meta and TikTok pipelines;
+# each fully fetched account's days are replaced under FACT_DIR/platform=pinterest. None disables it
+FACT_DIR = "ad_facts"
+
 HEADERS = {
     "Authorization": f"Bearer {ACCESS_TOKEN}",
     "Content-Type": "application/json",
     "Accept": "application/json",
 }
 
+AD_INDEX_PATH = "pinterest_ad_index.sqlite"  # ad lifecycle index used to prune analytics; None disables it
+PRUNE_GRACE_DAYS = 1  # slack between UTC lifecycle timestamps and account-timezone report dates
+
+MAX_WORKERS = 8  # concurrent analytics requests across all accounts
+DISCOVERY_WORKERS = 4  # accounts whose ads are listed at the same time
+ACCOUNT_QPS = 4  # per-account request rate cap
+
+# Retries: full-jitter backoff (or the server's Retry-After), a circuit breaker and a retry budget per host
+RETRY_MAX_ATTEMPTS = 6
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 60
+CIRCUIT_FAILURES = 5  # failures in a row that open a host's circuit
+CIRCUIT_RESET_SECONDS = 30
+RETRY_BUDGET_RATIO = 0.2  # error retries per request, after a burst of 10
+
+# ---------------------------
+# ✅ RUN METRICS
+# ---------------------------
+class RunMetrics:
+    """Thread-safe stage timings (per stage + labels such as account) and counters for one run."""
+    def __init__(self, platform):
+        self.platform = platform
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.spans = defaultdict(lambda: {"count": 0, "seconds": 0.0, "rows": 0})
+            self.counters = defaultdict(float)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        # set span["rows"] inside the block to report throughput
+        span = {"rows": 0}
+        started = time.time()
+        try:
+            yield span
+        finally:
+            self.add(stage, time.time() - started, span["rows"], **labels)
+
+    def add(self, stage, seconds, rows=0, **labels):
+        key = (stage, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            entry = self.spans[key]
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["rows"] += rows
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def report(self, summary=None):
+        with self.lock:
+            spans = [dict(stage=stage, labels=dict(labels), **entry) for (stage, labels), entry in self.spans.items()]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self.counters.items()]
+            elapsed = time.time() - self.started_at
+        stages = defaultdict(lambda: {"count": 0, "seconds": 0.0, "rows": 0})
+        for span in spans:
+            for field in ("count", "seconds", "rows"):
+                stages[span["stage"]][field] += span[field]
+        for totals in stages.values():
+            totals["rows_per_second"] = totals["rows"] / totals["seconds"] if totals["rows"] and totals["seconds"] else None
+        return {"platform": self.platform, "elapsed_seconds": elapsed, "summary": summary,
+                "stages": dict(stages), "counters": counters, "spans": spans}
+
+    def write(self, report_path, prometheus_path=None, summary=None):
+        report = self.report(summary)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        if prometheus_path:
+            platform = f'platform="{self.platform}"'
+            lines = ["# TYPE social_ads_run_seconds gauge",
+                     f"social_ads_run_seconds{{{platform}}} {report['elapsed_seconds']:.3f}",
+                     "# TYPE social_ads_stage_seconds_total counter",
+                     "# TYPE social_ads_stage_rows_total counter",
+                     "# TYPE social_ads_stage_calls_total counter"]
+            for stage, totals in sorted(report["stages"].items()):
+                labels = f'{platform},stage="{stage}"'
+                lines.append(f"social_ads_stage_seconds_total{{{labels}}} {totals['seconds']:.3f}")
+                lines.append(f"social_ads_stage_rows_total{{{labels}}} {totals['rows']}")
+                lines.append(f"social_ads_stage_calls_total{{{labels}}} {totals['count']}")
+            for counter in sorted(report["counters"], key=lambda c: (c["name"], sorted(c["labels"].items()))):
+                labels = ",".join([platform] + [f'{k}="{v}"' for k, v in sorted(counter["labels"].items())])
+                lines.append(f"social_ads_{counter['name']}_total{{{labels}}} {counter['value']:g}")
+            # rename into place so the collector never scrapes a partial file
+            with open(prometheus_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(prometheus_path + ".tmp", prometheus_path)
+        return report
+
+
+RUN_METRICS = RunMetrics("pinterest")
+
+# ---------------------------
+# ✅ RETRIES: CLASSIFICATION, BACKOFF, CIRCUIT BREAKERS
+# ---------------------------
+class RetryableError(Exception):
+    """A failure worth another attempt: throttling, a 5xx, a timeout or a dropped connection.
+
+    retry_after is the server's own hint in seconds, when it gave one.
+    """
+    def __init__(self, message, retry_after=None, throttled=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+
+class CircuitOpenError(RetryableError):
+    """Raised without sending the request while the host's circuit is open."""
+
+
+def parse_retry_after(headers, now=None):
+    """Seconds to wait according to Retry-After (delay or HTTP date) or a rate-limit reset header, else None."""
+    headers = CaseInsensitiveDict(headers or {})
+    now = time.time() if now is None else now
+    value = headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+    for name in ("RateLimit-Reset", "X-RateLimit-Reset"):
+        try:
+            value = float(headers.get(name))
+        except (TypeError, ValueError):
+            continue
+        # some APIs send the reset as an epoch timestamp rather than a delay
+        return max(0.0, value - now if value > 1e9 else value)
+    return None
+
+
+class CircuitBreaker:
+    """Stop calling a host after failure_threshold failures in a row.
+
+    While open, calls fail fast for reset_timeout seconds; then one probe is let through
+    (half-open) and its outcome closes the circuit or opens it again. Openings are
+    counted on `metrics` (a RunMetrics) and reported through `log`.
+    """
+    def __init__(self, host, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic, metrics=None, log=print):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.metrics = metrics
+        self.log = log
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if not self.probing and (self.opened_at is not None or self.failures < self.failure_threshold):
+                return
+            self.opened_at = self.clock()
+            self.probing = False
+        if self.metrics:
+            self.metrics.count("circuit_opened", host=self.host)
+        self.log(f"Circuit for {self.host} opened after {self.failures} failures in a row; "
+                 f"pausing it for {self.reset_timeout:.0f}s")
+
+
+class RetryBudget:
+    """Token bucket capping a host's error retries at `ratio` per request, after an initial `burst`."""
+    def __init__(self, ratio=0.2, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """Retries shared by every request: full-jitter backoff, Retry-After, circuit breakers and budgets per host.
+
+    call(host, send) runs send() until it returns. send raises RetryableError for
+    throttling and transient failures, and any other exception for failures no retry
+    can fix, which propagate at once. Throttled attempts wait as long as the server
+    asked and leave the host's circuit and budget alone; other failures count against
+    both. The last error is raised once the attempts or the budget run out. Retries
+    are counted on `metrics` (a RunMetrics) and reported through `log`.
+    """
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0, max_retry_after=300.0,
+                 failure_threshold=5, reset_timeout=30.0, budget_ratio=0.2, budget_burst=10, sleep=time.sleep,
+                 metrics=None, log=print):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self.sleep = sleep
+        self.metrics = metrics
+        self.log = log
+        self.breakers = {}
+        self.budgets = {}
+        self.lock = threading.Lock()
+
+    def _host(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, self.failure_threshold, self.reset_timeout,
+                                                     metrics=self.metrics, log=self.log)
+                self.budgets[host] = RetryBudget(self.budget_ratio, self.budget_burst)
+            return self.breakers[host], self.budgets[host]
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retrying after failed attempt number `attempt` (1-based)."""
+        if retry_after is not None:
+            # the server said when; a little jitter keeps the waiting threads from returning in lockstep
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, host, send, endpoint=""):
+        breaker, budget = self._host(host)
+        budget.deposit()
+        for attempt in range(1, self.max_attempts + 1):
+            if breaker.allow():
+                try:
+                    result = send()
+                except RetryableError as e:
+                    error = e
+                    if e.throttled:
+                        breaker.record_success()  # a rate-limit answer still shows the host is up
+                    else:
+                        breaker.record_failure()
+                except Exception:
+                    breaker.record_success()  # the host answered; the request itself is at fault
+                    raise
+                else:
+                    breaker.record_success()
+                    return result
+            else:
+                error = CircuitOpenError(f"circuit open for {host}", breaker.remaining() or None)
+
+            if attempt == self.max_attempts:
+                break
+            if error.retry_after is not None and error.retry_after > self.max_retry_after:
+                break  # not worth holding the run for
+            reason = "throttle" if error.throttled else "circuit" if isinstance(error, CircuitOpenError) else "error"
+            if reason == "error" and not budget.withdraw():
+                if self.metrics:
+                    self.metrics.count("retries_denied", host=host)
+                self.log(f"{endpoint or host}: retry budget spent, giving up: {error}")
+                break
+            delay = self.backoff(attempt, error.retry_after)
+            if self.metrics:
+                self.metrics.count("retries", endpoint=endpoint, reason=reason)
+                self.metrics.count("sleep_seconds", delay, reason="backoff")
+            self.log(f"{endpoint or host}: {error} (attempt {attempt}/{self.max_attempts}), retrying in {delay:.1f}s")
+            self.sleep(delay)
+        raise error
+
+
+RETRY_POLICY = RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, failure_threshold=CIRCUIT_FAILURES,
+                           reset_timeout=CIRCUIT_RESET_SECONDS, budget_ratio=RETRY_BUDGET_RATIO,
+                           metrics=RUN_METRICS, log=lambda message: print(f"⚠️ {message}"))
+
+# ---------------------------
+# ✅ HTTP: POOLED SESSION + PER-ACCOUNT RATE LIMIT
+# ---------------------------
+class ReplayAdapter(HTTPAdapter):
+    """Transport under a requests session for runs without the real API.
+
+    In "record" mode requests pass through and each exchange is appended to the
+    cassette (JSON lines, access tokens stripped); in "replay" mode responses come from
+    the cassette and nothing reaches the network. Identical requests are answered in
+    recorded order, the last response repeating, so a request retried after a throttled
+    answer, or a job status poll, sees the same sequence of answers as when it was recorded.
+    With a target, requests go to that base URL instead of the API host.
+    """
+    SECRET_PARAMS = {"access_token", "appsecret_proof", "input_token"}
+    DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "set-cookie"}
+    _lock = threading.Lock()
+    _cassettes = {}  # replay: path -> {key: deque of responses}
+    _recording = set()  # record: paths truncated by this process
+
+    def __init__(self, mode=None, cassette=None, target=None, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode
+        self.cassette = cassette
+        self.target = target.rstrip("/") if target else None
+        with self._lock:
+            if mode == "replay" and cassette not in self._cassettes:
+                recorded = defaultdict(deque)
+                with open(cassette, encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        recorded[entry["key"]].append(entry)
+                self._cassettes[cassette] = recorded
+            elif mode == "record" and cassette not in self._recording:
+                open(cassette, "w").close()
+                self._recording.add(cassette)
+
+    @classmethod
+    def request_key(cls, method, url, body=None):
+        """Method, path and sorted parameters of a request, without credentials or host"""
+        parts = urlsplit(url)
+        query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in cls.SECRET_PARAMS)
+        key = f"{method} {parts.path}?{urlencode(query)}"
+        if body:
+            body = body.decode("utf-8") if isinstance(body, bytes) else body
+            form = sorted((k, v) for k, v in parse_qsl(body, keep_blank_values=True) if k not in cls.SECRET_PARAMS)
+            key += " " + (urlencode(form) if form else body)
+        return key
+
+    def send(self, request, **kwargs):
+        key = self.request_key(request.method, request.url, request.body)
+        if self.mode == "replay":
+            with self._lock:
+                responses = self._cassettes[self.cassette].get(key)
+                entry = (responses.popleft() if len(responses) > 1 else responses[0]) if responses else None
+            if entry is None:
+                raise requests.exceptions.ConnectionError(f"No recorded response for {key}", request=request)
+            return self._replayed(request, entry)
+
+        if self.target:
+            parts = urlsplit(request.url)
+            request.url = self.target + parts.path + (f"?{parts.query}" if parts.query else "")
+        response = super().send(request, **kwargs)
+        if self.mode == "record":
+            entry = {
+                "key": key,
+                "status": response.status_code,
+                "headers": {k: v for k, v in response.headers.items() if k.lower() not in self.DROPPED_HEADERS},
+                "body": response.text,
+            }
+            with self._lock, open(self.cassette, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        return response
+
+    @staticmethod
+    def _replayed(request, entry):
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.reason = "Replayed"
+        response.url = request.url
+        response.request = request
+        return response
+
+
+def build_adapter(pool_size=MAX_WORKERS + DISCOVERY_WORKERS):
+    if REPLAY_MODE or STANDIN_URL:
+        return ReplayAdapter(REPLAY_MODE, REPLAY_CASSETTE, STANDIN_URL,
+                             pool_connections=pool_size, pool_maxsize=pool_size)
+    return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+
+SESSION = requests.Session()
+SESSION.mount("https://", build_adapter())
+SESSION.headers.update(HEADERS)
+
+
+class RateLimiter:
+    """Space requests at least 1/qps seconds apart across all threads."""
+    def __init__(self, qps):
+        self.interval = 1.0 / qps if qps > 0 else 0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            RUN_METRICS.count("sleep_seconds", wait, reason="rate_limit")
+            time.sleep(wait)
+
+
+_limiters_lock = threading.Lock()
+ACCOUNT_LIMITERS = defaultdict(lambda: RateLimiter(ACCOUNT_QPS))
+
+
+def account_get(ad_account_id, url, params=None):
+    """GET through the account's rate limit and RETRY_POLICY; returns a successful response or raises.
+
+    429, 408 and 5xx answers and network errors are retried; any other 4xx is raised at once.
+    """
+    with _limiters_lock:
+        limiter = ACCOUNT_LIMITERS[ad_account_id]
+    endpoint = url.split("?")[0].rsplit("/", 1)[-1]
+
+    def send():
+        limiter.acquire()
+        RUN_METRICS.count("requests", endpoint=endpoint)
+        try:
+            with RUN_METRICS.span("http", endpoint=endpoint):
+                response = SESSION.get(url, params=params, timeout=60)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            RUN_METRICS.count("request_errors", endpoint=endpoint, status="network")
+            raise RetryableError(f"network error: {e}") from e
+        RUN_METRICS.count("bytes", len(response.content or b""), endpoint=endpoint)
+        if response.status_code in (408, 429) or response.status_code >= 500:
+            RUN_METRICS.count("request_errors", endpoint=endpoint, status=response.status_code)
+            raise RetryableError(f"HTTP {response.status_code}", parse_retry_after(response.headers),
+                                 throttled=response.status_code == 429)
+        response.raise_for_status()
+        return response
+
+    return RETRY_POLICY.call(urlsplit(url).netloc, send, endpoint)
+
 # ---------------------------
 # ✅ HELPER: SPLIT LIST INTO CHUNKS
 # ---------------------------
@@ -45,116 +538,810 @@ def chunks(lst, n):
         yield lst[i:i + n]
 
 # ---------------------------
-# ✅ FETCH ADS WITH RETRIES
+# ✅ AD LIFECYCLE INDEX (PRUNING)
 # ---------------------------
-def fetch_ads_for_account(ad_account_id, page_size=100, max_retries=3):
-    ad_ids = []
+class AdIndex:
+    """Per-account ad lifecycle (status, created/updated time, delivery history) persisted in SQLite between runs."""
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # checked_from..checked_through is the contiguous range of days analytics has covered for the ad
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS ads (
+            ad_account_id TEXT, ad_id TEXT, status TEXT, created_time INTEGER, updated_time INTEGER,
+            last_delivery_date TEXT, checked_from TEXT, checked_through TEXT,
+            PRIMARY KEY (ad_account_id, ad_id)) WITHOUT ROWID""")
+        self.conn.commit()
+
+    def load(self, ad_account_id):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT ad_id, last_delivery_date, checked_from, checked_through FROM ads WHERE ad_account_id = ?",
+                (ad_account_id,)).fetchall()
+        return {ad_id: history for ad_id, *history in rows}
+
+    def upsert(self, ad_account_id, ads):
+        with self.lock:
+            self.conn.executemany(
+                """INSERT INTO ads (ad_account_id, ad_id, status, created_time, updated_time) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (ad_account_id, ad_id) DO UPDATE SET
+                status = excluded.status, created_time = excluded.created_time, updated_time = excluded.updated_time""",
+                [(ad_account_id, ad["id"], ad.get("status"), ad.get("created_time"), ad.get("updated_time"))
+                 for ad in ads if "id" in ad])
+            self.conn.commit()
+
+    def _load_history(self, ad_account_id, ad_ids):
+        for batch in chunks(list(ad_ids), 500):
+            yield from ((ad_id, history) for ad_id, *history in self.conn.execute(
+                f"SELECT ad_id, last_delivery_date, checked_from, checked_through FROM ads "
+                f"WHERE ad_account_id = ? AND ad_id IN ({','.join('?' * len(batch))})",
+                (ad_account_id, *batch)))
+
+    def record_delivery(self, ad_account_id, ad_ids, rows, window_start, window_end):
+        """Fold one analytics batch over window_start..window_end (ISO dates) into the ads' history."""
+        last_delivery = {}
+        for row in rows:
+            metrics = row.get("metrics") or row
+            ad_id, day = metrics.get("AD_ID"), metrics.get("DATE")
+            if ad_id is not None and day:
+                ad_id, day = str(ad_id), str(day)[:10]
+                last_delivery[ad_id] = max(day, last_delivery.get(ad_id, day))
+
+        window_before = (datetime.strptime(window_start, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+        window_after = (datetime.strptime(window_end, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        with self.lock:
+            history = dict(self._load_history(ad_account_id, ad_ids))
+            updates = []
+            for ad_id in ad_ids:
+                last, checked_from, checked_through = history.get(ad_id, (None, None, None))
+                if checked_from and checked_from <= window_after and checked_through >= window_before:
+                    # Overlapping or adjacent: extend the covered range
+                    checked_from, checked_through = min(checked_from, window_start), max(checked_through, window_end)
+                else:
+                    checked_from, checked_through = window_start, window_end
+                if ad_id in last_delivery:
+                    last = max(last or "", last_delivery[ad_id])
+                updates.append((last, checked_from, checked_through, ad_account_id, ad_id))
+            self.conn.executemany(
+                """UPDATE ads SET last_delivery_date = ?, checked_from = ?, checked_through = ?
+                WHERE ad_account_id = ? AND ad_id = ?""", updates)
+            self.conn.commit()
+
+AD_INDEX = None  # opened by run(), so importing the script creates no files
+
+
+def open_ad_index():
+    global AD_INDEX
+    if AD_INDEX is None and AD_INDEX_PATH:
+        AD_INDEX = AdIndex(AD_INDEX_PATH)
+    return AD_INDEX
+
+
+def _utc_date(timestamp):
+    return datetime.utcfromtimestamp(int(timestamp)).date()
+
+
+def may_deliver(ad, history, window_start, window_end):
+    """False only when the ad provably has no delivery between window_start and window_end (dates)."""
+    grace = timedelta(days=PRUNE_GRACE_DAYS)
+    if ad.get("created_time") and _utc_date(ad["created_time"]) - grace > window_end:
+        return False
+    if ad.get("status") == "ACTIVE" or not ad.get("updated_time"):
+        return True
+    # A paused/archived ad has held that status since at most its last update
+    stopped = _utc_date(ad["updated_time"]) + grace
+    if stopped < window_start:
+        return False
+    # Stopped inside the window: skip it only if earlier runs covered every day from the
+    # window start to the stop and saw its last delivery before the window
+    last_delivery, checked_from, checked_through = history.get(ad["id"], (None, None, None))
+    if not checked_from or checked_from > window_start.isoformat() or checked_through < stopped.isoformat():
+        return True
+    return bool(last_delivery) and last_delivery >= (window_start - grace).isoformat()
+
+# ---------------------------
+# ✅ FETCH ADS
+# ---------------------------
+def iter_ad_pages(ad_account_id, page_size=250):
+    """Yield the ads (id, status, created/updated time, ...) of each listing page as soon as it arrives."""
+    # The v5 ads list has no field selection, so the biggest page size is what keeps
+    # the number of round trips (and bookmarks to follow) down
     url = f"https://api.pinterest.com/v5/ad_accounts/{ad_account_id}/ads"
     params = {"page_size": page_size}
 
     while url:
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, headers=HEADERS, params=params)
-                if response.status_code == 200:
-                    break
-                else:
-                    wait = 2 ** attempt
-                    print(f"⚠️ Attempt {attempt+1} failed ({response.status_code}), retrying in {wait}s...")
-                    time.sleep(wait)
-            except requests.exceptions.RequestException as e:
-                wait = 2 ** attempt
-                print(f"⚠️ Network error: {e}, retrying in {wait}s...")
-                time.sleep(wait)
-        else:
-            print(f"❌ Failed to fetch ads after {max_retries} retries for {ad_account_id}")
-            return ad_ids
-
-        data = response.json()
+        # A page that still fails after the retries fails the whole listing, rather than
+        # silently cutting the account's ads short
+        data = account_get(ad_account_id, url, params).json()
         items = data.get("items", [])
-        ad_ids.extend([ad["id"] for ad in items if "id" in ad])
+        yield [ad for ad in items if "id" in ad]
 
         bookmark = data.get("bookmark")
         if bookmark:
             url = f"https://api.pinterest.com/v5/ad_accounts/{ad_account_id}/ads?bookmark={bookmark}"
             params = {"page_size": page_size}
-            time.sleep(0.2)  # small delay
         else:
             url = None
 
+
+def fetch_ads_for_account(ad_account_id, page_size=250):
+    ad_ids = []
+    for page in iter_ad_pages(ad_account_id, page_size):
+        ad_ids.extend(ad["id"] for ad in page)
     print(f"✅ {ad_account_id}: {len(ad_ids)} ads fetched")
     return ad_ids
 
+
+def stream_ads_to_analytics(ad_account_id, dispatch, start_date, end_date, batch_size=250):
+    """Producer: list an account's ads and hand each full batch to `dispatch` right away.
+
+    With the ad index enabled, ads that can't have delivery in start_date..end_date are
+    recorded in the index but never sent to analytics.
+    """
+    pending = []
+    total = pruned = 0
+    history = AD_INDEX.load(ad_account_id) if AD_INDEX else {}
+    window_start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    window_end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    started = time.time()
+    for page in iter_ad_pages(ad_account_id):
+        total += len(page)
+        if AD_INDEX:
+            AD_INDEX.upsert(ad_account_id, page)
+            live = [ad for ad in page if may_deliver(ad, history, window_start, window_end)]
+            pruned += len(page) - len(live)
+            page = live
+        pending.extend(ad["id"] for ad in page)
+        while len(pending) >= batch_size:
+            dispatch(ad_account_id, pending[:batch_size], start_date, end_date)
+            pending = pending[batch_size:]
+    if pending:
+        dispatch(ad_account_id, pending, start_date, end_date)
+    # dispatch only queues batches, so this is the listing time of the account
+    RUN_METRICS.add("discovery", time.time() - started, total, account=ad_account_id)
+    RUN_METRICS.count("ads_pruned", pruned, account=ad_account_id)
+    if not total:
+        print(f"⚠️ No ads for {ad_account_id}, skipping.")
+    print(f"✅ {ad_account_id}: {total} ads fetched, {pruned} pruned as not delivering in the window")
+    return total
+
 # ---------------------------
 # ✅ FETCH TARGETING ANALYTICS IN CHUNKS
 # ---------------------------
-def fetch_targeting_analytics_chunks(ad_account_id, ad_ids):
+def fetch_analytics_batch(ad_account_id, batch, start_date, end_date):
+    url = f"https://api.pinterest.com/v5/ad_accounts/{ad_account_id}/ads/targeting_analytics"
+    params = {
+        "ad_account_id": ad_account_id,
+        "ad_ids": ",".join(batch),
+        "start_date": start_date,
+        "end_date": end_date,
+        "columns": ",".join(columns),
+        "granularity": granularity,
+        "targeting_types": targeting_types,
+        "click_window_days": 7,
+        "view_window_days": 1,
+        "engagement_window_days": 30
+
+    }
+
+    # A request that fails after its retries raises: the run marks the account failed,
+    # and unlike an empty batch a failed one tells the ad index nothing
+    response = account_get(ad_account_id, url, params)
+    try:
+        data = response.json()
+    except json.JSONDecodeError:
+        print(f"❌ Invalid JSON for {ad_account_id} batch")
+        return None
+    rows = data.get("data", [])
+    for row in rows:
+        row["ad_account_id"] = ad_account_id
+    return rows
+
+
+def submit_analytics_batches(executor, ad_account_id, ad_ids, start_date, end_date):
+    """Dispatch every 250-id batch of an account to the pool; returns the futures."""
     if not ad_ids:
         print(f"⚠️ No ads for {ad_account_id}, skipping.")
         return []
+    return [executor.submit(fetch_analytics_batch, ad_account_id, batch, start_date, end_date)
+            for batch in chunks(ad_ids, 250)]  # max 250 per Pinterest API
+
 
+def fetch_targeting_analytics_chunks(ad_account_id, ad_ids, start_date, end_date, executor=None):
+    own_executor = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers=MAX_WORKERS)
     all_data = []
+    try:
+        with RUN_METRICS.span("fetch_targeting_analytics_chunks", account=ad_account_id) as span:
+            for future in as_completed(submit_analytics_batches(executor, ad_account_id, ad_ids, start_date, end_date)):
+                all_data.extend(future.result() or [])
+            span["rows"] = len(all_data)
+    finally:
+        if own_executor:
+            executor.shutdown()
 
-    for batch in chunks(ad_ids, 250):  # max 250 per Pinterest API
-        url = f"https://api.pinterest.com/v5/ad_accounts/{ad_account_id}/ads/targeting_analytics"
-        params = {
-            "ad_account_id": ad_account_id,
-            "ad_ids": ",".join(batch),
-            "start_date": start_date,
-            "end_date": end_date,
-            "columns": ",".join(columns),
-            "granularity": granularity,
-            "targeting_types": targeting_types,
-            "click_window_days": 7,
-            "view_window_days": 1,
-            "engagement_window_days": 30
-
-        }
-
-        for attempt in range(3):  # retries for analytics
-            response = requests.get(url, headers=HEADERS, params=params)
-            if response.status_code == 200:
-                break
-            else:
-                wait = 2 ** attempt
-                print(f"⚠️ Analytics attempt {attempt+1} failed ({response.status_code}), retrying in {wait}s...")
-                time.sleep(wait)
+    print(f"📊 {ad_account_id}: total rows fetched: {len(all_data)}")
+    return all_data
+
+# ---------------------------
+# ✅ COLUMNAR OUTPUT & LOAD
+# ---------------------------
+# One flat row per (ad, day, targeting value): row-level fields + the requested metric columns
+PINTEREST_SCHEMA = pa.schema([
+    ("ad_account_id", pa.string()),
+    ("targeting_type", pa.string()),
+    ("targeting_value", pa.string()),
+    ("DATE", pa.date32()),
+    ("AD_ID", pa.string()),
+    ("CAMPAIGN_ID", pa.string()),
+    ("CAMPAIGN_NAME", pa.string()),
+    ("CAMPAIGN_OBJECTIVE_TYPE", pa.string()),
+    ("AD_GROUP_ID", pa.string()),
+    ("AD_GROUP_NAME", pa.string()),
+    ("AD_NAME", pa.string()),
+    ("SPEND_IN_DOLLAR", pa.float64()),
+    ("TOTAL_IMPRESSION", pa.int64()),
+    ("TOTAL_CLICKTHROUGH", pa.int64()),
+    ("TOTAL_CHECKOUT", pa.int64()),
+    ("TOTAL_CHECKOUT_VALUE_IN_MICRO_DOLLAR", pa.int64()),
+])
+
+
+def flatten_row(row):
+    flat = {k: v for k, v in row.items() if k != "metrics"}
+    flat.update(row.get("metrics") or {})
+    return flat
+
+
+def rows_to_table(rows):
+    flat_rows = [flatten_row(row) for row in rows]
+    columns = []
+    for field in PINTEREST_SCHEMA:
+        values = [None if r.get(field.name) in (None, "") else str(r.get(field.name)) for r in flat_rows]
+        column = pa.array(values, pa.string())
+        if not pa.types.is_string(field.type):
+            try:
+                column = column.cast(field.type)
+            except pa.ArrowInvalid:
+                # e.g. "12.0" for an integer metric
+                column = column.cast(pa.float64()).cast(field.type, safe=False)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=PINTEREST_SCHEMA)
+
+
+def save_parquet(rows, file_name, batch_size=50000):
+    with RUN_METRICS.span("write") as span, \
+            pq.ParquetWriter(file_name, PINTEREST_SCHEMA, compression="zstd") as writer:
+        for i in range(0, len(rows), batch_size):
+            writer.write_table(rows_to_table(rows[i:i + batch_size]))
+        span["rows"] = len(rows)
+
+
+class BigQueryLoader:
+    """Batch-load an output file into a BigQuery table."""
+    SOURCE_FORMATS = {"jsonl": "NEWLINE_DELIMITED_JSON", "parquet": "PARQUET"}
+
+    def __init__(self, table_id):
+        from google.cloud import bigquery
+        self.bigquery = bigquery
+        self.client = bigquery.Client()
+        self.table_id = table_id
+
+    def load(self, path, output_format):
+        job_config = self.bigquery.LoadJobConfig(
+            source_format=self.SOURCE_FORMATS[output_format],
+            write_disposition=self.bigquery.WriteDisposition.WRITE_APPEND,
+            autodetect=output_format == "jsonl",
+        )
+        with open(path, "rb") as f:
+            job = self.client.load_table_from_file(f, self.table_id, job_config=job_config)
+        job.result()
+        return job.output_rows
+
+
+class LocalLoader:
+    """Filesystem stand-in for BigQueryLoader: each load appends a file to the table directory."""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, path, output_format):
+        shutil.copy(path, os.path.join(self.directory, os.path.basename(path)))
+        if output_format == "parquet":
+            return pq.ParquetFile(path).metadata.num_rows
+        with open(path, encoding="utf-8") as f:
+            return sum(1 for _ in f)
+
+
+def build_loader():
+    if BQ_TABLE:
+        return BigQueryLoader(BQ_TABLE)
+    if LOCAL_LOAD_DIR:
+        return LocalLoader(LOCAL_LOAD_DIR)
+    return None
+
+# ---------------------------
+# ✅ INCREMENTAL STATE & DAY PARTITIONS
+# ---------------------------
+class IncrementalState:
+    """Per-account high-water mark (last day fully written) persisted in SQLite."""
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS high_water (
+            account_id TEXT PRIMARY KEY, last_day TEXT, updated_at REAL)""")
+        self.conn.commit()
+
+    def window(self, account_id, end_date, lookback_days, initial_days):
+        """New days since the mark, widened to the trailing lookback (initial_days without a mark)."""
+        with self.lock:
+            row = self.conn.execute("SELECT last_day FROM high_water WHERE account_id = ?",
+                                    (account_id,)).fetchone()
+        end = datetime.strptime(end_date, "%Y-%m-%d").date()
+        if row is None:
+            start = end - timedelta(days=initial_days - 1)
         else:
-            print(f"❌ Failed batch for {ad_account_id}, skipping batch.")
-            continue
+            start = min(datetime.strptime(row[0], "%Y-%m-%d").date() + timedelta(days=1),
+                        end - timedelta(days=lookback_days - 1))
+        return start.isoformat(), end_date
+
+    def advance(self, account_id, last_day):
+        with self.lock:
+            self.conn.execute("""INSERT INTO high_water VALUES (?, ?, ?) ON CONFLICT (account_id) DO UPDATE SET
+                last_day = MAX(last_day, excluded.last_day), updated_at = excluded.updated_at""",
+                (account_id, last_day, time.time()))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def date_range(start_date, end_date):
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+class PartitionedWriter:
+    """Write platform/account/day partitions as size-capped, compressed shards plus a manifest.
+
+    Rows are buffered per (account, day) partition and cut into a shard whenever the
+    buffer passes `max_shard_bytes`; shards are serialized and compressed on a
+    background pool. Partitions are replaced, not appended to: `commit(account)` waits
+    for the account's shards, removes what earlier runs left in the partitions it
+    replaced and records the new shards in `_manifest.json` with row counts and
+    SHA-256 checksums, so loaders can pick up only the partitions that changed.
+    Shard writes are timed on `metrics` (a RunMetrics).
+    """
+
+    JSONL_EXTENSIONS = {"gzip": "jsonl.gz", "zstd": "jsonl.zst", None: "jsonl"}
+
+    def __init__(self, root, platform, output_format, max_shard_bytes=128 * 1024 * 1024, compression="gzip",
+                 workers=4, metrics=None):
+        self.root = os.path.join(root, f"platform={platform}")
+        self.platform = platform
+        self.output_format = output_format
+        self.max_shard_bytes = max_shard_bytes
+        # Parquet shards are always zstd inside the file; JSONL shards are compressed whole
+        self.compression = None if output_format == "parquet" else compression
+        self.extension = "parquet" if output_format == "parquet" else self.JSONL_EXTENSIONS[self.compression]
+        self.run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+        self.changed = []
+        self.metrics = metrics or RunMetrics(platform)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self._buffers = {}  # (account, day) -> [batches, buffered bytes]
+        self._shards = defaultdict(list)  # (account, day) -> shard futures
+        self._replaced = defaultdict(set)  # account -> days rewritten by this run
+        self._manifest_path = os.path.join(self.root, "_manifest.json")
+        self.manifest = {"platform": platform, "partitions": {}}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def partition_dir(self, account_id, day):
+        return os.path.join(self.root, f"account={account_id}", f"day={day}")
+
+    def replace(self, account_id, days):
+        """Mark the account's partitions for `days` as rewritten by this run, rows or not"""
+        with self.lock:
+            self._replaced[account_id].update(days)
+
+    def write(self, account_id, day, batch):
+        """Buffer a batch for a partition: an Arrow table for parquet, JSON lines for jsonl"""
+        parquet = self.output_format == "parquet"
+        rows = batch.num_rows if parquet else len(batch)
+        size = batch.nbytes if parquet else sum(len(line) for line in batch)
+        # Batches bigger than a shard are cut up so every shard stays near max_shard_bytes
+        step = -(-rows // max(1, -(-size // self.max_shard_bytes))) or 1
+        with self.lock:
+            self._replaced[account_id].add(day)
+            for offset in range(0, rows, step):
+                piece = batch.slice(offset, step) if parquet else batch[offset:offset + step]
+                buffer = self._buffers.setdefault((account_id, day), [[], 0])
+                buffer[0].append(piece)
+                buffer[1] += size * min(step, rows - offset) // rows
+                if buffer[1] >= self.max_shard_bytes:
+                    self._submit(account_id, day)
+
+    def _submit(self, account_id, day):
+        # Caller holds the lock
+        batches, _ = self._buffers.pop((account_id, day))
+        shards = self._shards[(account_id, day)]
+        name = f"part-{self.run_id}-{len(shards):05d}.{self.extension}"
+        shards.append(self._pool.submit(self._write_shard, os.path.join(self.partition_dir(account_id, day), name),
+                                        batches))
+
+    def _write_shard(self, path, batches):
+        with self.metrics.span("write_shard") as span:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            if self.output_format == "parquet":
+                table = pa.concat_tables(batches)
+                pq.write_table(table, tmp_path, compression="zstd")
+                rows = table.num_rows
+            else:
+                rows = sum(len(batch) for batch in batches)
+                stream = (pa.CompressedOutputStream(tmp_path, self.compression) if self.compression
+                          else pa.OSFile(tmp_path, "wb"))
+                with stream:
+                    for batch in batches:
+                        stream.write("".join(batch).encode("utf-8"))
+            digest = hashlib.sha256()
+            with open(tmp_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            os.replace(tmp_path, path)
+            span["rows"] = rows
+        return {"path": os.path.relpath(path, self.root), "rows": rows,
+                "bytes": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+    def commit(self, account_id):
+        """Finish the account's shards and swap them in for its previous partitions.
+
+        Returns the rows written per replaced day. If any shard fails, the shards this
+        run already wrote for the account are removed and the old partitions stay.
+        """
+        with self.lock:
+            for key in [key for key in self._buffers if key[0] == account_id]:
+                self._submit(*key)
+            days = sorted(self._replaced.pop(account_id, ()))
+            futures = {day: self._shards.pop((account_id, day), []) for day in days}
 
         try:
-            data = response.json()
-            for row in data.get("data", []):
-                row["ad_account_id"] = ad_account_id
-            all_data.extend(data.get("data", []))
-            time.sleep(0.3)
-        except json.JSONDecodeError:
-            print(f"❌ Invalid JSON for {ad_account_id} batch")
-            continue
+            shards = {day: [future.result() for future in day_futures] for day, day_futures in futures.items()}
+        except Exception:
+            self._remove_shards(future for day_futures in futures.values() for future in day_futures)
+            raise
+
+        written = {}
+        with self.lock:
+            for day, day_shards in shards.items():
+                directory = self.partition_dir(account_id, day)
+                keep = {os.path.basename(shard["path"]) for shard in day_shards}
+                if os.path.isdir(directory):
+                    for name in os.listdir(directory):
+                        if name not in keep:
+                            os.remove(os.path.join(directory, name))
+                    if not keep:
+                        os.rmdir(directory)
+                key = f"account={account_id}/day={day}"
+                written[day] = sum(shard["rows"] for shard in day_shards)
+                if day_shards:
+                    self.manifest["partitions"][key] = {"account": account_id, "date": day, "run_id": self.run_id,
+                                                        "rows": written[day], "shards": day_shards}
+                else:
+                    self.manifest["partitions"].pop(key, None)
+                self.changed.append(key)
+            self._save_manifest()
+        return written
+
+    def discard(self, account_id):
+        """Drop what this run buffered or wrote for the account; its previous partitions stay"""
+        with self.lock:
+            for key in [key for key in self._buffers if key[0] == account_id]:
+                del self._buffers[key]
+            self._replaced.pop(account_id, None)
+            futures = [future for key in [key for key in self._shards if key[0] == account_id]
+                       for future in self._shards.pop(key)]
+        self._remove_shards(futures)
+
+    def _remove_shards(self, futures):
+        for future in futures:
+            if future.exception() is None:
+                os.remove(os.path.join(self.root, future.result()["path"]))
+
+    def _save_manifest(self):
+        # Caller holds the lock
+        os.makedirs(self.root, exist_ok=True)
+        self.manifest["updated_at"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        with open(self._manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(self._manifest_path + ".tmp", self._manifest_path)
+
+    def close(self):
+        with self.lock:
+            pending = {account_id for account_id, _ in self._buffers} | set(self._replaced)
+        for account_id in pending:
+            self.commit(account_id)
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(cancel_futures=True)
+
+
+def partition_writer(root, output_format):
+    return PartitionedWriter(root, "pinterest", output_format, SHARD_MAX_BYTES, JSONL_COMPRESSION,
+                             COMPRESSION_WORKERS, RUN_METRICS)
 
-    print(f"📊 {ad_account_id}: total rows fetched: {len(all_data)}")
-    return all_data
 
 # ---------------------------
-# ✅ MAIN LOOP
+# ✅ CROSS-PLATFORM FACT TABLE
 # ---------------------------
-combined_data = []
+# One typed row per (day, ad, country, attribution window) with the same columns and
+# units in all three pipelines, so dashboards scan a single table
+FACT_SCHEMA = pa.schema([
+    ("date", pa.date32()), ("platform", pa.string()), ("account_id", pa.string()),
+    ("campaign_id", pa.string()), ("adgroup_id", pa.string()), ("ad_id", pa.string()),
+    ("country", pa.string()), ("attribution_window", pa.string()),
+    # Money is in major units of the account currency (never cents or micros)
+    ("spend", pa.float64()), ("impressions", pa.int64()), ("clicks", pa.int64()),
+    ("purchases", pa.int64()), ("purchase_value", pa.float64()),
+])
+# The click/view windows fetch_analytics_batch requests
+REPORT_ATTRIBUTION_WINDOW = "7d_click_1d_view"
+
+
+def fact_table(platform, num_rows, columns):
+    """Build a FACT_SCHEMA table from conformed columns; columns not given are null"""
+    columns = dict(columns, platform=pa.repeat(pa.scalar(platform), num_rows))
+    return pa.Table.from_arrays([pc.cast(columns[field.name], field.type, safe=False) if field.name in columns
+                                 else pa.nulls(num_rows, field.type) for field in FACT_SCHEMA], schema=FACT_SCHEMA)
+
+
+def pinterest_facts(table):
+    """Conform a PINTEREST_SCHEMA table to FACT_SCHEMA"""
+    is_country = pc.equal(table["targeting_type"], "COUNTRY")
+    return fact_table("pinterest", table.num_rows, {
+        "date": table["DATE"], "account_id": table["ad_account_id"],
+        "campaign_id": table["CAMPAIGN_ID"], "adgroup_id": table["AD_GROUP_ID"], "ad_id": table["AD_ID"],
+        "country": pc.if_else(is_country, pc.utf8_upper(table["targeting_value"]), None),
+        "attribution_window": pa.repeat(pa.scalar(REPORT_ATTRIBUTION_WINDOW), table.num_rows),
+        "spend": table["SPEND_IN_DOLLAR"], "impressions": table["TOTAL_IMPRESSION"],
+        "clicks": table["TOTAL_CLICKTHROUGH"], "purchases": table["TOTAL_CHECKOUT"],
+        "purchase_value": pc.divide(pc.cast(table["TOTAL_CHECKOUT_VALUE_IN_MICRO_DOLLAR"], pa.float64()), 1_000_000),
+    })
+
+
+def pinterest_day_parts(rows, days):
+    """(day, rows, to_facts) per day of an account's analytics rows, for write_day_partitions."""
+    by_day = {day: [] for day in days}
+    for row in rows:
+        day = str((row.get("metrics") or row).get("DATE") or "")[:10]
+        if day in by_day:
+            by_day[day].append(row)
+    for day, day_rows in by_day.items():
+        if not day_rows:
+            continue
+        if OUTPUT_FORMAT == "parquet":
+            table = rows_to_table(day_rows)
+            yield day, table, lambda table=table: pinterest_facts(table)
+        else:
+            yield (day, [json.dumps(row) + "\n" for row in day_rows],
+                   lambda day_rows=day_rows: pinterest_facts(rows_to_table(day_rows)))
+
+
+def write_day_partitions(writer, account_id, day_parts, days, facts=None):
+    """Replace the account's partition for every day in `days` with the rows of `day_parts`.
 
-for account_id in AD_ACCOUNT_IDS:
-    print(f"\n🚀 Processing Account: {account_id}")
-    ad_ids = fetch_ads_for_account(account_id)
-    analytics_data = fetch_targeting_analytics_chunks(account_id, ad_ids)
-    combined_data.extend(analytics_data)
+    `day_parts` yields (day, rows, to_facts) for each piece of a day: `rows` as
+    `writer.write` takes them (a table or JSONL lines) and `to_facts()` building the
+    piece's fact-table rows. Days without rows drop any earlier partition. With a
+    `facts` writer the same days of the fact table are replaced too; `writer` may be
+    None to build only the facts. Returns the number of rows written per day.
+    """
+    writers = [w for w in (writer, facts) if w is not None]
+    for w in writers:
+        w.replace(account_id, days)
+    wanted = set(days)
+    try:
+        for day, rows, to_facts in day_parts:
+            if day in wanted:
+                if writer:
+                    writer.write(account_id, day, rows)
+                if facts:
+                    facts.write(account_id, day, to_facts())
+        return [w.commit(account_id) for w in writers][0]
+    except Exception:
+        # Also undoes the fact shards when only the output commit went through
+        for w in writers:
+            w.discard(account_id)
+        raise
 
 # ---------------------------
-# ✅ SAVE COMBINED FILE
+# ✅ MAIN LOOP
 # ---------------------------
-file_name = f"pin_promotion_flat_conversions_{start_date}.jsonl"
-with open(file_name, "w") as f:
-    for row in combined_data:
-        json_line = json.dumps(row)
-        f.write(json_line + "\n")
+def run(start_date, end_date, account_windows=None, state=None):
+    """Extract every account for start_date..end_date, save the output and return the run summary.
+
+    account_windows gives accounts their own (start, end) inside the range. With an
+    IncrementalState (or OUTPUT_LAYOUT "partitioned"), every fully fetched account
+    replaces its day partitions instead of going into one combined file; with a state
+    it also advances its high-water mark.
+    """
+    started = time.time()
+    partitioned = state is not None or OUTPUT_LAYOUT == "partitioned"
+    RUN_METRICS.reset()
+    open_ad_index()
+    account_windows = account_windows or {account_id: (start_date, end_date) for account_id in AD_ACCOUNT_IDS}
+    # Ad listing (producers, one per account) and analytics (consumers) overlap: every
+    # 250-id batch goes to the analytics pool as soon as it fills, and finished batches
+    # are merged here as they arrive.
+    account_rows = defaultdict(int)
+    account_data = defaultdict(list)
+    incomplete_accounts = set()
+    finished_batches = queue.Queue()
+    dispatch_lock = threading.Lock()
+    dispatched = 0
+
+    def dispatch(ad_account_id, batch, start_date, end_date):
+        nonlocal dispatched
+        with dispatch_lock:
+            dispatched += 1
+        submitted_at = time.time()
+
+        def fetch_timed():
+            # queue wait on the analytics pool vs. the batch's own (rate-limited) fetch time
+            RUN_METRICS.add("analytics_queued", time.time() - submitted_at, account=ad_account_id)
+            with RUN_METRICS.span("analytics", account=ad_account_id) as span:
+                rows = fetch_analytics_batch(ad_account_id, batch, start_date, end_date)
+                span["rows"] = len(rows or [])
+            return rows
+
+        future = analytics_pool.submit(fetch_timed)
+        future.add_done_callback(lambda f: finished_batches.put((ad_account_id, batch, f)))
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as analytics_pool, \
+            ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as discovery_pool:
+        discovery = {discovery_pool.submit(stream_ads_to_analytics, account_id, dispatch, *window): account_id
+                     for account_id, window in account_windows.items()}
+        received = 0
+        while True:
+            discovery_done = all(f.done() for f in discovery)
+            with dispatch_lock:
+                if discovery_done and received == dispatched:
+                    break
+            try:
+                account_id, batch, future = finished_batches.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            received += 1
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"❌ Failed batch for {account_id}: {e}")
+                incomplete_accounts.add(account_id)
+                continue
+            if rows is None:
+                incomplete_accounts.add(account_id)
+                continue
+            if AD_INDEX:
+                AD_INDEX.record_delivery(account_id, batch, rows, *account_windows[account_id])
+            account_rows[account_id] += len(rows)
+            account_data[account_id].extend(rows)
+
+        failed_accounts = []
+        for future, account_id in discovery.items():
+            if future.exception():
+                print(f"❌ Failed to list ads for {account_id}: {future.exception()}")
+                failed_accounts.append(account_id)
+            elif account_id in incomplete_accounts:
+                print(f"❌ {account_id}: some analytics batches failed, account left out of this run")
+                failed_accounts.append(account_id)
+
+    for account_id in account_windows:
+        print(f"📊 {account_id}: total rows fetched: {account_rows[account_id]}")
+
+    published = {}
+    if partitioned or FACT_DIR:
+        # Only accounts without a failed listing, batch or write replace their days and move
+        # their mark; a combined run still replaces their days of the fact table
+        with ExitStack() as stack:
+            writer = (stack.enter_context(partition_writer(PARTITION_DIR, OUTPUT_FORMAT))
+                      if partitioned else None)
+            facts = stack.enter_context(partition_writer(FACT_DIR, "parquet")) if FACT_DIR else None
+            for account_id, (account_start, account_end) in account_windows.items():
+                if account_id in failed_accounts:
+                    print(f"⚠️ {account_id}: incomplete fetch, partitions and high-water mark left unchanged")
+                    continue
+                try:
+                    days = date_range(account_start, account_end)
+                    rows = account_data.pop(account_id, []) if partitioned else account_data[account_id]
+                    written = write_day_partitions(writer, account_id, pinterest_day_parts(rows, days), days, facts)
+                except Exception as e:
+                    print(f"❌ Failed to write partitions for {account_id}: {e}")
+                    failed_accounts.append(account_id)
+                    continue
+                published[account_id] = sum(written.values())
+                if state is not None:
+                    state.advance(account_id, account_end)
+                print(f"🗂️ {account_id}: replaced {len(written)} day partitions"
+                      f"{'' if partitioned else ' of the fact table'} ({account_start} to {account_end})")
+
+    if partitioned:
+        return write_run_report({
+            "platform": "pinterest",
+            "start_date": start_date,
+            "end_date": end_date,
+            "accounts": len(account_windows),
+            "failed_accounts": failed_accounts,
+            "rows": sum(published.values()),
+            "output": PARTITION_DIR,
+            "seconds": round(time.time() - started, 1),
+        })
+
+    # Save combined file
+    combined_data = [row for account_id in account_windows if account_id not in failed_accounts
+                     for row in account_data.pop(account_id, [])]
+    file_name = f"pin_promotion_flat_conversions_{start_date}.{OUTPUT_FORMAT}"
+    if OUTPUT_FORMAT == "parquet":
+        save_parquet(combined_data, file_name)
+    else:
+        with RUN_METRICS.span("write") as span, open(file_name, "w") as f:
+            for row in combined_data:
+                json_line = json.dumps(row)
+                f.write(json_line + "\n")
+            span["rows"] = len(combined_data)
+
+    print(f"\n💾 Saved combined file: {file_name}")
+    print(f"✅ Total rows: {len(combined_data)}")
+
+    loader = build_loader()
+    if loader and combined_data:
+        try:
+            print(f"📤 Loaded {loader.load(file_name, OUTPUT_FORMAT)} rows from {file_name}")
+        except Exception as e:
+            print(f"❌ Failed to load {file_name}: {e}")
+
+    return write_run_report({
+        "platform": "pinterest",
+        "start_date": start_date,
+        "end_date": end_date,
+        "accounts": len(account_windows),
+        "failed_accounts": failed_accounts,
+        "rows": len(combined_data),
+        "output": file_name,
+        "seconds": round(time.time() - started, 1),
+    })
+
+
+def write_run_report(summary):
+    if RUN_REPORT_PATH:
+        RUN_METRICS.write(RUN_REPORT_PATH, PROMETHEUS_TEXTFILE, summary)
+        print(f"📈 Run report written to {RUN_REPORT_PATH}")
+    return summary
+
+
+def main():
+    if INCREMENTAL:
+        state = IncrementalState(STATE_DB_PATH)
+        try:
+            windows = {account_id: state.window(account_id, end_date, LOOKBACK_DAYS, INITIAL_DAYS)
+                       for account_id in AD_ACCOUNT_IDS}
+            summary = run(min(start for start, _ in windows.values()), end_date, windows, state)
+        finally:
+            state.close()
+    else:
+        summary = run(start_date, end_date)
+    print(f"⏱️ Finished in {summary['seconds']}s")
+    return summary
+
 
-print(f"\n💾 Saved combined file: {file_name}")
-print(f"✅ Total rows: {len(combined_data)}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Fixtures that load the pipeline scripts the way benchmarks/run_benchmarks.py does."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from run_benchmarks import PIPELINES, load_pipeline  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def meta():
+    return load_pipeline("meta", {"__name__": "meta_pipeline", "FB_TOKEN_USA": "test-token"})
+
+
+@pytest.fixture(scope="module")
+def tiktok():
+    return load_pipeline("tiktok", {"__name__": "tiktok_pipeline"})
+
+
+@pytest.fixture(scope="module")
+def pinterest():
+    return load_pipeline("pinterest", {"__name__": "pinterest_pipeline"})
+
+
+@pytest.fixture(params=sorted(PIPELINES))
+def pipeline(request):
+    """Each pipeline's namespace in turn, for behaviour the three scripts share"""
+    return request.getfixturevalue(request.param)
@@ -0,0 +1,94 @@
+"""Meta's ActionExtractor: action lists flattened into the configured columns."""
+import pytest
+
+ACTION_COLUMNS = [
+    ("purchases", "purchase", "count", None),
+    ("purchase_value", "purchase", "value", None),
+    ("purchases_1d_view", "purchase", "count", "1d_view"),
+    ("posts", "post", "count", None),
+]
+
+
+def legacy_flatten(record):
+    """The per-type `if` chain ActionExtractor replaced"""
+    for column, _, kind, _ in ACTION_COLUMNS:
+        record[column] = 0 if kind == "count" else 0.0
+    for action in record.get("actions", []):
+        for column, action_type, kind, window in ACTION_COLUMNS:
+            if kind == "count" and action.get("action_type") == action_type:
+                record[column] = int(action.get(window or "value", 0))
+    for action_value in record.get("action_values", []):
+        for column, action_type, kind, window in ACTION_COLUMNS:
+            if kind == "value" and action_value.get("action_type") == action_type:
+                record[column] = float(action_value.get(window or "value", 0))
+    record.pop("actions", None)
+    record.pop("action_values", None)
+    return record
+
+
+def synthetic_records(n_records=200):
+    types = ["purchase", "post", "onsite_conversion.other", "link_click"]
+    for i in range(n_records):
+        yield {"ad_id": str(i), "spend": "1.5",
+               "actions": [{"action_type": t, "value": str(i % 9), "1d_view": str(i % 4)} for t in types[i % 3:]],
+               "action_values": [{"action_type": t, "value": f"{i % 9}.5", "1d_view": "0.25"} for t in types[:i % 4]]}
+
+
+@pytest.fixture
+def extractor(meta):
+    return meta["ActionExtractor"](ACTION_COLUMNS)
+
+
+def test_flatten_matches_the_if_chain(extractor):
+    expected = [legacy_flatten(record) for record in synthetic_records()]
+    assert extractor.flatten(list(synthetic_records())) == expected
+
+
+def test_missing_actions_get_defaults(extractor):
+    [row] = extractor.flatten([{"ad_id": "1"}])
+    assert row == {"ad_id": "1", "purchases": 0, "purchase_value": 0.0, "purchases_1d_view": 0, "posts": 0}
+
+
+def test_attribution_window_is_read_for_columns_without_their_own(extractor):
+    record = {"actions": [{"action_type": "purchase", "value": "5", "7d_click": "3", "1d_view": "1"}]}
+    [row] = extractor.flatten([record], "7d_click")
+    assert (row["purchases"], row["purchases_1d_view"]) == (3, 1)
+
+
+def test_default_columns_come_from_config(meta):
+    [row] = meta["ActionExtractor"]().flatten([{}])
+    assert set(row) == {column for column, *_ in meta["Config"].ACTION_COLUMNS}
+
+
+def test_combined_and_per_window_jobs_flatten_to_the_same_rows(meta):
+    windows = ("7d_click", "1d_view")
+    # every window key holds a different figure than 'value', so reading the wrong key shows up
+    records = [{"ad_id": str(i), "country": "US", "date_start": "2025-01-01",
+                "actions": [{"action_type": action_type, "value": str(i % 5),
+                             **{window: str(i % 7 + n) for n, window in enumerate(windows)}}
+                            for action_type in ("purchase", "view_content", "post")],
+                "action_values": [{"action_type": action_type, "value": f"{i % 5}.5",
+                                   **{window: f"{i % 7 + n}.25" for n, window in enumerate(windows)}}
+                                  for action_type in ("purchase", "view_content")]}
+               for i in range(50)]
+    extractor = meta["ActionExtractor"]()
+
+    combined = extractor.job_rows([dict(record) for record in records], "+".join(windows))
+    per_window = [row for window in windows for row in extractor.job_rows([dict(record) for record in records], window)]
+
+    def key(row):
+        return row["attribution_window"], row["ad_id"]
+
+    assert sorted(combined, key=key) == sorted(per_window, key=key)
+    assert {row["attribution_window"] for row in combined} == set(windows)
+    one_day_view = {row["ad_id"]: row for row in combined if row["attribution_window"] == "1d_view"}
+    assert one_day_view["3"]["purchases"] == 4
+
+
+def test_job_attribution_windows(meta, monkeypatch):
+    config = meta["Config"]
+    monkeypatch.setattr(config, "ATTRIBUTION_WINDOWS", ["7d_click", "1d_view"])
+    monkeypatch.setattr(config, "COMBINE_ATTRIBUTION_WINDOWS", True)
+    assert meta["job_attribution_windows"]() == ["7d_click+1d_view"]
+    monkeypatch.setattr(config, "COMBINE_ATTRIBUTION_WINDOWS", False)
+    assert meta["job_attribution_windows"]() == ["7d_click", "1d_view"]
@@ -0,0 +1,78 @@
+"""Meta's ChunkSizer: async job sizes learned per account."""
+import pytest
+
+
+@pytest.fixture
+def open_sizer(meta, tmp_path):
+    sizers = []
+
+    def open_sizer(**kwargs):
+        kwargs = {"target_rows": 1000, "target_seconds": 330, "max_days": 90, "smoothing": 0.5, **kwargs}
+        sizers.append(meta["ChunkSizer"](str(tmp_path / "chunk_sizes.sqlite"), **kwargs))
+        return sizers[-1]
+
+    yield open_sizer
+    for sizer in sizers:
+        sizer.close()
+
+
+def test_accounts_without_history_get_the_maximum(open_sizer):
+    assert open_sizer().chunk_days("1") == 90
+
+
+def test_row_density_limits_the_chunk(open_sizer):
+    sizer = open_sizer()
+    sizer.observe("1", days=10, rows=500, seconds=30)
+    assert sizer.chunk_days("1") == 20
+    # moving average: 50 rows/day, then 150 rows/day -> 100
+    sizer.observe("1", days=10, rows=1500, seconds=30)
+    assert sizer.chunk_days("1") == 10
+
+
+def test_job_seconds_limit_the_chunk(open_sizer):
+    sizer = open_sizer()
+    # 30s overhead + 10s/day against a 330s target
+    sizer.observe("1", days=5, rows=0, seconds=80)
+    assert sizer.chunk_days("1") == 30
+
+
+def test_failure_halves_the_cap_and_success_grows_it_back(open_sizer):
+    sizer = open_sizer()
+    sizer.observe_failure("1", days=40)
+    assert sizer.chunk_days("1") == 20
+    sizer.observe("1", days=20, rows=0, seconds=0)
+    assert sizer.chunk_days("1") == 25
+    sizer.observe("1", days=10, rows=0, seconds=0)
+    assert sizer.chunk_days("1") == 25
+    sizer.observe_failure("1", days=1)
+    assert sizer.chunk_days("1") == 1
+
+
+def test_cap_is_lifted_once_it_reaches_the_maximum(open_sizer):
+    sizer = open_sizer(max_days=10)
+    sizer.observe_failure("1", days=18)
+    assert sizer.chunk_days("1") == 9
+    sizer.observe("1", days=9, rows=0, seconds=0)
+    assert sizer.chunk_days("1") == 10
+
+
+def test_sizing_carries_across_runs(open_sizer):
+    open_sizer().observe("1", days=10, rows=500, seconds=30)
+    assert open_sizer().chunk_days("1") == 20
+    assert open_sizer().chunk_days("2") == 90
+
+
+def test_plan_splits_into_equal_chunks(open_sizer):
+    sizer = open_sizer()
+    sizer.observe("1", days=10, rows=500, seconds=30)
+    chunks = sizer.plan("1", {"since": "2025-01-01", "until": "2025-01-31"})
+    # 31 days at up to 20 per chunk: two chunks of 16 and 15 rather than 20 and 11
+    assert chunks == [{"since": "2025-01-01", "until": "2025-01-16"}, {"since": "2025-01-17", "until": "2025-01-31"}]
+    assert sizer.plan("2", {"since": "2025-01-01", "until": "2025-01-01"}) == [
+        {"since": "2025-01-01", "until": "2025-01-01"}]
+
+
+def test_split_time_range(meta):
+    assert meta["split_time_range"]("2025-01-01", "2025-01-10", days=4) == [
+        {"since": "2025-01-01", "until": "2025-01-04"}, {"since": "2025-01-05", "until": "2025-01-08"},
+        {"since": "2025-01-09", "until": "2025-01-10"}]
@@ -0,0 +1,53 @@
+"""Meta's DeduplicationManager: record keys and per-unit scopes."""
+import pytest
+
+
+def record(**overrides):
+    return {"adset_id": "11", "ad_id": "22", "date_start": "2025-01-31", "date_stop": "2025-01-31",
+            "account_id": "42", "attribution_window": "7d_click", "country": "US", "spend": "1.5", **overrides}
+
+
+@pytest.fixture
+def dedup(meta):
+    return meta["DeduplicationManager"]()
+
+
+def test_key_ignores_metric_fields(dedup):
+    assert dedup.generate_record_hash(record()) == dedup.generate_record_hash(record(spend="9.0", clicks="3"))
+
+
+@pytest.mark.parametrize("field", ["adset_id", "ad_id", "date_start", "date_stop", "account_id",
+                                   "attribution_window", "country"])
+def test_every_identity_field_is_part_of_the_key(dedup, field):
+    assert dedup.generate_record_hash(record()) != dedup.generate_record_hash(record(**{field: "other"}))
+
+
+def test_missing_field_differs_from_empty_string(dedup):
+    assert dedup.generate_record_hash(record(country=None)) != dedup.generate_record_hash(record(country=""))
+
+
+def test_key_is_a_signed_64_bit_int(dedup):
+    key = dedup.generate_record_hash(record())
+    assert isinstance(key, int) and -2 ** 63 <= key < 2 ** 63
+
+
+def test_filter_drops_repeats_within_and_across_batches(dedup):
+    first = dedup.filter_duplicates([record(), record(spend="2.0"), record(country="DE")])
+    assert [r["country"] for r in first] == ["US", "DE"]
+    assert dedup.filter_duplicates([record(country="DE"), record(country="FR")]) == [record(country="FR")]
+    assert dedup.is_duplicate(record())
+
+
+def test_committed_scope_keeps_its_keys(dedup):
+    dedup.filter_duplicates([record()], scope="chunk-1")
+    dedup.commit_scope("chunk-1")
+    dedup.release_scope("chunk-1")
+    assert dedup.is_duplicate(record())
+
+
+def test_released_scope_lets_a_retry_through(dedup):
+    dedup.filter_duplicates([record(country="DE")])
+    dedup.filter_duplicates([record(), record(country="DE")], scope="chunk-1")
+    dedup.release_scope("chunk-1")
+    # only the keys the failed unit added are forgotten
+    assert dedup.filter_duplicates([record(), record(country="DE")], scope="chunk-1") == [record()]
@@ -0,0 +1,67 @@
+"""Each pipeline conforms its native rows to the same FACT_SCHEMA, in the same units."""
+from datetime import date
+
+import pyarrow as pa
+
+EXPECTED = {
+    "date": date(2025, 1, 31), "account_id": "42", "campaign_id": "7", "adgroup_id": "8", "ad_id": "9",
+    "country": "US", "spend": 12.5, "impressions": 1000, "clicks": 30, "purchases": 2, "purchase_value": 40.0,
+}
+
+
+def meta_rows(meta):
+    record = {
+        "account_id": "42", "campaign_id": "7", "adset_id": "8", "ad_id": "9", "country": "us",
+        "attribution_window": "7d_click", "date_start": "2025-01-31", "date_stop": "2025-01-31",
+        "spend": "12.5", "impressions": "1000", "clicks": "30", "purchases": 2, "purchase_value": 40.0,
+    }
+    return meta["meta_facts"](meta["records_to_table"]([record], meta["META_SCHEMA"]))
+
+
+def tiktok_rows(tiktok):
+    record = {
+        "advertiser_id": "42",
+        "dimensions": {"stat_time_day": "2025-01-31 00:00:00", "country_code": "us", "ad_id": "9"},
+        "metrics": {"campaign_id": "7", "adgroup_id": "8", "spend": "12.5", "impressions": "1000", "clicks": "30",
+                    "complete_payment": "2", "total_complete_payment_rate": "40.0"},
+    }
+    return tiktok["tiktok_facts"](tiktok["frame_to_table"](tiktok["records_to_frame"]([record])))
+
+
+def pinterest_rows(pinterest):
+    row = {
+        "ad_account_id": "42", "targeting_type": "COUNTRY", "targeting_value": "us",
+        "metrics": {"DATE": "2025-01-31", "CAMPAIGN_ID": "7", "AD_GROUP_ID": "8", "AD_ID": "9",
+                    "SPEND_IN_DOLLAR": 12.5, "TOTAL_IMPRESSION": 1000, "TOTAL_CLICKTHROUGH": 30,
+                    "TOTAL_CHECKOUT": 2, "TOTAL_CHECKOUT_VALUE_IN_MICRO_DOLLAR": 40_000_000},
+    }
+    return pinterest["pinterest_facts"](pinterest["rows_to_table"]([row]))
+
+
+def test_meta_facts(meta):
+    facts = meta_rows(meta)
+    assert facts.schema.equals(meta["FACT_SCHEMA"])
+    assert facts.to_pylist() == [{**EXPECTED, "platform": "meta", "attribution_window": "7d_click"}]
+
+
+def test_tiktok_facts(tiktok):
+    facts = tiktok_rows(tiktok)
+    assert facts.schema.equals(tiktok["FACT_SCHEMA"])
+    assert facts.to_pylist() == [{**EXPECTED, "platform": "tiktok", "attribution_window": "7d_click_1d_view"}]
+
+
+def test_pinterest_facts_converts_micro_dollars(pinterest):
+    facts = pinterest_rows(pinterest)
+    assert facts.schema.equals(pinterest["FACT_SCHEMA"])
+    assert facts.to_pylist() == [{**EXPECTED, "platform": "pinterest", "attribution_window": "7d_click_1d_view"}]
+
+
+def test_pinterest_facts_leave_country_null_for_other_targeting(pinterest):
+    table = pinterest["rows_to_table"]([{"ad_account_id": "42", "targeting_type": "REGION", "targeting_value": "us-ca",
+                                         "metrics": {"DATE": "2025-01-31", "AD_ID": "9"}}])
+    assert pinterest["pinterest_facts"](table)["country"].to_pylist() == [None]
+
+
+def test_fact_tables_concatenate(meta, tiktok, pinterest):
+    combined = pa.concat_tables([meta_rows(meta), tiktok_rows(tiktok), pinterest_rows(pinterest)])
+    assert combined["platform"].to_pylist() == ["meta", "tiktok", "pinterest"]
@@ -0,0 +1,34 @@
+"""Incremental windows (IncrementalState, shared) and TikTok's split of long report ranges."""
+
+
+def test_first_run_covers_initial_days(tiktok, tmp_path):
+    state = tiktok["IncrementalState"](str(tmp_path / "state.sqlite"))
+    assert state.window("1", "2025-01-31", lookback_days=7, initial_days=30) == ("2025-01-02", "2025-01-31")
+
+
+def test_window_starts_after_the_mark_or_at_the_lookback(tiktok, tmp_path):
+    state = tiktok["IncrementalState"](str(tmp_path / "state.sqlite"))
+    state.advance("1", "2025-01-30")
+    assert state.window("1", "2025-01-31", lookback_days=7, initial_days=30) == ("2025-01-25", "2025-01-31")
+    state.advance("2", "2025-01-10")
+    assert state.window("2", "2025-01-31", lookback_days=7, initial_days=30) == ("2025-01-11", "2025-01-31")
+
+
+def test_mark_never_moves_back(tiktok, tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    state = tiktok["IncrementalState"](path)
+    state.advance("1", "2025-01-30")
+    state.advance("1", "2025-01-20")
+    state.close()
+    reopened = tiktok["IncrementalState"](path)
+    assert reopened.window("1", "2025-01-31", lookback_days=1, initial_days=30) == ("2025-01-31", "2025-01-31")
+
+
+def test_date_range_is_inclusive(tiktok):
+    assert tiktok["date_range"]("2024-12-30", "2025-01-02") == ["2024-12-30", "2024-12-31", "2025-01-01", "2025-01-02"]
+
+
+def test_tiktok_report_ranges_fit_the_30_day_limit(tiktok):
+    ranges = tiktok["report_ranges"]("2024-12-01", "2025-01-31")
+    assert ranges == [("2024-12-01", "2024-12-30"), ("2024-12-31", "2025-01-29"), ("2025-01-30", "2025-01-31")]
+    assert tiktok["report_ranges"]("2025-01-01", "2025-01-01") == [("2025-01-01", "2025-01-01")]
@@ -0,0 +1,84 @@
+"""Meta's ProgressLedger: a restarted run resumes from the units already committed."""
+import os
+
+import pytest
+
+WINDOW = "7d_click"
+RANGE = {"since": "2025-01-01", "until": "2025-01-31"}
+
+
+@pytest.fixture
+def open_ledger(meta, tmp_path):
+    ledgers = []
+
+    def open_ledger():
+        ledgers.append(meta["ProgressLedger"](str(tmp_path), "backfill"))
+        return ledgers[-1]
+
+    yield open_ledger
+    for ledger in ledgers:
+        ledger.close()
+
+
+def commit(ledger, since, until, rows=1, window=WINDOW):
+    time_range = {"since": since, "until": until}
+    tmp_path = ledger.shard_path("1", time_range, window) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("{}\n" * rows)
+    ledger.commit_unit("1", time_range, window, tmp_path, rows)
+    return ledger.shard_path("1", time_range, window)
+
+
+def test_restart_skips_committed_units(open_ledger):
+    ledger = open_ledger()
+    commit(ledger, "2025-01-01", "2025-01-10")
+    ledger.mark_failed("1", {"since": "2025-01-11", "until": "2025-01-20"}, WINDOW)
+    commit(ledger, "2025-01-21", "2025-01-25")
+    ledger.close()
+
+    resumed = open_ledger()
+    assert resumed.uncovered("1", RANGE, WINDOW) == [{"since": "2025-01-11", "until": "2025-01-20"},
+                                                      {"since": "2025-01-26", "until": "2025-01-31"}]
+    assert resumed.uncovered("2", RANGE, WINDOW) == [RANGE]
+    assert resumed.uncovered("1", RANGE, "1d_view") == [RANGE]
+
+
+def test_coverage_is_by_day_not_by_chunk(open_ledger):
+    ledger = open_ledger()
+    commit(ledger, "2025-01-01", "2025-01-20")
+    # a bisected retry of an overlapping chunk
+    commit(ledger, "2025-01-15", "2025-01-31")
+    assert ledger.uncovered("1", RANGE, WINDOW) == []
+    # only units inside the range count, so a narrower rerun fetches its days again
+    assert ledger.uncovered("1", {"since": "2025-01-05", "until": "2025-01-10"}, WINDOW) == [
+        {"since": "2025-01-05", "until": "2025-01-10"}]
+
+
+def test_completed_shards_only_once_every_day_is_done(open_ledger):
+    ledger = open_ledger()
+    first = commit(ledger, "2025-01-01", "2025-01-15")
+    assert ledger.completed_shards("1", RANGE, [WINDOW]) is None
+    # empty units complete their days without a shard
+    commit(ledger, "2025-01-16", "2025-01-20", rows=0)
+    last = commit(ledger, "2025-01-21", "2025-01-31")
+    assert ledger.completed_shards("1", RANGE, [WINDOW]) == [first, last]
+    assert ledger.completed_shards("1", RANGE, [WINDOW, "1d_view"]) is None
+    assert all(os.path.exists(path) for path in (first, last))
+
+
+def test_covers_uses_the_scheduled_windows(meta, open_ledger, monkeypatch):
+    monkeypatch.setattr(meta["Config"], "ATTRIBUTION_WINDOWS", [WINDOW])
+    ledger = open_ledger()
+    commit(ledger, "2025-01-01", "2025-01-31")
+    assert ledger.covers("1", "2025-01-01", "2025-01-31")
+    monkeypatch.setattr(meta["Config"], "ATTRIBUTION_WINDOWS", [WINDOW, "1d_view"])
+    monkeypatch.setattr(meta["Config"], "COMBINE_ATTRIBUTION_WINDOWS", False)
+    assert not ledger.covers("1", "2025-01-01", "2025-01-31")
+
+
+def test_discard_removes_checkpoints(open_ledger, tmp_path):
+    ledger = open_ledger()
+    commit(ledger, "2025-01-01", "2025-01-31")
+    ledger.discard()
+    assert os.listdir(tmp_path) == []
+    assert open_ledger().uncovered("1", RANGE, WINDOW) == [RANGE]
@@ -0,0 +1,47 @@
+"""TikTok's columnar normalizer returns the same records as normalize_record."""
+import pytest
+
+AD_MAPPING = {
+    "1000": {"ad_name": "ad 0", "adgroup_id": "500", "campaign_id": "100", "status": "ENABLE"},
+    "1001": {"ad_name": "", "adgroup_id": "501", "campaign_id": "101", "status": None},
+}
+CAMPAIGN_MAPPING = {"100": {"campaign_name": "campaign 0", "objective_type": "CONVERSIONS"}}
+ADGROUP_MAPPING = {"500": "adgroup 0"}
+
+
+def rows():
+    return [
+        {"dimensions": {"ad_id": "1000", "stat_time_day": "2024-05-01", "country_code": "US"},
+         "metrics": {"spend": "1.25", "clicks": "3", "impressions": "120", "conversion": "1"}},
+        # mapping values that are empty fall back to the row's own dimensions
+        {"dimensions": {"ad_id": 1001, "stat_time_day": "2024-05-02", "country_code": "DE", "ad_name": "from row",
+                        "status": "DISABLE"},
+         "metrics": {"spend": "0"}},
+        # unmapped ad, id that is not an integer, timestamp already in report format
+        {"dimensions": {"ad_id": "abc", "stat_time_day": "2024-05-03 00:00:00", "campaign_id": "100"},
+         "metrics": {}},
+        {"dimensions": {"stat_time_day": "not-a-day"}, "metrics": {"clicks": "7"}},
+        {"dimensions": None, "metrics": None},
+    ]
+
+
+def test_columnar_records_match_normalize_record(tiktok):
+    args = (AD_MAPPING, CAMPAIGN_MAPPING, ADGROUP_MAPPING, "7000")
+    expected = [tiktok["normalize_record"](row, *args) for row in rows()]
+    assert tiktok["normalize_records_columnar"](rows(), *args) == expected
+
+
+def test_columnar_frame_is_flat(tiktok):
+    frame = tiktok["normalize_records_columnar"](rows(), AD_MAPPING, CAMPAIGN_MAPPING, ADGROUP_MAPPING, "7000",
+                                                 as_frame=True)
+    assert len(frame) == len(rows())
+    assert set(tiktok["EXPECTED_DIMS"]) | set(tiktok["EXPECTED_METRICS"]) | {"advertiser_id"} == set(frame.columns)
+    assert frame.loc[0, "campaign_name"] == "campaign 0"
+    assert frame.loc[0, "stat_time_day"] == "2024-05-01T00:00:00Z"
+    assert frame.loc[0, "advertiser_id"] == 7000
+
+
+@pytest.mark.parametrize("advertiser_id, expected", [("7000", 7000), ("adv-1", "adv-1")])
+def test_advertiser_id_is_cast_when_numeric(tiktok, advertiser_id, expected):
+    records = tiktok["normalize_records_columnar"](rows()[:1], {}, {}, {}, advertiser_id)
+    assert records[0]["advertiser_id"] == expected
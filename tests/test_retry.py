@@ -0,0 +1,88 @@
+"""The retry layer, tested on one pipeline's copy (test_shared_code keeps the copies identical)."""
+import pytest
+
+
+@pytest.fixture
+def retry(tiktok):
+    return tiktok
+
+
+def failing(retry, errors, result="ok"):
+    """send() that raises each of `errors` in turn, then returns `result`"""
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return send, calls
+
+
+def test_retries_transient_errors_then_returns(retry):
+    sleeps = []
+    policy = retry["RetryPolicy"](max_attempts=4, sleep=sleeps.append, log=lambda message: None)
+    send, calls = failing(retry, [retry["RetryableError"]("503"), retry["RetryableError"]("timeout")])
+    assert policy.call("api.example", send) == "ok"
+    assert len(calls) == 3 and len(sleeps) == 2
+
+
+def test_non_retryable_error_propagates_at_once(retry):
+    policy = retry["RetryPolicy"](sleep=lambda seconds: None, log=lambda message: None)
+    send, calls = failing(retry, [ValueError("bad parameter")])
+    with pytest.raises(ValueError):
+        policy.call("api.example", send)
+    assert len(calls) == 1
+
+
+def test_waits_as_long_as_the_server_asks(retry):
+    sleeps = []
+    policy = retry["RetryPolicy"](base_delay=0.5, sleep=sleeps.append, log=lambda message: None)
+    send, _ = failing(retry, [retry["RetryableError"]("429", retry_after=7, throttled=True)])
+    policy.call("api.example", send)
+    assert 7 <= sleeps[0] <= 7.5
+
+
+def test_retry_budget_caps_error_retries(retry):
+    policy = retry["RetryPolicy"](max_attempts=5, budget_ratio=0.0, budget_burst=2, failure_threshold=100,
+                                  sleep=lambda seconds: None, log=lambda message: None)
+    send, calls = failing(retry, [retry["RetryableError"]("503")] * 10)
+    with pytest.raises(retry["RetryableError"]):
+        policy.call("api.example", send)
+    assert len(calls) == 3  # the first attempt plus the two retries the budget holds
+
+
+def test_throttling_does_not_spend_the_budget(retry):
+    policy = retry["RetryPolicy"](max_attempts=4, budget_ratio=0.0, budget_burst=0,
+                                  sleep=lambda seconds: None, log=lambda message: None)
+    throttled = retry["RetryableError"]("429", retry_after=0, throttled=True)
+    send, calls = failing(retry, [throttled, throttled])
+    assert policy.call("api.example", send) == "ok"
+    assert len(calls) == 3
+
+
+def test_circuit_opens_after_consecutive_failures(retry):
+    now = [0.0]
+    breaker = retry["CircuitBreaker"]("api.example", failure_threshold=3, reset_timeout=30,
+                                      clock=lambda: now[0], log=lambda message: None)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert not breaker.allow()
+    now[0] = 31.0
+    assert breaker.allow()  # the half-open probe
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"Retry-After": "12"}, 12),
+    ({"Retry-After": "Thu, 01 Jan 1970 00:01:40 GMT"}, 40),
+    ({"X-RateLimit-Reset": "160"}, 160),
+    ({"X-RateLimit-Reset": "2000000060"}, 2000000000),  # an epoch timestamp rather than a delay
+    ({}, None),
+])
+def test_parse_retry_after(retry, headers, expected):
+    value = retry["parse_retry_after"](headers, now=60)
+    assert value == expected if expected is None else value == pytest.approx(expected)
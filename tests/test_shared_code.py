@@ -0,0 +1,39 @@
+"""The pipelines run as standalone scripts, so code they share is copied into each one.
+
+These definitions must stay byte-identical across meta/, tiktok/ and pinterest/src/main.py;
+change one copy and paste it into the other two.
+"""
+import ast
+
+import pytest
+
+from run_benchmarks import PIPELINES
+
+SHARED = [
+    "RetryableError", "CircuitOpenError", "parse_retry_after", "CircuitBreaker", "RetryBudget", "RetryPolicy",
+    "RunMetrics", "ReplayAdapter", "IncrementalState", "date_range", "PartitionedWriter", "write_day_partitions",
+    "FACT_SCHEMA", "fact_table",
+]
+
+
+def top_level_sources(path):
+    with open(path, encoding="utf-8") as f:
+        # IPython shell escapes (!pip ...) are not Python
+        source = "\n".join("# " + line if line.lstrip().startswith("!") else line for line in f.read().splitlines())
+    sources = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            sources[node.targets[0].id] = ast.get_source_segment(source, node)
+        elif isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+            sources[node.name] = ast.get_source_segment(source, node)
+    return sources
+
+
+SOURCES = {platform: top_level_sources(path) for platform, path in PIPELINES.items()}
+
+
+@pytest.mark.parametrize("name", SHARED)
+def test_shared_definition_is_identical(name):
+    copies = {platform: sources.get(name) for platform, sources in SOURCES.items()}
+    assert None not in copies.values(), f"{name} is missing from {[p for p, s in copies.items() if s is None]}"
+    assert len(set(copies.values())) == 1, f"{name} differs between {', '.join(sorted(copies))}"
@@ -0,0 +1,96 @@
+"""UsageGovernor pacing, replayed on a virtual clock."""
+import json
+import random
+
+import pytest
+
+
+@pytest.fixture
+def clock():
+    class VirtualClock:
+        now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+        def sleep(self, seconds):
+            self.now += seconds
+
+    return VirtualClock()
+
+
+@pytest.fixture
+def governor(meta, clock):
+    return meta["UsageGovernor"](clock=clock, sleep=clock.sleep, rng=random.Random(0))
+
+
+def account_usage(percent, reset_seconds=0):
+    return {"x-ad-account-usage": json.dumps({"acc_id_util_pct": percent, "reset_time_duration": reset_seconds})}
+
+
+def waits(governor, clock, account_id, calls):
+    result = []
+    for _ in range(calls):
+        started = clock.now
+        governor.acquire(account_id)
+        result.append(clock.now - started)
+    return result
+
+
+def test_calls_below_the_soft_limit_are_not_delayed(governor, clock):
+    governor.update("1", account_usage(40))
+    assert waits(governor, clock, "1", 5) == [0] * 5
+
+
+def test_calls_are_spaced_out_between_soft_and_hard_limits(governor, clock):
+    governor.update("1", account_usage(75))
+    # halfway between 60 and 90: a quarter of max_spacing
+    assert waits(governor, clock, "1", 3) == [0, 7.5, 7.5]
+    # other accounts only share the app's usage
+    assert waits(governor, clock, "2", 1) == [0]
+
+
+def test_hard_limit_blocks_until_the_reset(governor, clock):
+    governor.update("1", account_usage(95, reset_seconds=120))
+    assert waits(governor, clock, "1", 2) == [120, 0]
+
+
+def test_regain_estimate_is_in_minutes(governor, clock):
+    governor.update("1", {"x-business-use-case-usage": json.dumps(
+        {"act_1": [{"type": "ads_insights", "call_count": 100, "estimated_time_to_regain_access": 3}]})})
+    assert governor.wait_time("1") == 180
+    assert governor.wait_time("2") == 0
+
+
+def test_app_level_throttling_blocks_every_account(governor, clock):
+    assert governor.record_error("1", 4)
+    assert governor.wait_time("2") > 0
+    assert not governor.record_error("1", 100)
+
+
+def test_throttle_backoff_grows_until_a_call_succeeds(meta, clock):
+    governor = meta["UsageGovernor"](clock=clock, sleep=clock.sleep, rng=random.Random(0), throttle_backoff=5,
+                                     default_cooldown=1000)
+    governor.rng.uniform = lambda low, high: high
+    backoffs = []
+    for _ in range(3):
+        governor.record_error("1", 17)
+        backoffs.append(governor.wait_time("1"))
+        clock.sleep(backoffs[-1])
+    assert backoffs == [10, 20, 40]
+    governor.record_success("1")
+    governor.record_error("1", 17)
+    assert governor.wait_time("1") == 10
+
+
+def test_recorded_headers_replay_to_the_same_waits(meta, governor, clock):
+    recorder = meta["UsageGovernor"](record=True)
+    for percent in (50, 70, 80, 95):
+        recorder.update("1", account_usage(percent, reset_seconds=30))
+
+    replayed = []
+    for entry in recorder.recorded:
+        replayed.extend(waits(governor, clock, entry["account_id"], 1))
+        governor.update(entry["account_id"], entry["headers"])
+    replayed.extend(waits(governor, clock, "1", 1))
+    assert replayed == [0, 0, pytest.approx(30 * (10 / 30) ** 2), pytest.approx(30 * (20 / 30) ** 2), 30]
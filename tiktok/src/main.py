@@ -4,17 +4,34 @@
 !pip install google-cloud-bigquery-datatransfer
 !pip install requests pandas google-cloud-bigquery
 !pip install pandas-gbq
+!pip install pyarrow
 
 
 import os
 import json
 import time
+import random
 import logging
+import hashlib
+import shutil
+import sqlite3
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 from six import string_types
-from six.moves.urllib.parse import urlencode, urlunparse
+from six.moves.urllib.parse import parse_qsl, urlencode, urlsplit, urlunparse
 
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,6 +40,40 @@ load_dotenv()
 ACCESS_TOKEN = os.getenv("TIKTOK_ACCESS_TOKEN", "YOUR TOKEN")
 ADVERTISER_IDS = json.loads(os.getenv("TIKTOK_ADVERTISER_IDS", '["ACCOUNT_ID", "ACCOUNT_ID"]'))
 REPORT_DAYS = int(os.getenv("REPORT_DAYS", "1"))  # number of days to include, default = 1
+MAX_WORKERS = int(os.getenv("TIKTOK_MAX_WORKERS", "8"))  # concurrent requests across advertisers/endpoints
+MAX_QPS = float(os.getenv("TIKTOK_MAX_QPS", "10"))  # shared request rate cap
+PAGE_WORKERS = int(os.getenv("TIKTOK_PAGE_WORKERS", "4"))  # concurrent pages per paginated fetch
+METADATA_CACHE_PATH = os.getenv("TIKTOK_METADATA_CACHE", "tiktok_metadata.sqlite")  # "" disables the cache
+METADATA_TTL_HOURS = float(os.getenv("TIKTOK_METADATA_TTL_HOURS", "24"))  # full catalog refresh interval
+OUTPUT_FORMAT = os.getenv("TIKTOK_OUTPUT_FORMAT", "parquet")  # "parquet" or "jsonl"
+BQ_TABLE = os.getenv("TIKTOK_BQ_TABLE", "")  # e.g. "project.dataset.tiktok_ads"; empty = don't load
+LOCAL_LOAD_DIR = os.getenv("TIKTOK_LOCAL_LOAD_DIR", "")  # filesystem stand-in for BigQuery (tests)
+# Incremental mode: each advertiser from its high-water mark plus a trailing re-fetch window, into per-day partitions
+INCREMENTAL = os.getenv("TIKTOK_INCREMENTAL", "0") == "1"
+STATE_DB_PATH = os.getenv("TIKTOK_STATE_DB", "tiktok_state.sqlite")
+LOOKBACK_DAYS = int(os.getenv("TIKTOK_LOOKBACK_DAYS", "7"))  # lets 7d_click_1d_view conversions settle
+INITIAL_DAYS = int(os.getenv("TIKTOK_INITIAL_DAYS", "30"))  # first run for an advertiser
+PARTITION_DIR = os.getenv("TIKTOK_PARTITION_DIR", "tiktok_partitions")
+# "combined" = one file for a full-refresh run; "partitioned" = platform/account/day partitions as in incremental mode
+OUTPUT_LAYOUT = os.getenv("TIKTOK_OUTPUT_LAYOUT", "combined")
+SHARD_MAX_BYTES = int(os.getenv("TIKTOK_SHARD_MAX_BYTES", str(128 * 1024 * 1024)))  # uncompressed size that rolls a shard
+JSONL_COMPRESSION = os.getenv("TIKTOK_JSONL_COMPRESSION", "gzip") or None  # "gzip", "zstd" or "" (parquet is always zstd)
+COMPRESSION_WORKERS = int(os.getenv("TIKTOK_COMPRESSION_WORKERS", "4"))
+# cross-platform fact table (FACT_SCHEMA) shared with the Meta and Pinterest pipelines; "" disables it
+FACT_DIR = os.getenv("TIKTOK_FACT_DIR", "ad_facts")
+RUN_REPORT_PATH = os.getenv("TIKTOK_RUN_REPORT", "tiktok_run_report.json")  # "" disables the run report
+PROMETHEUS_TEXTFILE = os.getenv("TIKTOK_PROM_TEXTFILE", "")  # node_exporter textfile collector target
+# offline runs: "record" saves every API exchange to the cassette, "replay" serves it back without network
+REPLAY_MODE = os.getenv("TIKTOK_REPLAY_MODE", "")
+REPLAY_CASSETTE = os.getenv("TIKTOK_CASSETTE", "tiktok_cassette.jsonl")
+STANDIN_URL = os.getenv("TIKTOK_STANDIN_URL", "")  # e.g. "http://127.0.0.1:8765", a local stand-in API server
+# retries: full-jitter backoff (or the server's Retry-After), a circuit breaker and a retry budget per host
+RETRY_MAX_ATTEMPTS = int(os.getenv("TIKTOK_RETRY_MAX_ATTEMPTS", "6"))
+RETRY_BASE_DELAY = float(os.getenv("TIKTOK_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("TIKTOK_RETRY_MAX_DELAY", "60"))
+CIRCUIT_FAILURES = int(os.getenv("TIKTOK_CIRCUIT_FAILURES", "5"))  # failures in a row that open a host's circuit
+CIRCUIT_RESET_SECONDS = float(os.getenv("TIKTOK_CIRCUIT_RESET_SECONDS", "30"))
+RETRY_BUDGET_RATIO = float(os.getenv("TIKTOK_RETRY_BUDGET_RATIO", "0.2"))  # error retries per request, after a burst of 10
 # TikTok API paths (keep as-is)
 BASE_PATH = "/open_api/v1.3/report/integrated/get/"
 AD_PATH = "/open_api/v1.3/ad/get/"
@@ -33,39 +84,447 @@ ADGROUP_PATH = "/open_api/v1.3/adgroup/get/"
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger("tiktok_etl")
 
+# ---------- RUN METRICS ----------
+class RunMetrics:
+    """Thread-safe stage timings (per stage + labels such as account) and counters for one run."""
+    def __init__(self, platform):
+        self.platform = platform
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.spans = defaultdict(lambda: {"count": 0, "seconds": 0.0, "rows": 0})
+            self.counters = defaultdict(float)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        # set span["rows"] inside the block to report throughput
+        span = {"rows": 0}
+        started = time.time()
+        try:
+            yield span
+        finally:
+            self.add(stage, time.time() - started, span["rows"], **labels)
+
+    def add(self, stage, seconds, rows=0, **labels):
+        key = (stage, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            entry = self.spans[key]
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["rows"] += rows
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def report(self, summary=None):
+        with self.lock:
+            spans = [dict(stage=stage, labels=dict(labels), **entry) for (stage, labels), entry in self.spans.items()]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self.counters.items()]
+            elapsed = time.time() - self.started_at
+        stages = defaultdict(lambda: {"count": 0, "seconds": 0.0, "rows": 0})
+        for span in spans:
+            for field in ("count", "seconds", "rows"):
+                stages[span["stage"]][field] += span[field]
+        for totals in stages.values():
+            totals["rows_per_second"] = totals["rows"] / totals["seconds"] if totals["rows"] and totals["seconds"] else None
+        return {"platform": self.platform, "elapsed_seconds": elapsed, "summary": summary,
+                "stages": dict(stages), "counters": counters, "spans": spans}
+
+    def write(self, report_path, prometheus_path=None, summary=None):
+        report = self.report(summary)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        if prometheus_path:
+            platform = f'platform="{self.platform}"'
+            lines = ["# TYPE social_ads_run_seconds gauge",
+                     f"social_ads_run_seconds{{{platform}}} {report['elapsed_seconds']:.3f}",
+                     "# TYPE social_ads_stage_seconds_total counter",
+                     "# TYPE social_ads_stage_rows_total counter",
+                     "# TYPE social_ads_stage_calls_total counter"]
+            for stage, totals in sorted(report["stages"].items()):
+                labels = f'{platform},stage="{stage}"'
+                lines.append(f"social_ads_stage_seconds_total{{{labels}}} {totals['seconds']:.3f}")
+                lines.append(f"social_ads_stage_rows_total{{{labels}}} {totals['rows']}")
+                lines.append(f"social_ads_stage_calls_total{{{labels}}} {totals['count']}")
+            for counter in sorted(report["counters"], key=lambda c: (c["name"], sorted(c["labels"].items()))):
+                labels = ",".join([platform] + [f'{k}="{v}"' for k, v in sorted(counter["labels"].items())])
+                lines.append(f"social_ads_{counter['name']}_total{{{labels}}} {counter['value']:g}")
+            # rename into place so the collector never scrapes a partial file
+            with open(prometheus_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(prometheus_path + ".tmp", prometheus_path)
+        return report
+
+RUN_METRICS = RunMetrics("tiktok")
+
+# ---------- RETRIES ----------
+class RetryableError(Exception):
+    """A failure worth another attempt: throttling, a 5xx, a timeout or a dropped connection.
+
+    retry_after is the server's own hint in seconds, when it gave one.
+    """
+    def __init__(self, message, retry_after=None, throttled=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+class CircuitOpenError(RetryableError):
+    """Raised without sending the request while the host's circuit is open."""
+
+def parse_retry_after(headers, now=None):
+    """Seconds to wait according to Retry-After (delay or HTTP date) or a rate-limit reset header, else None."""
+    headers = CaseInsensitiveDict(headers or {})
+    now = time.time() if now is None else now
+    value = headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+    for name in ("RateLimit-Reset", "X-RateLimit-Reset"):
+        try:
+            value = float(headers.get(name))
+        except (TypeError, ValueError):
+            continue
+        # some APIs send the reset as an epoch timestamp rather than a delay
+        return max(0.0, value - now if value > 1e9 else value)
+    return None
+
+class CircuitBreaker:
+    """Stop calling a host after failure_threshold failures in a row.
+
+    While open, calls fail fast for reset_timeout seconds; then one probe is let through
+    (half-open) and its outcome closes the circuit or opens it again. Openings are
+    counted on `metrics` (a RunMetrics) and reported through `log`.
+    """
+    def __init__(self, host, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic, metrics=None, log=print):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.metrics = metrics
+        self.log = log
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if not self.probing and (self.opened_at is not None or self.failures < self.failure_threshold):
+                return
+            self.opened_at = self.clock()
+            self.probing = False
+        if self.metrics:
+            self.metrics.count("circuit_opened", host=self.host)
+        self.log(f"Circuit for {self.host} opened after {self.failures} failures in a row; "
+                 f"pausing it for {self.reset_timeout:.0f}s")
+
+class RetryBudget:
+    """Token bucket capping a host's error retries at `ratio` per request, after an initial `burst`."""
+    def __init__(self, ratio=0.2, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class RetryPolicy:
+    """Retries shared by every request: full-jitter backoff, Retry-After, circuit breakers and budgets per host.
+
+    call(host, send) runs send() until it returns. send raises RetryableError for
+    throttling and transient failures, and any other exception for failures no retry
+    can fix, which propagate at once. Throttled attempts wait as long as the server
+    asked and leave the host's circuit and budget alone; other failures count against
+    both. The last error is raised once the attempts or the budget run out. Retries
+    are counted on `metrics` (a RunMetrics) and reported through `log`.
+    """
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0, max_retry_after=300.0,
+                 failure_threshold=5, reset_timeout=30.0, budget_ratio=0.2, budget_burst=10, sleep=time.sleep,
+                 metrics=None, log=print):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self.sleep = sleep
+        self.metrics = metrics
+        self.log = log
+        self.breakers = {}
+        self.budgets = {}
+        self.lock = threading.Lock()
+
+    def _host(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, self.failure_threshold, self.reset_timeout,
+                                                     metrics=self.metrics, log=self.log)
+                self.budgets[host] = RetryBudget(self.budget_ratio, self.budget_burst)
+            return self.breakers[host], self.budgets[host]
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retrying after failed attempt number `attempt` (1-based)."""
+        if retry_after is not None:
+            # the server said when; a little jitter keeps the waiting threads from returning in lockstep
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, host, send, endpoint=""):
+        breaker, budget = self._host(host)
+        budget.deposit()
+        for attempt in range(1, self.max_attempts + 1):
+            if breaker.allow():
+                try:
+                    result = send()
+                except RetryableError as e:
+                    error = e
+                    if e.throttled:
+                        breaker.record_success()  # a rate-limit answer still shows the host is up
+                    else:
+                        breaker.record_failure()
+                except Exception:
+                    breaker.record_success()  # the host answered; the request itself is at fault
+                    raise
+                else:
+                    breaker.record_success()
+                    return result
+            else:
+                error = CircuitOpenError(f"circuit open for {host}", breaker.remaining() or None)
+
+            if attempt == self.max_attempts:
+                break
+            if error.retry_after is not None and error.retry_after > self.max_retry_after:
+                break  # not worth holding the run for
+            reason = "throttle" if error.throttled else "circuit" if isinstance(error, CircuitOpenError) else "error"
+            if reason == "error" and not budget.withdraw():
+                if self.metrics:
+                    self.metrics.count("retries_denied", host=host)
+                self.log(f"{endpoint or host}: retry budget spent, giving up: {error}")
+                break
+            delay = self.backoff(attempt, error.retry_after)
+            if self.metrics:
+                self.metrics.count("retries", endpoint=endpoint, reason=reason)
+                self.metrics.count("sleep_seconds", delay, reason="backoff")
+            self.log(f"{endpoint or host}: {error} (attempt {attempt}/{self.max_attempts}), retrying in {delay:.1f}s")
+            self.sleep(delay)
+        raise error
+
+RETRY_POLICY = RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, failure_threshold=CIRCUIT_FAILURES,
+                           reset_timeout=CIRCUIT_RESET_SECONDS, budget_ratio=RETRY_BUDGET_RATIO,
+                           metrics=RUN_METRICS, log=logger.warning)
+
+# ---------- HTTP ----------
+class RateLimiter:
+    """Space requests at least 1/qps seconds apart across all threads."""
+    def __init__(self, qps):
+        self.interval = 1.0 / qps if qps > 0 else 0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            RUN_METRICS.count("sleep_seconds", wait, reason="rate_limit")
+            time.sleep(wait)
+
+class ReplayAdapter(HTTPAdapter):
+    """Transport under a requests session for runs without the real API.
+
+    In "record" mode requests pass through and each exchange is appended to the
+    cassette (JSON lines, access tokens stripped); in "replay" mode responses come from
+    the cassette and nothing reaches the network. Identical requests are answered in
+    recorded order, the last response repeating, so a request retried after a throttled
+    answer, or a job status poll, sees the same sequence of answers as when it was recorded.
+    With a target, requests go to that base URL instead of the API host.
+    """
+    SECRET_PARAMS = {"access_token", "appsecret_proof", "input_token"}
+    DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "set-cookie"}
+    _lock = threading.Lock()
+    _cassettes = {}  # replay: path -> {key: deque of responses}
+    _recording = set()  # record: paths truncated by this process
+
+    def __init__(self, mode=None, cassette=None, target=None, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode
+        self.cassette = cassette
+        self.target = target.rstrip("/") if target else None
+        with self._lock:
+            if mode == "replay" and cassette not in self._cassettes:
+                recorded = defaultdict(deque)
+                with open(cassette, encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        recorded[entry["key"]].append(entry)
+                self._cassettes[cassette] = recorded
+            elif mode == "record" and cassette not in self._recording:
+                open(cassette, "w").close()
+                self._recording.add(cassette)
+
+    @classmethod
+    def request_key(cls, method, url, body=None):
+        """Method, path and sorted parameters of a request, without credentials or host"""
+        parts = urlsplit(url)
+        query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in cls.SECRET_PARAMS)
+        key = f"{method} {parts.path}?{urlencode(query)}"
+        if body:
+            body = body.decode("utf-8") if isinstance(body, bytes) else body
+            form = sorted((k, v) for k, v in parse_qsl(body, keep_blank_values=True) if k not in cls.SECRET_PARAMS)
+            key += " " + (urlencode(form) if form else body)
+        return key
+
+    def send(self, request, **kwargs):
+        key = self.request_key(request.method, request.url, request.body)
+        if self.mode == "replay":
+            with self._lock:
+                responses = self._cassettes[self.cassette].get(key)
+                entry = (responses.popleft() if len(responses) > 1 else responses[0]) if responses else None
+            if entry is None:
+                raise requests.exceptions.ConnectionError(f"No recorded response for {key}", request=request)
+            return self._replayed(request, entry)
+
+        if self.target:
+            parts = urlsplit(request.url)
+            request.url = self.target + parts.path + (f"?{parts.query}" if parts.query else "")
+        response = super().send(request, **kwargs)
+        if self.mode == "record":
+            entry = {
+                "key": key,
+                "status": response.status_code,
+                "headers": {k: v for k, v in response.headers.items() if k.lower() not in self.DROPPED_HEADERS},
+                "body": response.text,
+            }
+            with self._lock, open(self.cassette, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        return response
+
+    @staticmethod
+    def _replayed(request, entry):
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.reason = "Replayed"
+        response.url = request.url
+        response.request = request
+        return response
+
+def build_session(pool_size):
+    # one keep-alive pool shared by every worker thread, so pages reuse TLS connections
+    session = requests.Session()
+    if REPLAY_MODE or STANDIN_URL:
+        adapter = ReplayAdapter(REPLAY_MODE, REPLAY_CASSETTE, STANDIN_URL,
+                                pool_connections=pool_size, pool_maxsize=pool_size)
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.headers.update({"Access-Token": ACCESS_TOKEN, "Content-Type": "application/json"})
+    return session
+
+SESSION = build_session(MAX_WORKERS + PAGE_WORKERS)
+RATE_LIMITER = RateLimiter(MAX_QPS)
+# pages 2..N are leaf tasks on their own pool, so advertiser tasks waiting on them can't deadlock
+PAGE_POOL = ThreadPoolExecutor(max_workers=PAGE_WORKERS)
+
 # ---------- HELPERS ----------
 def get_default_date_range(days):
     # end = yesterday, start = end - (days-1)
-    end_dt = datetime.utcnow() - timedelta(days=)
-    start_dt = end_dt
+    end_dt = datetime.utcnow() - timedelta(days=1)
+    start_dt = end_dt - timedelta(days=days - 1)
     return start_dt.strftime("%Y-%m-%d"), end_dt.strftime("%Y-%m-%d")
 
 def build_url(path, query=""):
     scheme, netloc = "https", "business-api.tiktok.com"
     return urlunparse((scheme, netloc, path, "", query, ""))
 
-def get_json(url_path, params=None, max_retries=3):
-    headers = {"Access-Token": ACCESS_TOKEN, "Content-Type": "application/json"}
-    for attempt in range(max_retries):
+class TikTokApiError(Exception):
+    """A TikTok answer no retry will fix (bad parameters, permissions, auth)."""
+
+# 40100 is TikTok's QPS limit; codes from 50000 up are failures on TikTok's side
+THROTTLE_CODES = {40100}
+
+def get_json(url_path, params=None):
+    """GET a TikTok endpoint through RATE_LIMITER and RETRY_POLICY; returns the body of a code-0 answer or raises."""
+    if params:
+        # ensure list/dict params are JSON-encoded
+        q = urlencode({k: v if isinstance(v, string_types) else json.dumps(v) for k, v in params.items()})
+        url_with_params = build_url(url_path, q)
+    else:
+        url_with_params = build_url(url_path)
+
+    def send():
+        RATE_LIMITER.acquire()
+        RUN_METRICS.count("requests", endpoint=url_path)
         try:
-            if params:
-                # ensure list/dict params are JSON-encoded
-                q = urlencode({k: v if isinstance(v, string_types) else json.dumps(v) for k, v in params.items()})
-                url_with_params = build_url(url_path, q)
-            else:
-                url_with_params = build_url(url_path)
-            resp = requests.get(url_with_params, headers=headers, timeout=30)
-            resp.raise_for_status()
-            return resp.json()
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Request error (attempt {attempt+1}/{max_retries}): {e}")
-            if attempt == max_retries - 1:
-                return {"code": -1, "message": str(e)}
-            time.sleep(2 ** attempt)
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
-            return {"code": -1, "message": str(e)}
-    return {"code": -1, "message": "Unknown error"}
+            with RUN_METRICS.span("http", endpoint=url_path):
+                resp = SESSION.get(url_with_params, timeout=30)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            RUN_METRICS.count("request_errors", endpoint=url_path, status="network")
+            raise RetryableError(f"request failed: {e}") from e
+        RUN_METRICS.count("bytes", len(resp.content or b""), endpoint=url_path)
+        if resp.status_code == 429 or resp.status_code >= 500:
+            RUN_METRICS.count("request_errors", endpoint=url_path, status=resp.status_code)
+            raise RetryableError(f"HTTP {resp.status_code}", parse_retry_after(resp.headers),
+                                 throttled=resp.status_code == 429)
+        resp.raise_for_status()
+        body = resp.json()
+        code = body.get("code")
+        if code in THROTTLE_CODES or (isinstance(code, int) and code >= 50000):
+            RUN_METRICS.count("request_errors", endpoint=url_path, status=code)
+            raise RetryableError(f"code {code}: {body.get('message')}", parse_retry_after(resp.headers),
+                                 throttled=code in THROTTLE_CODES)
+        if code != 0:
+            raise TikTokApiError(f"{url_path} returned code {code}: {body.get('message')}")
+        return body
+
+    return RETRY_POLICY.call(urlsplit(url_with_params).netloc, send, url_path)
 
 def validate_response(resp, endpoint_name):
     if not isinstance(resp, dict):
@@ -76,62 +535,214 @@ def validate_response(resp, endpoint_name):
         return False
     return True
 
-def fetch_paginated_data(endpoint_path, base_params, data_key="list", advertiser_id=""):
+def _fetch_page(endpoint_path, base_params, page, data_key):
+    resp = get_json(endpoint_path, {**base_params, "page": page})
+    if not validate_response(resp, f"{endpoint_path} page {page}"):
+        return None, {}
+    data = resp.get("data", {})
+    return data.get(data_key, []), data.get("page_info", {})
+
+def iter_paginated_pages(endpoint_path, base_params, data_key="list", parallel=True, ordered=True):
+    """Yield each page's list of items.
+
+    Page 1 is fetched first to learn `total_page`; with `parallel`, pages 2..N are then
+    fetched concurrently on PAGE_POOL (still paced by RATE_LIMITER in get_json). Pages are
+    yielded in page order when `ordered`, otherwise as soon as each one arrives.
+    """
+    data_list, page_info = _fetch_page(endpoint_path, base_params, 1, data_key)
+    if not data_list:
+        return
+    yield data_list
+    total_page = page_info.get("total_page", 1)
+    if total_page <= 1:
+        return
+
+    if not parallel:
+        for page in range(2, total_page + 1):
+            data_list, _ = _fetch_page(endpoint_path, base_params, page, data_key)
+            if not data_list:
+                break
+            yield data_list
+        return
+
+    futures = [PAGE_POOL.submit(_fetch_page, endpoint_path, base_params, page, data_key)
+               for page in range(2, total_page + 1)]
+    try:
+        for fut in (futures if ordered else as_completed(futures)):
+            data_list, _ = fut.result()
+            if data_list:
+                yield data_list
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+def fetch_paginated_data(endpoint_path, base_params, data_key="list", advertiser_id="", parallel=True, ordered=True):
     all_data = []
-    page = 1
-    while True:
-        params = {**base_params, "page": page}
-        resp = get_json(endpoint_path, params)
-        if not validate_response(resp, endpoint_path):
-            break
-        data_list = resp.get("data", {}).get(data_key, [])
-        if not data_list:
-            break
-        all_data.extend(data_list)
-        page_info = resp.get("data", {}).get("page_info", {})
-        if page >= page_info.get("total_page", 1):
-            break
-        page += 1
-        time.sleep(0.15)
+    with RUN_METRICS.span("fetch_paginated_data", endpoint=endpoint_path, advertiser=advertiser_id) as span:
+        for data_list in iter_paginated_pages(endpoint_path, base_params, data_key, parallel, ordered):
+            all_data.extend(data_list)
+        span["rows"] = len(all_data)
     return all_data
 
+# ---------- METADATA CACHE ----------
+class MetadataCache:
+    """Per-advertiser campaign/adgroup/ad mappings persisted in SQLite between runs."""
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS entities (
+            advertiser_id TEXT, entity_type TEXT, entity_id TEXT, payload TEXT,
+            PRIMARY KEY (advertiser_id, entity_type, entity_id)) WITHOUT ROWID""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS refresh_state (
+            advertiser_id TEXT, entity_type TEXT, full_refresh_at REAL, refreshed_at REAL,
+            PRIMARY KEY (advertiser_id, entity_type))""")
+        self.conn.commit()
+
+    def load(self, advertiser_id, entity_type):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT entity_id, payload FROM entities WHERE advertiser_id = ? AND entity_type = ?",
+                (advertiser_id, entity_type)).fetchall()
+        return {entity_id: json.loads(payload) for entity_id, payload in rows}
+
+    def state(self, advertiser_id, entity_type):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT full_refresh_at, refreshed_at FROM refresh_state WHERE advertiser_id = ? AND entity_type = ?",
+                (advertiser_id, entity_type)).fetchone()
+
+    def store(self, advertiser_id, entity_type, mapping, refreshed_at=None, full=False):
+        # refreshed_at=None stores entities without touching the refresh bookkeeping
+        with self.lock:
+            if full:
+                self.conn.execute("DELETE FROM entities WHERE advertiser_id = ? AND entity_type = ?",
+                                  (advertiser_id, entity_type))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)",
+                [(advertiser_id, entity_type, k, json.dumps(v)) for k, v in mapping.items()])
+            if full:
+                self.conn.execute("INSERT OR REPLACE INTO refresh_state VALUES (?, ?, ?, ?)",
+                                  (advertiser_id, entity_type, refreshed_at, refreshed_at))
+            elif refreshed_at is not None:
+                self.conn.execute(
+                    "UPDATE refresh_state SET refreshed_at = ? WHERE advertiser_id = ? AND entity_type = ?",
+                    (refreshed_at, advertiser_id, entity_type))
+            self.conn.commit()
+
+METADATA_CACHE = None  # opened by run(), so importing the module creates no files
+
+def open_metadata_cache():
+    global METADATA_CACHE
+    if METADATA_CACHE is None and METADATA_CACHE_PATH:
+        METADATA_CACHE = MetadataCache(METADATA_CACHE_PATH)
+    return METADATA_CACHE
+
 # ---------- METADATA FETCH ----------
-def fetch_campaign_mapping(advertiser_id, page_size=500):
-    params = {
-        "advertiser_id": advertiser_id,
-        "page_size": page_size,
-        "fields": ["campaign_id", "campaign_name", "objective_type"]
+def _campaign_value(c):
+    return {"campaign_name": c.get("campaign_name"), "objective_type": c.get("objective_type")}
+
+def _adgroup_value(a):
+    return a.get("adgroup_name")
+
+def _ad_value(a):
+    return {
+        "ad_name": a.get("ad_name"),
+        "adgroup_id": str(a.get("adgroup_id")) if a.get("adgroup_id") is not None else None,
+        "campaign_id": str(a.get("campaign_id")) if a.get("campaign_id") is not None else None,
+        "status": a.get("operation_status")
     }
-    campaigns = fetch_paginated_data(CAMPAIGN_PATH, params, "list", advertiser_id)
-    return {str(c["campaign_id"]): {"campaign_name": c.get("campaign_name"), "objective_type": c.get("objective_type")} for c in campaigns}
+
+# entity_type -> (path, id field, requested fields, row -> mapping value)
+ENTITY_SPECS = {
+    "campaign": (CAMPAIGN_PATH, "campaign_id", ["campaign_id", "campaign_name", "objective_type"], _campaign_value),
+    "adgroup": (ADGROUP_PATH, "adgroup_id", ["adgroup_id", "adgroup_name"], _adgroup_value),
+    "ad": (AD_PATH, "ad_id", ["ad_id", "ad_name", "adgroup_id", "campaign_id", "operation_status"], _ad_value),
+}
+
+def fetch_entity_mapping(entity_type, advertiser_id, page_size=500):
+    """Return {entity_id: value} for an advertiser, served from METADATA_CACHE when possible.
+
+    Within METADATA_TTL_HOURS of the last full download only entities created since the
+    previous refresh are requested; after that the whole catalog is re-downloaded.
+    """
+    path, id_field, fields, to_value = ENTITY_SPECS[entity_type]
+    params = {"advertiser_id": advertiser_id, "page_size": page_size, "fields": fields}
+    started_at = time.time()
+    state = METADATA_CACHE.state(advertiser_id, entity_type) if METADATA_CACHE else None
+    full = state is None or started_at - state[0] >= METADATA_TTL_HOURS * 3600
+
+    if not full:
+        # overlap the previous refresh a little to cover clock skew and slow indexing
+        since = datetime.utcfromtimestamp(state[1] - 3600).strftime("%Y-%m-%d %H:%M:%S")
+        params["filtering"] = {"creation_filter_start_time": since}
+
+    rows = fetch_paginated_data(path, params, "list", advertiser_id)
+    fetched = {str(r[id_field]): to_value(r) for r in rows}
+    if not METADATA_CACHE:
+        return fetched
+
+    METADATA_CACHE.store(advertiser_id, entity_type, fetched, started_at, full)
+    if full:
+        logger.info(f"Adv {advertiser_id}: full {entity_type} refresh, {len(fetched)} entities cached")
+        return fetched
+    mapping = METADATA_CACHE.load(advertiser_id, entity_type)
+    logger.info(f"Adv {advertiser_id}: {len(fetched)} new {entity_type}s fetched, {len(mapping)} served from cache")
+    return mapping
+
+def fetch_entities_by_id(entity_type, advertiser_id, entity_ids, batch_size=100):
+    """Fetch specific entities (e.g. ones referenced by metrics but missing from the cache)."""
+    path, id_field, fields, to_value = ENTITY_SPECS[entity_type]
+    entity_ids = sorted(entity_ids)
+    fetched = {}
+    for i in range(0, len(entity_ids), batch_size):
+        params = {
+            "advertiser_id": advertiser_id,
+            "page_size": batch_size,
+            "fields": fields,
+            "filtering": {f"{entity_type}_ids": entity_ids[i:i + batch_size]}
+        }
+        for r in fetch_paginated_data(path, params, "list", advertiser_id):
+            fetched[str(r[id_field])] = to_value(r)
+    if METADATA_CACHE and fetched:
+        METADATA_CACHE.store(advertiser_id, entity_type, fetched)
+    return fetched
+
+def fill_missing_metadata(advertiser_id, raw_metrics, ad_map, campaign_map, adgroup_map):
+    # entities modified or created between cache refreshes can be referenced before they are cached
+    ad_ids = {str((r.get("dimensions") or {}).get("ad_id")) for r in raw_metrics} - {"None"} - ad_map.keys()
+    if ad_ids:
+        ad_map.update(fetch_entities_by_id("ad", advertiser_id, ad_ids))
+    campaign_ids = {m["campaign_id"] for m in ad_map.values() if m.get("campaign_id")} - campaign_map.keys()
+    if campaign_ids:
+        campaign_map.update(fetch_entities_by_id("campaign", advertiser_id, campaign_ids))
+    adgroup_ids = {m["adgroup_id"] for m in ad_map.values() if m.get("adgroup_id")} - adgroup_map.keys()
+    if adgroup_ids:
+        adgroup_map.update(fetch_entities_by_id("adgroup", advertiser_id, adgroup_ids))
+
+def fetch_campaign_mapping(advertiser_id, page_size=500):
+    return fetch_entity_mapping("campaign", advertiser_id, page_size)
 
 def fetch_adgroup_mapping(advertiser_id, page_size=500):
-    params = {
-        "advertiser_id": advertiser_id,
-        "page_size": page_size,
-        "fields": ["adgroup_id", "adgroup_name"]
-    }
-    adgroups = fetch_paginated_data(ADGROUP_PATH, params, "list", advertiser_id)
-    return {str(a["adgroup_id"]): a.get("adgroup_name") for a in adgroups}
+    return fetch_entity_mapping("adgroup", advertiser_id, page_size)
 
 def fetch_ad_mapping(advertiser_id, page_size=500):
-    params = {
-        "advertiser_id": advertiser_id,
-        "page_size": page_size,
-        "fields": ["ad_id", "ad_name", "adgroup_id", "campaign_id", "operation_status"]
-    }
-    ads = fetch_paginated_data(AD_PATH, params, "list", advertiser_id)
-    mapping = {}
-    for a in ads:
-        mapping[str(a["ad_id"])] = {
-            "ad_name": a.get("ad_name"),
-            "adgroup_id": str(a.get("adgroup_id")) if a.get("adgroup_id") is not None else None,
-            "campaign_id": str(a.get("campaign_id")) if a.get("campaign_id") is not None else None,
-            "status": a.get("operation_status")
-        }
-    return mapping
+    return fetch_entity_mapping("ad", advertiser_id, page_size)
+
+REPORT_MAX_DAYS = 30  # the report rejects longer date ranges
+
+def report_ranges(start_date, end_date, max_days=REPORT_MAX_DAYS):
+    """Split start_date..end_date into consecutive (start, end) ranges of at most max_days."""
+    days = date_range(start_date, end_date)
+    return [(days[i], days[min(i + max_days, len(days)) - 1]) for i in range(0, len(days), max_days)]
 
 def fetch_ad_metrics(advertiser_id, start_date, end_date, metrics, page_size=500):
+    # an advertiser that missed runs can be owed more days than one request may cover
+    rows = []
+    for range_start, range_end in report_ranges(start_date, end_date):
+        rows.extend(fetch_report_range(advertiser_id, range_start, range_end, metrics, page_size))
+    return rows
+
+def fetch_report_range(advertiser_id, start_date, end_date, metrics, page_size):
     params = {
         "advertiser_id": advertiser_id,
         "report_type": "BASIC",
@@ -220,52 +831,657 @@ def normalize_record(row, ad_mapping, campaign_mapping, adgroup_mapping, adverti
     }
     return merged
 
+EXPECTED_DIMS = ["campaign_name","campaign_id","adgroup_name","ad_id","ad_name",
+                 "adgroup_id","status","stat_time_day","country_code","objective_type"]
+EXPECTED_METRICS = ["complete_payment","total_complete_payment_rate","conversion","clicks","impressions","spend"]
+
+def _cast_id(val):
+    try:
+        return int(val)
+    except Exception:
+        return val
+
+def _to_bq_timestamp(sd):
+    if isinstance(sd, str) and len(sd) == 10 and sd.count("-") == 2:
+        try:
+            return datetime.strptime(sd, "%Y-%m-%d").strftime("%Y-%m-%dT00:00:00Z")
+        except Exception:
+            pass
+    return sd
+
+def _map_unique(series, func):
+    # apply func once per distinct value and gather the results back to rows; None stays None
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    values = np.empty(len(uniques) + 1, dtype=object)
+    values[:-1] = [func(u) for u in uniques]
+    values[-1] = None
+    return pd.Series(values[codes], index=series.index, dtype=object)
+
+def _coalesce(primary, fallback):
+    # vectorized `primary or fallback` for the None/"" values the mappings can hold
+    primary = pd.Series(primary.to_numpy(dtype=object), index=fallback.index, dtype=object)
+    return primary.where(primary.notna() & (primary != ""), fallback)
+
+def _as_objects(frame, columns):
+    frame = frame.astype(object)
+    frame = frame.where(frame.notna(), None)
+    for c in columns:
+        if c not in frame:
+            frame[c] = None
+    return frame
+
+def normalize_records_columnar(rows, ad_mapping, campaign_mapping, adgroup_mapping, advertiser_id, as_frame=False):
+    """Batch version of normalize_record that works on whole columns.
+
+    Joins against the three mappings are vectorized reindexes, and id casting and date
+    conversion run once per distinct value rather than once per row. Returns the same
+    records as normalize_record (dimension keys absent from a row come back as None), or
+    with as_frame=True a flat DataFrame of dimension and metric columns plus advertiser_id.
+    """
+    if not rows:
+        return pd.DataFrame(columns=EXPECTED_DIMS + EXPECTED_METRICS + ["advertiser_id"]) if as_frame else []
+
+    dims = _as_objects(pd.DataFrame.from_records([r.get("dimensions") or {} for r in rows]), EXPECTED_DIMS)
+    metrics = _as_objects(pd.DataFrame.from_records([r.get("metrics") or {} for r in rows]), EXPECTED_METRICS)
+
+    ad_table = pd.DataFrame.from_dict(ad_mapping, orient="index", columns=["ad_name", "adgroup_id", "campaign_id", "status"])
+    ad = ad_table.reindex(_map_unique(dims["ad_id"], str).to_numpy())
+
+    campaign_id = _coalesce(ad["campaign_id"], dims["campaign_id"])
+    campaign_table = pd.DataFrame.from_dict(campaign_mapping, orient="index", columns=["campaign_name", "objective_type"])
+    campaign = campaign_table.reindex(_map_unique(campaign_id, str).to_numpy())
+
+    dims["ad_name"] = _coalesce(ad["ad_name"], dims["ad_name"])
+    dims["adgroup_id"] = _coalesce(ad["adgroup_id"], dims["adgroup_id"])
+    dims["campaign_id"] = campaign_id
+    dims["campaign_name"] = _coalesce(campaign["campaign_name"], dims["campaign_name"])
+    dims["objective_type"] = _coalesce(campaign["objective_type"], dims["objective_type"])
+    # looked up with the raw adgroup_id, exactly like normalize_record
+    adgroup_table = pd.Series(adgroup_mapping, dtype=object)
+    dims["adgroup_name"] = _coalesce(adgroup_table.reindex(dims["adgroup_id"].to_numpy()), dims["adgroup_name"])
+    dims["status"] = _coalesce(ad["status"], dims["status"])
+
+    for id_field in ["campaign_id", "adgroup_id", "ad_id"]:
+        dims[id_field] = _map_unique(dims[id_field], _cast_id)
+    dims["stat_time_day"] = _map_unique(dims["stat_time_day"], _to_bq_timestamp)
+    adv_id_val = _cast_id(advertiser_id)
+
+    if as_frame:
+        frame = pd.concat([dims, metrics.drop(columns=[c for c in metrics if c in dims])], axis=1)
+        frame["advertiser_id"] = adv_id_val
+        return frame
+    # zip plain object arrays instead of DataFrame.to_dict, which boxes every cell
+    dim_cols, metric_cols = list(dims.columns), list(metrics.columns)
+    dim_rows = zip(*(dims[c].to_numpy(dtype=object) for c in dim_cols))
+    metric_rows = zip(*(metrics[c].to_numpy(dtype=object) for c in metric_cols))
+    return [
+        {"dimensions": dict(zip(dim_cols, d)), "metrics": dict(zip(metric_cols, m)), "advertiser_id": adv_id_val}
+        for d, m in zip(dim_rows, metric_rows)
+    ]
+
 def save_jsonl(records, filename):
     with open(filename, "w", encoding="utf-8") as f:
         for rec in records:
             f.write(json.dumps(rec, ensure_ascii=False) + "\n")
 
+# ---------- COLUMNAR OUTPUT & LOAD ----------
+# flat Parquet/BigQuery schema: dimension columns, metric columns, advertiser_id
+TIKTOK_SCHEMA = pa.schema([
+    ("advertiser_id", pa.int64()),
+    ("stat_time_day", pa.timestamp("s", tz="UTC")),
+    ("country_code", pa.string()),
+    ("campaign_id", pa.int64()), ("campaign_name", pa.string()), ("objective_type", pa.string()),
+    ("adgroup_id", pa.int64()), ("adgroup_name", pa.string()),
+    ("ad_id", pa.int64()), ("ad_name", pa.string()), ("status", pa.string()),
+    ("impressions", pa.int64()), ("clicks", pa.int64()), ("spend", pa.float64()),
+    ("conversion", pa.int64()), ("complete_payment", pa.int64()),
+    ("total_complete_payment_rate", pa.float64()),
+])
+
+def _parse_or_none(value, arrow_type):
+    try:
+        return pa.array([value], pa.string()).cast(arrow_type)[0].as_py()
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return None
+
+def frame_to_table(frame, schema=TIKTOK_SCHEMA):
+    columns = []
+    for field in schema:
+        values = frame[field.name].to_numpy(dtype=object) if field.name in frame else [None] * len(frame)
+        strings = [None if v is None or v == "" else str(v) for v in values]
+        if pa.types.is_string(field.type):
+            columns.append(pa.array(strings, pa.string()))
+            continue
+        if pa.types.is_timestamp(field.type) and field.type.tz:
+            # TikTok mixes "YYYY-MM-DD HH:MM:SS" and our "...T00:00:00Z"; both are UTC
+            strings = [v[:-1] if v and v.endswith("Z") else v for v in strings]
+            field = pa.field(field.name, pa.timestamp(field.type.unit))
+        try:
+            columns.append(pa.array(strings, pa.string()).cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # rare unparsable values (e.g. an id that stayed a string) become NULL instead of failing the file
+            parsed = [None if v is None else _parse_or_none(v, field.type) for v in strings]
+            logger.warning(f"{field.name}: {sum(1 for v, p in zip(strings, parsed) if v is not None and p is None)} unparsable values set to NULL")
+            columns.append(pa.array(parsed, field.type))
+    columns = [col.cast(f.type) for col, f in zip(columns, schema)]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def save_parquet(frames, filename, compression="zstd"):
+    rows = 0
+    with RUN_METRICS.span("write") as span, \
+            pq.ParquetWriter(filename, TIKTOK_SCHEMA, compression=compression) as writer:
+        for frame in frames:
+            if len(frame):
+                writer.write_table(frame_to_table(frame))
+                rows += len(frame)
+        span["rows"] = rows
+    return rows
+
+class BigQueryLoader:
+    """Batch-load an output file into a BigQuery table."""
+    SOURCE_FORMATS = {"jsonl": "NEWLINE_DELIMITED_JSON", "parquet": "PARQUET"}
+
+    def __init__(self, table_id):
+        from google.cloud import bigquery
+        self.bigquery = bigquery
+        self.client = bigquery.Client()
+        self.table_id = table_id
+
+    def load(self, path, output_format):
+        job_config = self.bigquery.LoadJobConfig(
+            source_format=self.SOURCE_FORMATS[output_format],
+            write_disposition=self.bigquery.WriteDisposition.WRITE_APPEND,
+            autodetect=output_format == "jsonl",
+        )
+        with open(path, "rb") as f:
+            job = self.client.load_table_from_file(f, self.table_id, job_config=job_config)
+        job.result()
+        return job.output_rows
+
+class LocalLoader:
+    """Filesystem stand-in for BigQueryLoader: each load appends a file to the table directory."""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, path, output_format):
+        shutil.copy(path, os.path.join(self.directory, os.path.basename(path)))
+        if output_format == "parquet":
+            return pq.ParquetFile(path).metadata.num_rows
+        with open(path, encoding="utf-8") as f:
+            return sum(1 for _ in f)
+
+def build_loader():
+    if BQ_TABLE:
+        return BigQueryLoader(BQ_TABLE)
+    if LOCAL_LOAD_DIR:
+        return LocalLoader(LOCAL_LOAD_DIR)
+    return None
+
+# ---------- INCREMENTAL STATE & PARTITIONS ----------
+class IncrementalState:
+    """Per-account high-water mark (last day fully written) persisted in SQLite."""
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS high_water (
+            account_id TEXT PRIMARY KEY, last_day TEXT, updated_at REAL)""")
+        self.conn.commit()
+
+    def window(self, account_id, end_date, lookback_days, initial_days):
+        """New days since the mark, widened to the trailing lookback (initial_days without a mark)."""
+        with self.lock:
+            row = self.conn.execute("SELECT last_day FROM high_water WHERE account_id = ?",
+                                    (account_id,)).fetchone()
+        end = datetime.strptime(end_date, "%Y-%m-%d").date()
+        if row is None:
+            start = end - timedelta(days=initial_days - 1)
+        else:
+            start = min(datetime.strptime(row[0], "%Y-%m-%d").date() + timedelta(days=1),
+                        end - timedelta(days=lookback_days - 1))
+        return start.isoformat(), end_date
+
+    def advance(self, account_id, last_day):
+        with self.lock:
+            self.conn.execute("""INSERT INTO high_water VALUES (?, ?, ?) ON CONFLICT (account_id) DO UPDATE SET
+                last_day = MAX(last_day, excluded.last_day), updated_at = excluded.updated_at""",
+                (account_id, last_day, time.time()))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def date_range(start_date, end_date):
+    start = datetime.strptime(start_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+class PartitionedWriter:
+    """Write platform/account/day partitions as size-capped, compressed shards plus a manifest.
+
+    Rows are buffered per (account, day) partition and cut into a shard whenever the
+    buffer passes `max_shard_bytes`; shards are serialized and compressed on a
+    background pool. Partitions are replaced, not appended to: `commit(account)` waits
+    for the account's shards, removes what earlier runs left in the partitions it
+    replaced and records the new shards in `_manifest.json` with row counts and
+    SHA-256 checksums, so loaders can pick up only the partitions that changed.
+    Shard writes are timed on `metrics` (a RunMetrics).
+    """
+
+    JSONL_EXTENSIONS = {"gzip": "jsonl.gz", "zstd": "jsonl.zst", None: "jsonl"}
+
+    def __init__(self, root, platform, output_format, max_shard_bytes=128 * 1024 * 1024, compression="gzip",
+                 workers=4, metrics=None):
+        self.root = os.path.join(root, f"platform={platform}")
+        self.platform = platform
+        self.output_format = output_format
+        self.max_shard_bytes = max_shard_bytes
+        # Parquet shards are always zstd inside the file; JSONL shards are compressed whole
+        self.compression = None if output_format == "parquet" else compression
+        self.extension = "parquet" if output_format == "parquet" else self.JSONL_EXTENSIONS[self.compression]
+        self.run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+        self.changed = []
+        self.metrics = metrics or RunMetrics(platform)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self._buffers = {}  # (account, day) -> [batches, buffered bytes]
+        self._shards = defaultdict(list)  # (account, day) -> shard futures
+        self._replaced = defaultdict(set)  # account -> days rewritten by this run
+        self._manifest_path = os.path.join(self.root, "_manifest.json")
+        self.manifest = {"platform": platform, "partitions": {}}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def partition_dir(self, account_id, day):
+        return os.path.join(self.root, f"account={account_id}", f"day={day}")
+
+    def replace(self, account_id, days):
+        """Mark the account's partitions for `days` as rewritten by this run, rows or not"""
+        with self.lock:
+            self._replaced[account_id].update(days)
+
+    def write(self, account_id, day, batch):
+        """Buffer a batch for a partition: an Arrow table for parquet, JSON lines for jsonl"""
+        parquet = self.output_format == "parquet"
+        rows = batch.num_rows if parquet else len(batch)
+        size = batch.nbytes if parquet else sum(len(line) for line in batch)
+        # Batches bigger than a shard are cut up so every shard stays near max_shard_bytes
+        step = -(-rows // max(1, -(-size // self.max_shard_bytes))) or 1
+        with self.lock:
+            self._replaced[account_id].add(day)
+            for offset in range(0, rows, step):
+                piece = batch.slice(offset, step) if parquet else batch[offset:offset + step]
+                buffer = self._buffers.setdefault((account_id, day), [[], 0])
+                buffer[0].append(piece)
+                buffer[1] += size * min(step, rows - offset) // rows
+                if buffer[1] >= self.max_shard_bytes:
+                    self._submit(account_id, day)
+
+    def _submit(self, account_id, day):
+        # Caller holds the lock
+        batches, _ = self._buffers.pop((account_id, day))
+        shards = self._shards[(account_id, day)]
+        name = f"part-{self.run_id}-{len(shards):05d}.{self.extension}"
+        shards.append(self._pool.submit(self._write_shard, os.path.join(self.partition_dir(account_id, day), name),
+                                        batches))
+
+    def _write_shard(self, path, batches):
+        with self.metrics.span("write_shard") as span:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            if self.output_format == "parquet":
+                table = pa.concat_tables(batches)
+                pq.write_table(table, tmp_path, compression="zstd")
+                rows = table.num_rows
+            else:
+                rows = sum(len(batch) for batch in batches)
+                stream = (pa.CompressedOutputStream(tmp_path, self.compression) if self.compression
+                          else pa.OSFile(tmp_path, "wb"))
+                with stream:
+                    for batch in batches:
+                        stream.write("".join(batch).encode("utf-8"))
+            digest = hashlib.sha256()
+            with open(tmp_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            os.replace(tmp_path, path)
+            span["rows"] = rows
+        return {"path": os.path.relpath(path, self.root), "rows": rows,
+                "bytes": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+    def commit(self, account_id):
+        """Finish the account's shards and swap them in for its previous partitions.
+
+        Returns the rows written per replaced day. If any shard fails, the shards this
+        run already wrote for the account are removed and the old partitions stay.
+        """
+        with self.lock:
+            for key in [key for key in self._buffers if key[0] == account_id]:
+                self._submit(*key)
+            days = sorted(self._replaced.pop(account_id, ()))
+            futures = {day: self._shards.pop((account_id, day), []) for day in days}
+
+        try:
+            shards = {day: [future.result() for future in day_futures] for day, day_futures in futures.items()}
+        except Exception:
+            self._remove_shards(future for day_futures in futures.values() for future in day_futures)
+            raise
+
+        written = {}
+        with self.lock:
+            for day, day_shards in shards.items():
+                directory = self.partition_dir(account_id, day)
+                keep = {os.path.basename(shard["path"]) for shard in day_shards}
+                if os.path.isdir(directory):
+                    for name in os.listdir(directory):
+                        if name not in keep:
+                            os.remove(os.path.join(directory, name))
+                    if not keep:
+                        os.rmdir(directory)
+                key = f"account={account_id}/day={day}"
+                written[day] = sum(shard["rows"] for shard in day_shards)
+                if day_shards:
+                    self.manifest["partitions"][key] = {"account": account_id, "date": day, "run_id": self.run_id,
+                                                        "rows": written[day], "shards": day_shards}
+                else:
+                    self.manifest["partitions"].pop(key, None)
+                self.changed.append(key)
+            self._save_manifest()
+        return written
+
+    def discard(self, account_id):
+        """Drop what this run buffered or wrote for the account; its previous partitions stay"""
+        with self.lock:
+            for key in [key for key in self._buffers if key[0] == account_id]:
+                del self._buffers[key]
+            self._replaced.pop(account_id, None)
+            futures = [future for key in [key for key in self._shards if key[0] == account_id]
+                       for future in self._shards.pop(key)]
+        self._remove_shards(futures)
+
+    def _remove_shards(self, futures):
+        for future in futures:
+            if future.exception() is None:
+                os.remove(os.path.join(self.root, future.result()["path"]))
+
+    def _save_manifest(self):
+        # Caller holds the lock
+        os.makedirs(self.root, exist_ok=True)
+        self.manifest["updated_at"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        with open(self._manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(self._manifest_path + ".tmp", self._manifest_path)
+
+    def close(self):
+        with self.lock:
+            pending = {account_id for account_id, _ in self._buffers} | set(self._replaced)
+        for account_id in pending:
+            self.commit(account_id)
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(cancel_futures=True)
+
+def partition_writer(root, output_format):
+    return PartitionedWriter(root, "tiktok", output_format, SHARD_MAX_BYTES, JSONL_COMPRESSION,
+                             COMPRESSION_WORKERS, RUN_METRICS)
+
+# ---------- FACT TABLE ----------
+# one typed row per (day, ad, country, attribution window) with the same columns and
+# units in all three pipelines, so dashboards scan a single table
+FACT_SCHEMA = pa.schema([
+    ("date", pa.date32()), ("platform", pa.string()), ("account_id", pa.string()),
+    ("campaign_id", pa.string()), ("adgroup_id", pa.string()), ("ad_id", pa.string()),
+    ("country", pa.string()), ("attribution_window", pa.string()),
+    # Money is in major units of the account currency (never cents or micros)
+    ("spend", pa.float64()), ("impressions", pa.int64()), ("clicks", pa.int64()),
+    ("purchases", pa.int64()), ("purchase_value", pa.float64()),
+])
+# the window fetch_ad_metrics requests
+REPORT_ATTRIBUTION_WINDOW = "7d_click_1d_view"
+
+def fact_table(platform, num_rows, columns):
+    """Build a FACT_SCHEMA table from conformed columns; columns not given are null"""
+    columns = dict(columns, platform=pa.repeat(pa.scalar(platform), num_rows))
+    return pa.Table.from_arrays([pc.cast(columns[field.name], field.type, safe=False) if field.name in columns
+                                 else pa.nulls(num_rows, field.type) for field in FACT_SCHEMA], schema=FACT_SCHEMA)
+
+def tiktok_facts(table):
+    """Conform a TIKTOK_SCHEMA table to FACT_SCHEMA"""
+    return fact_table("tiktok", table.num_rows, {
+        "date": pc.cast(table["stat_time_day"], pa.date32()), "account_id": table["advertiser_id"],
+        "campaign_id": table["campaign_id"], "adgroup_id": table["adgroup_id"], "ad_id": table["ad_id"],
+        "country": pc.utf8_upper(table["country_code"]),
+        "attribution_window": pa.repeat(pa.scalar(REPORT_ATTRIBUTION_WINDOW), table.num_rows),
+        "spend": table["spend"], "impressions": table["impressions"], "clicks": table["clicks"],
+        # despite its name, total_complete_payment_rate is the total value of the complete payments
+        "purchases": table["complete_payment"], "purchase_value": table["total_complete_payment_rate"],
+    })
+
+def records_to_frame(records):
+    # nested normalize_record output -> the flat columns frame_to_table expects
+    return pd.DataFrame.from_records([{**rec["dimensions"], **rec["metrics"], "advertiser_id": rec["advertiser_id"]}
+                                      for rec in records])
+
+def tiktok_day_parts(merged, days):
+    """(day, rows, to_facts) per day of the merged report, for write_day_partitions."""
+    if OUTPUT_FORMAT == "parquet":
+        row_days = merged["stat_time_day"].map(lambda v: str(v)[:10] if v else None)
+        for day in days:
+            part = merged[(row_days == day).to_numpy()]
+            if len(part):
+                table = frame_to_table(part)
+                yield day, table, lambda table=table: tiktok_facts(table)
+    else:
+        by_day = defaultdict(list)
+        for rec in merged:
+            by_day[str(rec["dimensions"].get("stat_time_day") or "")[:10]].append(rec)
+        for day in days:
+            if by_day.get(day):
+                yield (day, [json.dumps(rec, ensure_ascii=False) + "\n" for rec in by_day[day]],
+                       lambda recs=by_day[day]: tiktok_facts(frame_to_table(records_to_frame(recs))))
+
+def write_day_partitions(writer, account_id, day_parts, days, facts=None):
+    """Replace the account's partition for every day in `days` with the rows of `day_parts`.
+
+    `day_parts` yields (day, rows, to_facts) for each piece of a day: `rows` as
+    `writer.write` takes them (a table or JSONL lines) and `to_facts()` building the
+    piece's fact-table rows. Days without rows drop any earlier partition. With a
+    `facts` writer the same days of the fact table are replaced too; `writer` may be
+    None to build only the facts. Returns the number of rows written per day.
+    """
+    writers = [w for w in (writer, facts) if w is not None]
+    for w in writers:
+        w.replace(account_id, days)
+    wanted = set(days)
+    try:
+        for day, rows, to_facts in day_parts:
+            if day in wanted:
+                if writer:
+                    writer.write(account_id, day, rows)
+                if facts:
+                    facts.write(account_id, day, to_facts())
+        return [w.commit(account_id) for w in writers][0]
+    except Exception:
+        # Also undoes the fact shards when only the output commit went through
+        for w in writers:
+            w.discard(account_id)
+        raise
+
 # ---------- MAIN ----------
-def main():
-    if not ACCESS_TOKEN or not ADVERTISER_IDS:
-        logger.error("Missing TIKTOK_ACCESS_TOKEN or TIKTOK_ADVERTISER_IDS environment variables.")
-        return 1
+def run(start_date, end_date, account_windows=None, state=None):
+    """Extract every advertiser for start_date..end_date, write the output and return the run summary.
 
-    start_date, end_date = get_default_date_range(REPORT_DAYS)
+    account_windows gives advertisers their own (start, end) inside the range. With an
+    IncrementalState (or OUTPUT_LAYOUT "partitioned"), each advertiser replaces its day
+    partitions as soon as it is merged instead of going into one combined file; with a
+    state its high-water mark advances too.
+    """
+    started = time.time()
+    RUN_METRICS.reset()
+    open_metadata_cache()
+    account_windows = account_windows or {adv: (start_date, end_date) for adv in ADVERTISER_IDS}
     METRICS = ["impressions", "clicks", "spend", "conversion", "complete_payment", "total_complete_payment_rate"]
 
-    all_final = []
-    for adv in ADVERTISER_IDS:
-        logger.info(f"Processing advertiser {adv} for {start_date} to {end_date}")
-        try:
-            campaign_map = fetch_campaign_mapping(adv)
-            adgroup_map = fetch_adgroup_mapping(adv)
-            ad_map = fetch_ad_mapping(adv)
-            raw_metrics = fetch_ad_metrics(adv, start_date, end_date, METRICS)
+    # every (advertiser, endpoint) fetch is an independent task on one bounded pool
+    tasks = {
+        "campaign_map": fetch_campaign_mapping,
+        "adgroup_map": fetch_adgroup_mapping,
+        "ad_map": fetch_ad_mapping,
+        "raw_metrics": lambda adv: fetch_ad_metrics(adv, *account_windows[adv], METRICS),
+    }
+    results = {adv: {} for adv in account_windows}
+    partitioned = state is not None or OUTPUT_LAYOUT == "partitioned"
+    writer = partition_writer(PARTITION_DIR, OUTPUT_FORMAT) if partitioned else None
+    facts = partition_writer(FACT_DIR, "parquet") if FACT_DIR else None
+    failed = set()
+    merged_by_adv = {}
+    published = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {}
+        for adv, (adv_start, adv_end) in account_windows.items():
+            logger.info(f"Queueing advertiser {adv} for {adv_start} to {adv_end}")
+            for name, fn in tasks.items():
+                futures[executor.submit(fn, adv)] = (adv, name)
+
+        for fut in as_completed(futures):
+            adv, name = futures[fut]
+            if adv in failed:
+                continue
+            try:
+                results[adv][name] = fut.result()
+            except Exception as e:
+                logger.exception(f"Failed processing advertiser {adv} ({name}): {e}")
+                failed.add(adv)
+                continue
+            if len(results[adv]) < len(tasks):
+                continue
 
             # Merge and normalize (do NOT drop rows if metadata missing)
-            for r in raw_metrics:
-                merged = normalize_record(r, ad_map, campaign_map, adgroup_map, adv)
-                all_final.append(merged)
+            res = results.pop(adv)
+            try:
+                fill_missing_metadata(adv, res["raw_metrics"], res["ad_map"], res["campaign_map"], res["adgroup_map"])
+            except Exception as e:
+                logger.warning(f"Adv {adv}: could not fill missing metadata: {e}")
+            with RUN_METRICS.span("normalize", advertiser=adv) as span:
+                merged = normalize_records_columnar(
+                    res["raw_metrics"], res["ad_map"], res["campaign_map"], res["adgroup_map"], adv,
+                    as_frame=OUTPUT_FORMAT == "parquet")
+                span["rows"] = len(merged)
+            logger.info(f"Adv {adv}: metrics rows fetched {len(res['raw_metrics'])} merged -> {len(merged)}")
+            adv_start, adv_end = account_windows[adv]
+            days = date_range(adv_start, adv_end)
+            if not partitioned:
+                merged_by_adv[adv] = merged
+                if facts:
+                    try:
+                        write_day_partitions(None, adv, tiktok_day_parts(merged, days), days, facts)
+                    except Exception as e:
+                        logger.exception(f"Adv {adv}: failed writing fact partitions: {e}")
+                continue
+            try:
+                written = write_day_partitions(writer, adv, tiktok_day_parts(merged, days), days, facts)
+            except Exception as e:
+                logger.exception(f"Adv {adv}: failed writing partitions: {e}")
+                failed.add(adv)
+                continue
+            if state is not None:
+                state.advance(adv, adv_end)
+            published[adv] = sum(written.values())
+            logger.info(f"Adv {adv}: replaced {len(written)} day partitions ({adv_start} to {adv_end})")
 
-            logger.info(f"Adv {adv}: metrics rows fetched {len(raw_metrics)} merged -> {len(all_final)} total")
-        except Exception as e:
-            logger.exception(f"Failed processing advertiser {adv}: {e}")
-            continue
-        time.sleep(0.5)
+    if facts:
+        facts.close()
+    if partitioned:
+        writer.close()
+        return write_run_report({
+            "platform": "tiktok",
+            "start_date": start_date,
+            "end_date": end_date,
+            "accounts": len(account_windows),
+            "failed_accounts": [adv for adv in account_windows if adv not in published],
+            "rows": sum(published.values()),
+            "output": PARTITION_DIR,
+            "seconds": round(time.time() - started, 1),
+        })
 
     # final file
-    filename = f"tiktok_ad_report_{start_date}_to_{end_date}.jsonl"
-    save_jsonl(all_final, filename)
-    logger.info(f"Wrote {len(all_final)} rows to {filename}")
-    # quick sanity prints
-    if len(all_final) > 0:
-        sample_dims = list(all_final[0]["dimensions"].keys())
-        logger.info(f"Sample dimension keys: {sample_dims}")
-        # check country_code presence fraction
-        with_country = sum(1 for r in all_final if r["dimensions"].get("country_code") not in (None, "", []))
-        logger.info(f"country_code present in {with_country}/{len(all_final)} rows")
-    print(filename)
+    filename = f"tiktok_ad_report_{start_date}_to_{end_date}.{OUTPUT_FORMAT}"
+    if OUTPUT_FORMAT == "parquet":
+        frames = [merged_by_adv[adv] for adv in account_windows if adv in merged_by_adv]
+        total_rows = save_parquet(frames, filename)
+        # quick sanity prints
+        if total_rows > 0:
+            logger.info(f"Columns: {TIKTOK_SCHEMA.names}")
+            with_country = sum(int(f["country_code"].map(lambda c: c not in (None, "", [])).sum()) for f in frames)
+            logger.info(f"country_code present in {with_country}/{total_rows} rows")
+    else:
+        all_final = [rec for adv in account_windows for rec in merged_by_adv.get(adv, [])]
+        with RUN_METRICS.span("write") as span:
+            save_jsonl(all_final, filename)
+            span["rows"] = len(all_final)
+        total_rows = len(all_final)
+        # quick sanity prints
+        if len(all_final) > 0:
+            sample_dims = list(all_final[0]["dimensions"].keys())
+            logger.info(f"Sample dimension keys: {sample_dims}")
+            # check country_code presence fraction
+            with_country = sum(1 for r in all_final if r["dimensions"].get("country_code") not in (None, "", []))
+            logger.info(f"country_code present in {with_country}/{len(all_final)} rows")
+    logger.info(f"Wrote {total_rows} rows to {filename}")
+
+    loader = build_loader()
+    if loader and total_rows:
+        try:
+            logger.info(f"Loaded {loader.load(filename, OUTPUT_FORMAT)} rows from {filename}")
+        except Exception as e:
+            logger.exception(f"Failed to load {filename}: {e}")
+
+    return write_run_report({
+        "platform": "tiktok",
+        "start_date": start_date,
+        "end_date": end_date,
+        "accounts": len(account_windows),
+        "failed_accounts": [adv for adv in account_windows if adv not in merged_by_adv],
+        "rows": total_rows,
+        "output": filename,
+        "seconds": round(time.time() - started, 1),
+    })
+
+def write_run_report(summary):
+    if RUN_REPORT_PATH:
+        RUN_METRICS.write(RUN_REPORT_PATH, PROMETHEUS_TEXTFILE, summary)
+        logger.info(f"Run report written to {RUN_REPORT_PATH}")
+    return summary
+
+def main():
+    if not ACCESS_TOKEN or not ADVERTISER_IDS:
+        logger.error("Missing TIKTOK_ACCESS_TOKEN or TIKTOK_ADVERTISER_IDS environment variables.")
+        return 1
+
+    if INCREMENTAL:
+        state = IncrementalState(STATE_DB_PATH)
+        try:
+            end_date = get_default_date_range(1)[1]
+            windows = {adv: state.window(adv, end_date, LOOKBACK_DAYS, INITIAL_DAYS) for adv in ADVERTISER_IDS}
+            summary = run(min(start for start, _ in windows.values()), end_date, windows, state)
+        finally:
+            state.close()
+    else:
+        start_date, end_date = get_default_date_range(REPORT_DAYS)
+        summary = run(start_date, end_date)
+    if summary["failed_accounts"]:
+        logger.warning(f"Failed advertisers: {summary['failed_accounts']}")
+    logger.info(f"Finished {summary['accounts']} advertisers in {summary['seconds']}s")
+    print(summary["output"])
     return 0
 
 if __name__ == "__main__":